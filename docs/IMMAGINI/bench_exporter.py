@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark dell'esportazione Smartsheet (smartsheet_export.py) senza rete né token
+Avvia fake_smartsheet_server.py in locale, esegue SheetImageExporter sul foglio sintetico
+per ogni combinazione di download paralleli (--workers) e imageId per richiesta (--batch)
+e salva i risultati in JSON.
+
+Metriche per caso: righe/s, immagini/s, MB/s scaricati, tempo al primo file, durata totale;
+richieste, ritentativi, 429 e attese per limite dello scheduler; pagine, richieste URL ed
+errori iniettati visti dal server. Ogni caso parte con cartella di destinazione vuota.
+
+Le latenze e gli errori del server finto simulano il servizio reale: con --api-latency,
+--image-latency e --fail-429/--fail-5xx si provano concorrenza e lotti senza consumare il
+limite di frequenza del token. --api-rate è il limite applicato dallo scheduler (come in
+produzione); --rate-limit quello imposto dal server.
+
+Dipendenze: requests, Pillow (PIL).
+
+Uso:
+    python bench_exporter.py --rows 5000 --api-latency 0.2 --image-latency 0.05 --workers 4 8 16 --batch 40 80
+    python bench_exporter.py --rows 2000 --fail-429 0.02 --fail-5xx 0.01 -o risultati.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+import requests
+
+import smartsheet_export
+from smartsheet_export import (
+    SheetImageExporter, RequestScheduler, make_session, API_RATE_PER_MINUTE, BACKOFF_BASE, DOWNLOAD_WORKERS,
+    URL_BATCH, MAX_DOWNLOAD_WORKERS,
+)
+from fake_smartsheet_server import (
+    FakeSmartsheetServer, FakeSheetConfig, IMAGE_COLUMN_ID, NAME_COLUMN_ID, add_config_arguments, config_from_args,
+)
+from web_image_pipeline import write_json_atomic
+
+BENCH_VERSION = 1
+TOKEN = "bench-token"
+
+
+# ---------------- Esecuzione ----------------
+def run_case(server: FakeSmartsheetServer, workers: int, batch: int, api_rate: float = API_RATE_PER_MINUTE,
+             backoff: float = BACKOFF_BASE) -> Dict[str, Any]:
+    """Un'esportazione completa del foglio finto in una cartella temporanea."""
+    server.reset_stats()
+    stop_flag = threading.Event()
+    http = RequestScheduler(make_session(workers), stop_flag=stop_flag, rate_per_minute=api_rate, backoff_base=backoff)
+    ok = failed = nbytes = 0
+    first: Optional[float] = None
+    with tempfile.TemporaryDirectory(prefix="bench_exporter_") as tmp:
+        exporter = SheetImageExporter(TOKEN, server.config.sheet_id, IMAGE_COLUMN_ID, NAME_COLUMN_ID, Path(tmp),
+                                      workers=workers, batch=batch, stop_flag=stop_flag, session=http)
+        t0 = time.perf_counter()
+        try:
+            for res in exporter.run():
+                if res.ok:
+                    ok += 1
+                    nbytes += res.bytes
+                    if first is None:
+                        first = time.perf_counter() - t0
+                else:
+                    failed += 1
+        finally:
+            elapsed = time.perf_counter() - t0
+            exporter.close()
+            http.close()
+    sched = http.stats()
+    srv = server.stats()
+    return {
+        "workers": workers,
+        "batch": batch,
+        "rows": exporter.rows,
+        "images": exporter.images,
+        "ok": ok,
+        "failed": failed,
+        "bytes": nbytes,
+        "elapsed_s": round(elapsed, 3),
+        "first_file_s": round(first, 3) if first is not None else None,
+        "rows_per_s": round(exporter.rows / elapsed, 1) if elapsed else 0.0,
+        "images_per_s": round(ok / elapsed, 2) if elapsed else 0.0,
+        "mb_per_s": round(nbytes / elapsed / 2**20, 2) if elapsed else 0.0,
+        "url_requests": exporter.url_requests,
+        "scheduler": {k: sched[k] for k in ("requests", "retries", "throttled", "failures", "throttle_wait_s")},
+        "server": srv,
+    }
+
+def run_suite(config: FakeSheetConfig, workers=(DOWNLOAD_WORKERS,), batches=(URL_BATCH,),
+              api_rate: float = API_RATE_PER_MINUTE, backoff: float = BACKOFF_BASE) -> Dict[str, Any]:
+    cases = {}
+    api_base = smartsheet_export.API_BASE
+    with FakeSmartsheetServer(config) as server:
+        smartsheet_export.API_BASE = server.api_base
+        try:
+            for w in workers:
+                for b in batches:
+                    name = f"w{w}-b{b}"
+                    r = cases[name] = run_case(server, w, b, api_rate, backoff)
+                    first = f"{r['first_file_s']:.2f} s" if r["first_file_s"] is not None else "-"
+                    print(f"{name:<10}{r['rows_per_s']:>9.1f} righe/s{r['images_per_s']:>9.1f} img/s"
+                          f"{r['mb_per_s']:>8.2f} MB/s  primo file {first:>8}  totale {r['elapsed_s']:>7.2f} s"
+                          f"  ritentativi {r['scheduler']['retries']}  errori {r['failed']}", file=sys.stderr)
+        finally:
+            smartsheet_export.API_BASE = api_base
+    return {
+        "version": BENCH_VERSION,
+        "env": {
+            "python": platform.python_version(),
+            "requests": requests.__version__,
+            "platform": platform.platform(),
+        },
+        "server": {k: v for k, v in vars(config).items()},
+        "api_rate_per_minute": api_rate,
+        "cases": cases,
+    }
+
+
+# ---------------- CLI ----------------
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(description="Benchmark dell'esportazione Smartsheet su un server finto locale.")
+    p.add_argument("-o", "--output", type=Path, help="file JSON dei risultati (default: stdout)")
+    p.add_argument("--workers", type=int, nargs="+", default=[DOWNLOAD_WORKERS], help="download paralleli da provare")
+    p.add_argument("--batch", type=int, nargs="+", default=[URL_BATCH], help="imageId per richiesta /imageurls")
+    p.add_argument("--api-rate", type=float, default=API_RATE_PER_MINUTE, help="limite al minuto dello scheduler")
+    p.add_argument("--backoff", type=float, default=BACKOFF_BASE, help="base del backoff dei ritentativi (s)")
+    add_config_arguments(p)
+    args = p.parse_args(argv)
+
+    if any(not 1 <= w <= MAX_DOWNLOAD_WORKERS for w in args.workers) or any(b < 1 for b in args.batch):
+        print(f"Errore: workers tra 1 e {MAX_DOWNLOAD_WORKERS}, batch >= 1", file=sys.stderr)
+        return 2
+    try:
+        config = config_from_args(args)
+        config.validate()
+    except ValueError as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 2
+    results = run_suite(config, args.workers, args.batch, args.api_rate, args.backoff)
+    if args.output:
+        write_json_atomic(args.output, results)
+        print(f"Risultati: {args.output}")
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark memoria - rimozione metadata
+Confronta la rimozione metadata attuale (parametri encoder, web_image_pipeline.py) con il
+metodo precedente (copia dei pixel via list(getdata()) + putdata) sulla stessa cartella.
+
+Ogni metodo viene eseguito in un processo separato: il picco di RSS misurato riguarda solo
+quel metodo. Per ogni metodo stampa tempo totale, picco RSS e dimensione della bitmap più
+grande elaborata.
+
+Dipendenze: Pillow (PIL); psutil solo su Windows (per il picco di memoria)
+
+Uso:
+    python bench_metadata_memory.py                      # cartella di default: questa (ritratti)
+    python bench_metadata_memory.py CARTELLA --long-side 4000 --format JPEG
+"""
+
+import io
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+from PIL import Image
+
+from web_image_pipeline import (
+    ResizeSettings, STRIP_META_PARAMS, collect_files, decode_image, to_srgb, resize_scale, prepare_for_encode,
+)
+
+METHODS = ("encoder", "legacy")
+
+
+def peak_rss_bytes(children: bool = False) -> int:
+    """Picco RSS del processo; children=True: del processo figlio (terminato) più grande."""
+    try:
+        import resource
+        who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+        peak = resource.getrusage(who).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # Linux: KB
+    except ImportError:  # Windows
+        if children:
+            return 0
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+
+def _legacy_remove_metadata(img):
+    # Metodo precedente: una tupla Python per pixel
+    data = list(img.getdata())
+    clean = Image.new(img.mode, img.size)
+    clean.putdata(data)
+    return clean
+
+def _run_method(method: str, src: Path, settings: ResizeSettings) -> dict:
+    files = collect_files(src)
+    base_rss = peak_rss_bytes()
+    max_bitmap = 0
+    t0 = time.perf_counter()
+    for path in files:
+        img, source_size = decode_image(path, settings)
+        img = resize_scale(to_srgb(img, settings), settings, source_size)
+        max_bitmap = max(max_bitmap, img.width * img.height * len(img.getbands()))
+        img, params = prepare_for_encode(img, settings)
+        if method == "legacy":
+            img = _legacy_remove_metadata(img)
+            params = {k: v for k, v in params.items() if k not in STRIP_META_PARAMS}
+        img.save(io.BytesIO(), format=settings.format, **params)  # encode in memoria, nessun file scritto
+    elapsed = time.perf_counter() - t0
+    return {
+        "method": method,
+        "files": len(files),
+        "seconds": round(elapsed, 3),
+        "peak_rss_mb": round(peak_rss_bytes() / 2**20, 1),
+        "baseline_rss_mb": round(base_rss / 2**20, 1),
+        "max_bitmap_mb": round(max_bitmap / 2**20, 1),
+    }
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Confronto memoria/tempo della rimozione metadata.")
+    p.add_argument("src", nargs="?", type=Path, default=Path(__file__).resolve().parent)
+    p.add_argument("--long-side", type=int, default=1600, help="lato lungo di destinazione (px)")
+    p.add_argument("--format", type=str.upper, choices=("WEBP", "JPEG", "PNG"), default="JPEG")
+    p.add_argument("--worker", choices=METHODS, help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    settings = ResizeSettings(long_side=args.long_side, format=args.format, strip_meta=True).validate()
+    if args.worker:
+        print(json.dumps(_run_method(args.worker, args.src, settings)))
+        return 0
+
+    results = []
+    for method in METHODS:
+        cmd = [sys.executable, str(Path(__file__).resolve()), str(args.src),
+               "--long-side", str(args.long_side), "--format", args.format, "--worker", method]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"Cartella: {args.src}  (lato lungo {args.long_side}px, {args.format})")
+    print(f"{'metodo':<10}{'file':>6}{'tempo s':>10}{'picco RSS MB':>14}{'max bitmap MB':>15}")
+    for r in results:
+        print(f"{r['method']:<10}{r['files']:>6}{r['seconds']:>10}{r['peak_rss_mb']:>14}{r['max_bitmap_mb']:>15}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
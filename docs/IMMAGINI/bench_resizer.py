@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark riproducibile del ridimensionamento (web_image_pipeline.py)
+Genera un corpus sintetico deterministico, esegue la pipeline su ogni combinazione
+modalità (scale/exact) x formato (JPEG/PNG/WEBP) e salva i risultati in JSON; il comando
+compare confronta due risultati e segnala le regressioni.
+
+Corpus (stesso seed -> stessi pixel, stessi parametri di codifica):
+- ritratti 600x800 PNG/JPEG (come quelli dell'organigramma), con e senza profilo ICC
+- foto "fotocamera" 4000x3000 JPEG con orientamento EXIF 6/8 e profilo ICC, TIFF non compressi
+Ogni caso gira in un processo separato: il picco di RSS riguarda solo quel caso.
+
+Metriche per caso: immagini/s (migliore tra le ripetizioni), latenza per immagine
+p50/p95/p99 (tutte le ripetizioni), tempo per fase (p50), picco RSS.
+
+Dipendenze: Pillow (PIL); psutil solo su Windows (per il picco di memoria). Nessun accesso di rete.
+
+Uso:
+    python bench_resizer.py generate CORPUS [--portraits 40 --cameras 6 --seed 1]
+    python bench_resizer.py run CORPUS -o risultati.json [--repeat 3 --workers 1]
+    python bench_resizer.py compare baseline.json risultati.json [--threshold 10]
+"""
+
+import sys
+import json
+import random
+import hashlib
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+import PIL
+from PIL import Image, ImageDraw
+
+from web_image_pipeline import (
+    ResizeSettings, ResizePipeline, MODES, FORMATS, STAGES, HAVE_CMS, percentile, collect_files, file_sha256,
+    write_json_atomic,
+)
+from bench_metadata_memory import peak_rss_bytes
+
+if HAVE_CMS:
+    from PIL import ImageCms
+
+BENCH_VERSION = 1
+CORPUS_INDEX = "corpus.json"
+
+# Parametri dei casi: dimensioni tipiche dell'uso web del repository
+CASE_SETTINGS = {
+    "scale": dict(mode="scale", scale_type="long", long_side=1600),
+    "exact": dict(mode="exact", exact_w=600, exact_h=600, exact_mode="fill"),
+}
+
+# Metriche confrontate da compare: (chiave, True se più alto è meglio)
+COMPARE_METRICS = (
+    ("images_per_s", True),
+    ("latency_p50_ms", False),
+    ("latency_p95_ms", False),
+    ("peak_rss_mb", False),
+)
+
+
+# ---------------- Corpus sintetico ----------------
+def _synthetic_image(rnd: random.Random, size) -> Image.Image:
+    """Sfumatura + forme + rumore: contenuto con entropia simile a una foto, deterministico."""
+    w, h = size
+    base = Image.merge("RGB", [Image.linear_gradient("L").rotate(rnd.choice((0, 90, 180, 270))).resize(size)
+                               for _ in range(3)])
+    draw = ImageDraw.Draw(base)
+    for _ in range(24):
+        x0, y0 = rnd.randrange(w), rnd.randrange(h)
+        x1, y1 = x0 + rnd.randrange(w // 8, w // 2), y0 + rnd.randrange(h // 8, h // 2)
+        fill = tuple(rnd.randrange(256) for _ in range(3))
+        (draw.ellipse if rnd.random() < 0.5 else draw.rectangle)((x0, y0, x1, y1), fill=fill)
+    noise = Image.frombytes("L", (w // 4, h // 4), rnd.randbytes((w // 4) * (h // 4))).resize(size)
+    return Image.blend(base, Image.merge("RGB", (noise, noise, noise)), 0.15)
+
+def _srgb_icc() -> Optional[bytes]:
+    if not HAVE_CMS:
+        return None
+    icc = bytearray(ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes())
+    # Intestazione ICC: data di creazione (byte 24-35) e ID del profilo (84-99) azzerati,
+    # altrimenti ogni generazione produrrebbe file diversi
+    icc[24:36] = bytes(12)
+    icc[84:100] = bytes(16)
+    return bytes(icc)
+
+def generate_corpus(dst: Path, portraits: int = 40, cameras: int = 6, seed: int = 1) -> Dict[str, Any]:
+    """
+    Scrive il corpus in dst e l'indice corpus.json (file, formato, dimensione, orientamento,
+    ICC, sha256). Lo stesso seed produce gli stessi file con la stessa versione di Pillow.
+    """
+    dst.mkdir(parents=True, exist_ok=True)
+    rnd = random.Random(seed)
+    icc = _srgb_icc()
+    files = []
+
+    def save(img, name, fmt, orientation=1, with_icc=False, **params):
+        exif = Image.Exif()
+        if orientation != 1:
+            exif[0x0112] = orientation
+        if with_icc and icc:
+            params["icc_profile"] = icc
+        if fmt in ("JPEG", "TIFF") and orientation != 1:
+            params["exif"] = exif.tobytes()
+        path = dst / name
+        img.save(path, format=fmt, **params)
+        files.append({"file": name, "format": fmt, "size": list(img.size), "orientation": orientation,
+                      "icc": bool(with_icc and icc), "sha256": file_sha256(path)})
+
+    for n in range(portraits):
+        img = _synthetic_image(rnd, (600, 800))
+        if n % 2:
+            save(img, f"portrait_{n:03d}.png", "PNG", with_icc=n % 4 == 1)
+        else:
+            save(img, f"portrait_{n:03d}.jpg", "JPEG", with_icc=n % 4 == 0, quality=90)
+    for n in range(cameras):
+        # Salvate "di lato" come le fotocamere: l'orientamento EXIF le raddrizza
+        img = _synthetic_image(rnd, (4000, 3000))
+        if n % 3 == 2:
+            save(img, f"camera_{n:03d}.tif", "TIFF", orientation=1, with_icc=True)
+        else:
+            save(img, f"camera_{n:03d}.jpg", "JPEG", orientation=(6, 8)[n % 2], with_icc=n % 2 == 0, quality=92)
+
+    index = {
+        "version": BENCH_VERSION,
+        "seed": seed,
+        "pillow": PIL.__version__,
+        "digest": hashlib.sha256("".join(f["sha256"] for f in files).encode()).hexdigest()[:16],
+        "files": files,
+    }
+    write_json_atomic(dst / CORPUS_INDEX, index)
+    return index
+
+
+# ---------------- Esecuzione ----------------
+def _run_case(corpus: Path, mode: str, fmt: str, repeat: int, workers: int) -> Dict[str, Any]:
+    """Eseguito nel processo figlio: un caso, `repeat` passate complete sul corpus."""
+    settings = ResizeSettings(format=fmt, **CASE_SETTINGS[mode])
+    files = collect_files(corpus)
+    base_rss = peak_rss_bytes()
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    rates = []
+    failed = 0
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="bench_resizer_") as tmp:
+            pipe = ResizePipeline(settings, workers=workers, timing=True)
+            for res in pipe.process(files, corpus, Path(tmp)):
+                if not res.ok:
+                    failed += 1
+                    continue
+                latencies.append(res.timings["total"])
+                for name, value in res.timings.items():
+                    stages.setdefault(name, []).append(value)
+            rates.append(pipe.report.summary()["images_per_s"])
+    return {
+        "files": len(files),
+        "failed": failed,
+        "images_per_s": max(rates) if rates else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "stage_p50_ms": {k: round(percentile(v, 50) * 1000, 2) for k, v in stages.items() if k in STAGES},
+        # Con workers > 1 il lavoro è nei processi del pool (terminati a fine passata)
+        "peak_rss_mb": round(max(peak_rss_bytes(), peak_rss_bytes(children=True)) / 2**20, 1),
+        "baseline_rss_mb": round(base_rss / 2**20, 1),
+    }
+
+def run_suite(corpus: Path, modes=MODES, formats=FORMATS, repeat: int = 3, workers: int = 1) -> Dict[str, Any]:
+    try:
+        index = json.loads((corpus / CORPUS_INDEX).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        index = {}
+    cases = {}
+    for mode in modes:
+        for fmt in formats:
+            name = f"{mode}-{fmt}"
+            cmd = [sys.executable, str(Path(__file__).resolve()), "run", str(corpus),
+                   "--repeat", str(repeat), "--workers", str(workers), "--case", name]
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            cases[name] = json.loads(out.strip().splitlines()[-1])
+            r = cases[name]
+            print(f"{name:<12}{r['images_per_s']:>10.2f} img/s  p50 {r['latency_p50_ms']:>8.1f} ms"
+                  f"  p95 {r['latency_p95_ms']:>8.1f} ms  RSS {r['peak_rss_mb']:>7.1f} MB", file=sys.stderr)
+    return {
+        "version": BENCH_VERSION,
+        "env": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "corpus": {"path": str(corpus), "digest": index.get("digest", ""), "seed": index.get("seed")},
+        "repeat": repeat,
+        "workers": workers,
+        "cases": cases,
+    }
+
+
+# ---------------- Confronto ----------------
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 10.0) -> List[Dict[str, Any]]:
+    """
+    Confronta i casi presenti in entrambi i risultati. Ritorna una riga per metrica con
+    la variazione percentuale; regression=True se peggiora oltre threshold (%).
+    """
+    rows = []
+    for name, cur in current.get("cases", {}).items():
+        base = baseline.get("cases", {}).get(name)
+        if not base:
+            continue
+        for key, higher_is_better in COMPARE_METRICS:
+            old, new = base.get(key), cur.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if higher_is_better else change
+            rows.append({"case": name, "metric": key, "baseline": old, "current": new,
+                         "change_pct": round(change, 1), "regression": worse > threshold})
+    return rows
+
+
+# ---------------- CLI ----------------
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(description="Benchmark riproducibile del ridimensionamento immagini.")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    g = sub.add_parser("generate", help="genera il corpus sintetico")
+    g.add_argument("dst", type=Path)
+    g.add_argument("--portraits", type=int, default=40, help="ritratti 600x800 (PNG/JPEG)")
+    g.add_argument("--cameras", type=int, default=6, help="foto 4000x3000 (JPEG ruotati/TIFF)")
+    g.add_argument("--seed", type=int, default=1)
+
+    r = sub.add_parser("run", help="esegue i casi e scrive i risultati JSON")
+    r.add_argument("corpus", type=Path)
+    r.add_argument("-o", "--output", type=Path, help="file JSON dei risultati (default: stdout)")
+    r.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    r.add_argument("--formats", nargs="+", type=str.upper, choices=FORMATS, default=list(FORMATS))
+    r.add_argument("--repeat", type=int, default=3, help="passate per caso")
+    r.add_argument("--workers", type=int, default=1, help="processi della pipeline (1 = misura più stabile)")
+    r.add_argument("--case", help=argparse.SUPPRESS)
+
+    c = sub.add_parser("compare", help="confronta i risultati con una baseline")
+    c.add_argument("baseline", type=Path)
+    c.add_argument("current", type=Path)
+    c.add_argument("--threshold", type=float, default=10.0, help="peggioramento tollerato (%%)")
+    args = p.parse_args(argv)
+
+    if args.command == "generate":
+        index = generate_corpus(args.dst, args.portraits, args.cameras, args.seed)
+        print(f"Corpus: {len(index['files'])} file in {args.dst} (digest {index['digest']})")
+        return 0
+
+    if args.command == "run":
+        if not args.corpus.is_dir():
+            print(f"Errore: cartella corpus non valida: {args.corpus}", file=sys.stderr)
+            return 2
+        if args.case:
+            mode, fmt = args.case.split("-")
+            print(json.dumps(_run_case(args.corpus, mode, fmt, args.repeat, args.workers)))
+            return 0
+        results = run_suite(args.corpus, args.modes, args.formats, args.repeat, args.workers)
+        if args.output:
+            write_json_atomic(args.output, results)
+            print(f"Risultati: {args.output}")
+        else:
+            print(json.dumps(results, indent=2))
+        return 0
+
+    try:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        current = json.loads(args.current.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 2
+    if baseline.get("corpus", {}).get("digest") != current.get("corpus", {}).get("digest"):
+        print("Attenzione: i risultati sono stati misurati su corpus diversi.", file=sys.stderr)
+    if baseline.get("env") != current.get("env"):
+        print("Attenzione: ambiente diverso (Python/Pillow/piattaforma).", file=sys.stderr)
+    if (baseline.get("workers"), baseline.get("repeat")) != (current.get("workers"), current.get("repeat")):
+        print("Attenzione: workers/repeat diversi tra i due risultati.", file=sys.stderr)
+    rows = compare_results(baseline, current, args.threshold)
+    print(f"{'caso':<12}{'metrica':<16}{'baseline':>10}{'attuale':>10}{'var %':>8}")
+    for row in rows:
+        flag = "  REGRESSIONE" if row["regression"] else ""
+        print(f"{row['case']:<12}{row['metric']:<16}{row['baseline']:>10}{row['current']:>10}{row['change_pct']:>8}{flag}")
+    regressions = sum(row["regression"] for row in rows)
+    print(f"Regressioni oltre {args.threshold:g}%: {regressions}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
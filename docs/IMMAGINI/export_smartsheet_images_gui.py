@@ -17,103 +17,51 @@ Note:
 - Seleziona la "Colonna con le immagini" (la colonna che contiene le immagini in cella) e
   la "Colonna per rinomina" (il cui valore verrà usato per il nome file).
 - Scegli la cartella di destinazione e premi "Avvia esportazione".
+- Il log a video mostra le ultime righe; il log completo è in logs/ (gui_log_sink.py).
+- Le chiamate API e i download sono nel motore smartsheet_export.py: lettura delle righe,
+  richieste URL e download procedono in parallelo ("Download paralleli", connessioni riusate);
+  il log resta nell'ordine delle righe. Le richieste rispettano il limite al minuto dell'API
+  e vengono ritentate su 429/5xx o errori di rete (Retry-After, backoff con jitter).
+- Incrementale: un manifest nella cartella di destinazione ricorda quale immagine (imageId) è
+  stata salvata in quale file; le immagini invariate vengono saltate senza richiederne l'URL,
+  i file delle persone rinominate vengono rinominati, un'esportazione interrotta riprende.
+- Formato web (opzionale): le immagini scaricate vengono ridimensionate e convertite in memoria
+  (web_image_pipeline.py, stessi parametri di web_image_resizer_gui.py) e su disco va solo il
+  file finale, nominato con la colonna di rinomina: niente PNG intermedio da rielaborare.
+- Cache: colonne e righe lette vengono salvate nella cartella di cache dell'utente
+  (%LOCALAPPDATA%\\smartsheet_export) per ID e versione del foglio; se il foglio non è
+  cambiato "Carica colonne" e l'esportazione non rileggono le righe dall'API.
 """
 
-import os
-import re
-import io
-import sys
-import json
 import time
-import queue
 import threading
-from typing import List, Dict, Any, Optional
+from typing import Optional
 from pathlib import Path
 
 import requests
 
-try:
-    from PIL import Image
-    PIL_OK = True
-except Exception:
-    PIL_OK = False
-
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
-API_BASE = "https://api.smartsheet.com/2.0"
-
-def sanitize_filename(s: str) -> str:
-    s = (s or "").strip()
-    s = re.sub(r'[\\/:*?"<>|]+', "_", s)
-    s = re.sub(r"\s+", " ", s)
-    return s[:150] or "senza_nome"
-
-def headers(token: str, json_mode: bool=False) -> Dict[str, str]:
-    h = {"Authorization": f"Bearer {token}"}
-    if json_mode:
-        h["Content-Type"] = "application/json"
-    return h
-
-def get_sheet_columns(token: str, sheet_id: int) -> List[Dict[str, Any]]:
-    # Recupera solo metadati del foglio (incluse colonne). Una singola pagina è sufficiente.
-    url = f"{API_BASE}/sheets/{sheet_id}?pageSize=1"
-    r = requests.get(url, headers=headers(token))
-    r.raise_for_status()
-    data = r.json()
-    return data.get("columns", [])
-
-def iter_sheet_rows(token: str, sheet_id: int, page_size: int = 500):
-    # Itera tutte le righe con paginazione per evitare timeouts su fogli grandi
-    page = 1
-    while True:
-        url = f"{API_BASE}/sheets/{sheet_id}?pageSize={page_size}&page={page}"
-        r = requests.get(url, headers=headers(token))
-        r.raise_for_status()
-        data = r.json()
-        rows = data.get("rows", [])
-        if not rows:
-            break
-        for row in rows:
-            yield row
-        # Heuristica: se arriviamo a meno del page_size, presumiamo fine
-        if len(rows) < page_size:
-            break
-        page += 1
-
-def post_image_urls(token: str, image_ids: List[str]) -> List[str]:
-    # Richiede URL temporanei per imageId
-    payload = [{"imageId": iid} for iid in image_ids]
-    r = requests.post(f"{API_BASE}/imageurls", headers=headers(token, json_mode=True), json=payload)
-    r.raise_for_status()
-    data = r.json()
-    return [item.get("url") for item in data.get("imageUrls", []) if item.get("url")]
-
-def download_and_save_png(token: str, url: str, out_path: Path):
-    resp = requests.get(url, headers=headers(token), stream=True)
-    resp.raise_for_status()
-    ctype = (resp.headers.get("Content-Type") or "").lower()
-    raw = resp.content
-    # Se già PNG o estensione png, salva raw
-    if "image/png" in ctype or out_path.suffix.lower() == ".png":
-        out_path.write_bytes(raw)
-        return
-    if PIL_OK:
-        try:
-            img = Image.open(io.BytesIO(raw))
-            img.save(out_path, format="PNG")
-            return
-        except Exception:
-            pass
-    # fallback: salva raw anche se non è PNG (potrebbe non aprirsi come PNG)
-    out_path.write_bytes(raw)
+from gui_log_sink import LogSink, ProgressTracker, default_log_path
+# Motore di esportazione (senza Tk)
+from smartsheet_export import (
+    SheetImageExporter, RequestScheduler, SheetCache, Cancelled, DOWNLOAD_WORKERS, MAX_DOWNLOAD_WORKERS,
+    HAVE_PIPELINE, make_session, get_sheet_columns,
+)
+if HAVE_PIPELINE:
+    from web_image_pipeline import ResizeSettings
+
+# Stesse etichette di web_image_resizer_gui.py
+EXACT_MODE_LABELS = {"ADATTA (bordi)": "fit", "RIEMPI (ritaglio)": "fill"}
+
 
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Smartsheet - Esporta immagini dalle celle")
-        self.geometry("760x560")
-        self.minsize(740, 540)
+        self.geometry("760x660")
+        self.minsize(740, 620)
 
         self.var_token = tk.StringVar()
         self.var_sheet_id = tk.StringVar()
@@ -122,11 +70,25 @@ class App(tk.Tk):
         self.columns_map = {}  # title -> id
         self.var_img_col = tk.StringVar()
         self.var_name_col = tk.StringVar()
-
-        self.queue = queue.Queue()
+        self.var_workers = tk.IntVar(value=DOWNLOAD_WORKERS)
+        self.var_incremental = tk.BooleanVar(value=True)
+        # Formato web (esportazione diretta)
+        self.var_web = tk.BooleanVar(value=False)
+        self.var_web_mode = tk.StringVar(value="scale")   # "scale" | "exact"
+        self.var_web_long_side = tk.IntVar(value=1600)
+        self.var_web_w = tk.IntVar(value=600)
+        self.var_web_h = tk.IntVar(value=600)
+        self.var_web_exact_mode = tk.StringVar(value="RIEMPI (ritaglio)")
+        self.var_web_format = tk.StringVar(value="WEBP")
+        self.var_web_quality = tk.IntVar(value=82)
+        self.var_web_strip_meta = tk.BooleanVar(value=True)
 
         self._build_ui()
-        self._poll_log_queue()
+        # Tutte le chiamate (colonne, righe, URL, download) passano dallo stesso scheduler:
+        # un solo limite di frequenza per il token, connessioni riusate tra un'esportazione e l'altra
+        self.http = RequestScheduler(make_session(MAX_DOWNLOAD_WORKERS), stop_flag=self.stop_flag)
+        # Colonne e righe del foglio su disco, riusate finché la versione del foglio non cambia
+        self.cache = SheetCache()
 
     def _build_ui(self):
         pad = {"padx": 8, "pady": 6}
@@ -142,8 +104,8 @@ class App(tk.Tk):
         ent_sheet = ttk.Entry(frm_top, textvariable=self.var_sheet_id, width=22)
         ent_sheet.grid(row=0, column=3, sticky="w", **pad)
 
-        btn_cols = ttk.Button(frm_top, text="Carica colonne", command=self.on_load_columns)
-        btn_cols.grid(row=0, column=4, sticky="w", **pad)
+        self.btn_cols = ttk.Button(frm_top, text="Carica colonne", command=self.on_load_columns)
+        self.btn_cols.grid(row=0, column=4, sticky="w", **pad)
 
         frm_top.columnconfigure(1, weight=1)
 
@@ -167,8 +129,41 @@ class App(tk.Tk):
         btn_browse = ttk.Button(frm_opts, text="Sfoglia…", command=self.on_browse)
         btn_browse.grid(row=1, column=4, sticky="w", **pad)
 
+        ttk.Label(frm_opts, text="Download paralleli:").grid(row=2, column=0, sticky="e", **pad)
+        ttk.Spinbox(frm_opts, from_=1, to=MAX_DOWNLOAD_WORKERS, textvariable=self.var_workers, width=6).grid(row=2, column=1, sticky="w", **pad)
+        ttk.Checkbutton(frm_opts, text="Incrementale (solo immagini nuove o cambiate, riprende le esportazioni interrotte)",
+                        variable=self.var_incremental).grid(row=2, column=2, columnspan=3, sticky="w", **pad)
+
         frm_opts.columnconfigure(3, weight=1)
 
+        frm_web = ttk.LabelFrame(self, text="Formato web (opzionale)")
+        frm_web.pack(fill="x", padx=10, pady=6)
+        chk_web = ttk.Checkbutton(frm_web, text="Ridimensiona durante l'esportazione (scrive solo i file finali)",
+                                  variable=self.var_web)
+        chk_web.grid(row=0, column=0, columnspan=4, sticky="w", **pad)
+        ttk.Label(frm_web, text="Formato:").grid(row=0, column=4, sticky="e", **pad)
+        ttk.Combobox(frm_web, values=["WEBP", "JPEG", "PNG"], textvariable=self.var_web_format, state="readonly",
+                     width=7).grid(row=0, column=5, sticky="w", **pad)
+        ttk.Label(frm_web, text="Qualità:").grid(row=0, column=6, sticky="e", **pad)
+        ttk.Spinbox(frm_web, from_=1, to=100, textvariable=self.var_web_quality, width=5).grid(row=0, column=7, sticky="w", **pad)
+
+        ttk.Radiobutton(frm_web, text="Lato lungo (px):", value="scale",
+                        variable=self.var_web_mode).grid(row=1, column=0, sticky="w", **pad)
+        ttk.Spinbox(frm_web, from_=16, to=10000, textvariable=self.var_web_long_side, width=6).grid(row=1, column=1, sticky="w", **pad)
+        ttk.Radiobutton(frm_web, text="Esatta (L x A):", value="exact",
+                        variable=self.var_web_mode).grid(row=1, column=2, sticky="e", **pad)
+        frm_size = ttk.Frame(frm_web)
+        frm_size.grid(row=1, column=3, sticky="w", **pad)
+        ttk.Spinbox(frm_size, from_=16, to=10000, textvariable=self.var_web_w, width=6).pack(side="left")
+        ttk.Label(frm_size, text=" x ").pack(side="left")
+        ttk.Spinbox(frm_size, from_=16, to=10000, textvariable=self.var_web_h, width=6).pack(side="left")
+        ttk.Combobox(frm_web, values=list(EXACT_MODE_LABELS), textvariable=self.var_web_exact_mode, state="readonly",
+                     width=17).grid(row=1, column=4, columnspan=2, sticky="w", **pad)
+        ttk.Checkbutton(frm_web, text="Rimuovi metadata", variable=self.var_web_strip_meta).grid(row=1, column=6, columnspan=2, sticky="w", **pad)
+        if not HAVE_PIPELINE:
+            chk_web["state"] = "disabled"
+            ttk.Label(frm_web, text="(richiede web_image_pipeline.py e Pillow)").grid(row=2, column=0, columnspan=8, sticky="w", **pad)
+
         frm_actions = ttk.Frame(self)
         frm_actions.pack(fill="x", padx=10, pady=(0,6))
         self.btn_start = ttk.Button(frm_actions, text="Avvia esportazione", command=self.on_start, state="disabled")
@@ -176,7 +171,9 @@ class App(tk.Tk):
         self.btn_cancel = ttk.Button(frm_actions, text="Annulla", command=self.on_cancel, state="disabled")
         self.btn_cancel.pack(side="left", padx=4)
 
-        self.progress = ttk.Progressbar(frm_actions, mode="indeterminate")
+        self.lbl_progress = ttk.Label(frm_actions, text="", width=34, anchor="e")
+        self.lbl_progress.pack(side="right", padx=4)
+        self.progress = ttk.Progressbar(frm_actions, mode="determinate")
         self.progress.pack(side="right", fill="x", expand=True, padx=4)
 
         frm_log = ttk.LabelFrame(self, text="Log")
@@ -184,23 +181,23 @@ class App(tk.Tk):
         self.txt_log = tk.Text(frm_log, height=16, wrap="word")
         self.txt_log.pack(fill="both", expand=True, padx=6, pady=6)
         self.txt_log.insert("end", "Pronto.\n")
+        self.sink = LogSink(self, self.txt_log, log_file=default_log_path("export_smartsheet_images"),
+                            progress=ProgressTracker(self.progress, self.lbl_progress, unit="immagini"))
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
 
         self.worker = None
+        self.loader = None   # thread di "Carica colonne"
         self.stop_flag = threading.Event()
 
     def log(self, msg: str):
-        self.queue.put(msg)
+        # Sicuro dal thread di esportazione: il widget viene aggiornato dal LogSink una volta per frame
+        self.sink.write(msg)
 
-    def _poll_log_queue(self):
-        try:
-            while True:
-                msg = self.queue.get_nowait()
-                self.txt_log.insert("end", msg.rstrip() + "\n")
-                self.txt_log.see("end")
-        except queue.Empty:
-            pass
-        finally:
-            self.after(120, self._poll_log_queue)
+    def _on_close(self):
+        self.stop_flag.set()
+        self.http.close()
+        self.sink.close()
+        self.destroy()
 
     def on_browse(self):
         folder = filedialog.askdirectory(initialdir=self.var_out_dir.get() or str(Path.cwd()))
@@ -218,27 +215,52 @@ class App(tk.Tk):
         except ValueError:
             messagebox.showerror("Errore", "Sheet ID deve essere un numero intero.")
             return
+        if self.loader and self.loader.is_alive():
+            return
         self.log("Caricamento colonne in corso…")
+        if not (self.worker and self.worker.is_alive()):
+            self.stop_flag.clear()
+        self.btn_cols["state"] = "disabled"
+        # In un thread: con ritentativi e Retry-After la chiamata può durare decine di secondi
+        self.loader = threading.Thread(target=self._load_columns, args=(token, sheet_id), daemon=True)
+        self.loader.start()
+
+    def _load_columns(self, token: str, sheet_id: int):
         try:
-            cols = get_sheet_columns(token, sheet_id)
+            cols = get_sheet_columns(token, sheet_id, self.http, self.cache)
             if not cols:
                 raise RuntimeError("Nessuna colonna trovata (controlla permessi e ID foglio).")
-            # Popola combobox con titoli
-            self.columns_map = {c["title"]: c["id"] for c in cols}
-            titles = list(self.columns_map.keys())
-            titles.sort(key=str.lower)
-            self.cmb_img_col["values"] = titles
-            self.cmb_name_col["values"] = titles
-            if titles:
-                self.var_img_col.set(titles[0])
-                if len(titles) > 1:
-                    self.var_name_col.set(titles[1])
-            self.btn_start["state"] = "normal"
-            self.log(f"Colonne caricate: {len(titles)}")
-        except requests.HTTPError as e:
+            done, arg = self._apply_columns, cols
+        except Exception as e:
+            done, arg = self._columns_failed, e
+        try:
+            self.after(0, done, arg)  # widget aggiornati solo dal thread Tk
+        except (RuntimeError, tk.TclError):
+            pass  # finestra già chiusa
+
+    def _apply_columns(self, cols: list):
+        self.btn_cols["state"] = "normal"
+        # Popola combobox con titoli
+        self.columns_map = {c["title"]: c["id"] for c in cols}
+        titles = list(self.columns_map.keys())
+        titles.sort(key=str.lower)
+        self.cmb_img_col["values"] = titles
+        self.cmb_name_col["values"] = titles
+        if titles:
+            self.var_img_col.set(titles[0])
+            if len(titles) > 1:
+                self.var_name_col.set(titles[1])
+        self.btn_start["state"] = "normal"
+        self.log(f"Colonne caricate: {len(titles)}")
+
+    def _columns_failed(self, e: Exception):
+        self.btn_cols["state"] = "normal"
+        if isinstance(e, Cancelled):
+            self.log("Caricamento colonne annullato.")
+        elif isinstance(e, requests.HTTPError):
             self.log(f"Errore HTTP: {e} - {getattr(e.response, 'text', '')}")
             messagebox.showerror("Errore HTTP", f"{e}\n\n{getattr(e.response, 'text', '')}")
-        except Exception as e:
+        else:
             self.log(f"Errore: {e}")
             messagebox.showerror("Errore", str(e))
 
@@ -260,102 +282,123 @@ class App(tk.Tk):
             messagebox.showerror("Errore", "Sheet ID deve essere un numero intero.")
             return
 
+        try:
+            workers = int(self.var_workers.get())
+        except (ValueError, tk.TclError):
+            messagebox.showerror("Errore", "Download paralleli deve essere un numero intero.")
+            return
+
+        resize = None
+        if self.var_web.get():
+            try:
+                resize = self._web_settings()
+            except (ValueError, tk.TclError) as e:
+                messagebox.showerror("Errore", f"Parametri formato web non validi: {e}")
+                return
+
         Path(out_dir).mkdir(parents=True, exist_ok=True)
 
         self.stop_flag.clear()
-        self.progress.start(80)
+        self.sink.progress.start()
+        self.log(f"Avvio esportazione… (log completo: {self.sink.log_file})")
         self.btn_start["state"] = "disabled"
         self.btn_cancel["state"] = "normal"
 
-        args = (token, sheet_id, out_dir, img_col_title, name_col_title, self.var_prefix.get().strip())
+        args = (token, sheet_id, out_dir, img_col_title, name_col_title, self.var_prefix.get().strip(), workers,
+                bool(self.var_incremental.get()), resize)
         self.worker = threading.Thread(target=self._run_export, args=args, daemon=True)
         self.worker.start()
 
+    def _web_settings(self) -> "ResizeSettings":
+        """Parametri dell'esportazione diretta; nomi file = valore della colonna di rinomina."""
+        return ResizeSettings(
+            mode=self.var_web_mode.get(),
+            scale_type="long",
+            long_side=int(self.var_web_long_side.get()),
+            exact_w=int(self.var_web_w.get()),
+            exact_h=int(self.var_web_h.get()),
+            exact_mode=EXACT_MODE_LABELS[self.var_web_exact_mode.get()],
+            format=self.var_web_format.get(),
+            quality=int(self.var_web_quality.get()),
+            strip_meta=bool(self.var_web_strip_meta.get()),
+            suffix="",
+        ).validate()
+
     def on_cancel(self):
         if self.worker and self.worker.is_alive():
             self.stop_flag.set()
             self.log("Richiesta di annullamento…")
 
-    def _run_export(self, token: str, sheet_id: int, out_dir: str, img_col_title: str, name_col_title: str, prefix: str):
+    def _run_export(self, token: str, sheet_id: int, out_dir: str, img_col_title: str, name_col_title: str,
+                    prefix: str, workers: int = DOWNLOAD_WORKERS, incremental: bool = True,
+                    resize: Optional["ResizeSettings"] = None):
+        stats0 = self.http.stats()
         try:
             # Ricava mappa colonne (se non presente o cambiata)
             if not self.columns_map:
-                cols = get_sheet_columns(token, sheet_id)
+                cols = get_sheet_columns(token, sheet_id, self.http, self.cache)
                 self.columns_map = {c["title"]: c["id"] for c in cols}
 
             if img_col_title not in self.columns_map or name_col_title not in self.columns_map:
                 raise RuntimeError("Le colonne selezionate non sono valide. Ricaricare le colonne.")
 
-            img_col_id = self.columns_map[img_col_title]
-            name_col_id = self.columns_map[name_col_title]
-
-            self.log("Lettura righe del foglio…")
-            cells_with_images = []  # (row, cell)
-            for row in iter_sheet_rows(token, sheet_id):
-                if self.stop_flag.is_set():
-                    self.log("Operazione annullata.")
-                    self._done()
-                    return
-                for cell in row.get("cells", []):
-                    # Filtra solo le celle della colonna selezionata
-                    if cell.get("columnId") != img_col_id:
-                        continue
-                    img = cell.get("image")
-                    if isinstance(img, dict) and img.get("id"):
-                        cells_with_images.append((row, cell))
-
-            total = len(cells_with_images)
-            if total == 0:
+            # Righe, URL e download procedono in parallelo: i primi file arrivano
+            # mentre le pagine successive del foglio sono ancora in lettura
+            exporter = SheetImageExporter(token, sheet_id, self.columns_map[img_col_title],
+                                          self.columns_map[name_col_title], Path(out_dir), prefix,
+                                          workers, stop_flag=self.stop_flag, session=self.http,
+                                          incremental=incremental, resize=resize, cache=self.cache)
+            self.log(f"Lettura righe e download in corso… (paralleli: {workers})")
+            if resize is not None:
+                geometry = (f"lato lungo {resize.long_side}px" if resize.mode == "scale"
+                            else f"{resize.exact_w}x{resize.exact_h} {resize.exact_mode}")
+                self.log(f"Formato web: {resize.format} q={resize.quality}, {geometry}")
+            t0 = time.perf_counter()
+            done = failed = unchanged = renamed = 0
+            downloaded = written = 0
+            cached_logged = False
+            for res in exporter.run():
+                if exporter.from_cache and not cached_logged:
+                    cached_logged = True
+                    self.log(f"Foglio invariato (versione {exporter.version}): righe dalla cache locale.")
+                if res.unchanged:
+                    unchanged += 1
+                elif res.renamed_from:
+                    renamed += 1
+                    self.log(f"Rinominato: {res.renamed_from} → {res.path.name}")
+                elif res.ok:
+                    done += 1
+                    if done == 1:
+                        self.log(f"Primo file dopo {time.perf_counter() - t0:.1f} s")
+                    downloaded += res.bytes
+                    written += res.written
+                    if resize is not None:
+                        self.log(f"Salvato: {res.path.name} ({res.bytes // 1024} KB → {res.written // 1024} KB)")
+                    else:
+                        self.log(f"Salvato: {res.path.name}")
+                else:
+                    failed += 1
+                    self.log(f"Errore su '{res.path.name}': {res.error}")
+                if exporter.listed:
+                    self.sink.progress.set_total(exporter.images)
+                self.sink.progress.advance()
+            if exporter.cancelled:
+                self.log("Operazione annullata.")
+                return
+            if exporter.images == 0:
                 self.log("Nessuna immagine trovata nella colonna selezionata.")
-                self._done()
                 return
 
-            self.log(f"Trovate {total} immagini. Richiesta URL di download…")
-            image_ids = [cell["image"]["id"] for (_, cell) in cells_with_images]
-            urls = []
-            BATCH = 80
-            for i in range(0, len(image_ids), BATCH):
-                if self.stop_flag.is_set():
-                    self.log("Operazione annullata.")
-                    self._done()
-                    return
-                chunk = image_ids[i:i+BATCH]
-                urls.extend(post_image_urls(token, chunk))
-                self.log(f"  URL ottenuti: {len(urls)}/{total}")
-
-            out_dir_p = Path(out_dir)
-            seen = set()
-            done = 0
-            for (row, cell), url in zip(cells_with_images, urls):
-                if self.stop_flag.is_set():
-                    self.log("Operazione annullata.")
-                    self._done()
-                    return
-                # Valore per filename dalla colonna selezionata
-                rename_value = None
-                for c in row.get("cells", []):
-                    if c.get("columnId") == name_col_id:
-                        rename_value = c.get("displayValue") or c.get("value")
-                        break
-                if not rename_value:
-                    rename_value = f"row_{row.get('id')}"
-
-                base = sanitize_filename(str(rename_value))
-                fname = f"{prefix}{base}.png"
-                j = 2
-                while fname in seen or (out_dir_p / fname).exists():
-                    fname = f"{prefix}{base} ({j}).png"
-                    j += 1
-                seen.add(fname)
-
-                try:
-                    download_and_save_png(token, url, out_dir_p / fname)
-                    done += 1
-                    self.log(f"Salvato: {fname}")
-                except Exception as e:
-                    self.log(f"Errore su '{fname}': {e}")
-
-            self.log(f"Completato. Salvati {done} file in: {out_dir_p.resolve()}")
+            self.log(f"Righe lette: {exporter.rows}. Immagini: {exporter.images} "
+                     f"(richieste URL: {exporter.url_requests}). Errori: {failed}.")
+            if incremental:
+                self.log(f"Invariate (saltate): {unchanged}. Rinominate: {renamed}.")
+            if resize is not None and downloaded:
+                self.log(f"Scaricati {downloaded / 2**20:.1f} MB, scritti {written / 2**20:.1f} MB "
+                         f"({written / downloaded * 100:.0f}%).")
+            self.log(f"Completato. Salvati {done} file in: {Path(out_dir).resolve()}")
+        except Cancelled:
+            self.log("Operazione annullata.")
         except requests.HTTPError as e:
             self.log(f"Errore HTTP: {e} - {getattr(e.response, 'text', '')}")
             messagebox.showerror("Errore HTTP", f"{e}\n\n{getattr(e.response, 'text', '')}")
@@ -363,10 +406,14 @@ class App(tk.Tk):
             self.log(f"Errore: {e}")
             messagebox.showerror("Errore", str(e))
         finally:
+            st = self.http.stats()
+            self.log(f"Richieste HTTP: {st['requests'] - stats0['requests']}, ritentativi: {st['retries'] - stats0['retries']}, "
+                     f"429: {st['throttled'] - stats0['throttled']}, attese per limite: "
+                     f"{st['throttle_wait_s'] - stats0['throttle_wait_s']:.1f} s")
             self._done()
 
     def _done(self):
-        self.progress.stop()
+        self.sink.progress.finish()
         self.btn_start["state"] = "normal"
         self.btn_cancel["state"] = "disabled"
 
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+Smartsheet finto in locale per misurare e provare smartsheet_export.py senza token né rete
+
+Riproduce solo gli endpoint usati dall'esportazione:
+- GET  /2.0/sheets/{id}   foglio sintetico con paginazione (pageSize, page), proiezione
+                          delle colonne (columnIds) ed esclusione delle celle vuote
+- GET  /2.0/sheets/{id}/version   numero di versione (bump_version() simula una modifica)
+- POST /2.0/imageurls     URL temporanei per una lista di imageId
+- GET  /images/{imageId}  download dell'immagine (host "esterno": fuori da API_BASE, come
+                          gli URL firmati del servizio reale, quindi senza limite API)
+
+Parametri (FakeSheetConfig): numero di righe, quota di righe con immagine, colonne extra,
+dimensione e formato delle immagini, latenza per chiamata API e per download, banda per
+download, limite al minuto sulle chiamate API (429 con Retry-After) e iniezione casuale di
+429/5xx. Stesso seed -> stesso foglio e stessa sequenza di errori a parità di richieste.
+
+Dipendenze: Pillow (immagini sintetiche). Solo libreria standard per il server.
+
+Uso da Python:
+    from fake_smartsheet_server import FakeSmartsheetServer, FakeSheetConfig
+    with FakeSmartsheetServer(FakeSheetConfig(rows=5000, api_latency=0.2)) as srv:
+        smartsheet_export.API_BASE = srv.api_base
+        ...   # foglio srv.config.sheet_id, colonne IMAGE_COLUMN_ID / NAME_COLUMN_ID
+        print(srv.stats())
+
+Da riga di comando (poi SMARTSHEET_API_BASE=<api_base> per la GUI, token qualsiasi):
+    python fake_smartsheet_server.py --port 8765 --rows 5000 --api-latency 0.2 --fail-429 0.02
+"""
+
+import io
+import sys
+import math
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image, ImageDraw
+
+API_PREFIX = "/2.0"
+IMAGE_PREFIX = "/images/"
+IMAGE_COLUMN_ID = 1001
+NAME_COLUMN_ID = 1002
+EXTRA_COLUMN_BASE = 2001
+IMAGE_VARIANTS = 16      # immagini distinte generate; gli imageId le riusano a rotazione
+WRITE_CHUNK = 64 * 1024
+
+
+@dataclass
+class FakeSheetConfig:
+    sheet_id: int = 1
+    rows: int = 2000
+    image_ratio: float = 1.0         # quota di righe con immagine in cella
+    extra_columns: int = 20          # colonne di testo oltre a immagine e nome (peso delle pagine)
+    image_size: tuple = (600, 800)
+    image_format: str = "PNG"
+    api_latency: float = 0.0         # secondi per chiamata API (foglio, imageurls)
+    image_latency: float = 0.0       # secondi prima del primo byte di un download
+    bandwidth: float = 0.0           # byte/s per download (0 = illimitata)
+    rate_per_minute: int = 0         # limite sulle chiamate API, 0 = nessuno
+    fail_429: float = 0.0            # probabilità di 429 (Retry-After) per richiesta
+    fail_5xx: float = 0.0            # probabilità di 503 per richiesta
+    retry_after: float = 1.0         # secondi in Retry-After dei 429 iniettati (limite: fino al posto libero)
+    seed: int = 1
+
+    def validate(self):
+        if self.rows < 0 or self.extra_columns < 0:
+            raise ValueError("rows ed extra_columns devono essere >= 0")
+        if not 0.0 <= self.image_ratio <= 1.0:
+            raise ValueError("image_ratio deve essere tra 0 e 1")
+        if not (0.0 <= self.fail_429 <= 1.0 and 0.0 <= self.fail_5xx <= 1.0):
+            raise ValueError("fail_429 e fail_5xx devono essere tra 0 e 1")
+        if self.image_format.upper() not in ("PNG", "JPEG", "WEBP"):
+            raise ValueError(f"formato immagine non supportato: {self.image_format}")
+
+
+# ---------------- Dati sintetici ----------------
+def synthetic_images(size, fmt: str = "PNG", count: int = IMAGE_VARIANTS, seed: int = 1) -> List[bytes]:
+    """Ritratti finti (sfumatura, forme, rumore): peso simile a una foto compressa."""
+    rnd = random.Random(seed)
+    w, h = size
+    out = []
+    for _ in range(count):
+        img = Image.merge("RGB", [Image.linear_gradient("L").rotate(rnd.choice((0, 90, 180, 270))).resize(size)
+                                  for _ in range(3)])
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            x0, y0 = rnd.randrange(w), rnd.randrange(h)
+            draw.ellipse((x0, y0, x0 + rnd.randrange(w // 8, w // 2), y0 + rnd.randrange(h // 8, h // 2)),
+                         fill=tuple(rnd.randrange(256) for _ in range(3)))
+        noise = Image.frombytes("L", (w // 4, h // 4), rnd.randbytes((w // 4) * (h // 4))).resize(size)
+        img = Image.blend(img, Image.merge("RGB", (noise, noise, noise)), 0.1)
+        buf = io.BytesIO()
+        img.save(buf, format=fmt.upper())
+        out.append(buf.getvalue())
+    return out
+
+class SyntheticSheet:
+    """Foglio generato al volo riga per riga: la memoria non dipende dal numero di righe."""
+
+    def __init__(self, config: FakeSheetConfig):
+        self.config = config
+        self.version = 1
+        self.columns = [{"id": IMAGE_COLUMN_ID, "index": 0, "title": "Foto", "type": "TEXT_NUMBER"},
+                        {"id": NAME_COLUMN_ID, "index": 1, "title": "Nome", "type": "TEXT_NUMBER", "primary": True}]
+        self.columns += [{"id": EXTRA_COLUMN_BASE + i, "index": 2 + i, "title": f"Campo {i + 1}", "type": "TEXT_NUMBER"}
+                         for i in range(config.extra_columns)]
+
+    def has_image(self, n: int) -> bool:
+        # Distribuzione uniforme e deterministica della quota di righe con immagine
+        ratio = self.config.image_ratio
+        return int((n + 1) * ratio) > int(n * ratio)
+
+    def row(self, n: int, keep: Optional[set] = None, skip_empty: bool = False) -> Dict[str, Any]:
+        row_id = 100000 + n
+        cells = []
+        if keep is None or IMAGE_COLUMN_ID in keep:
+            if self.has_image(n):
+                cells.append({"columnId": IMAGE_COLUMN_ID, "value": f"foto_{n}.png",
+                              "image": {"id": f"img{n:07d}", "width": self.config.image_size[0],
+                                        "height": self.config.image_size[1]}})
+            elif not skip_empty:
+                cells.append({"columnId": IMAGE_COLUMN_ID})
+        if keep is None or NAME_COLUMN_ID in keep:
+            name = f"Persona {n:05d}"
+            cells.append({"columnId": NAME_COLUMN_ID, "value": name, "displayValue": name})
+        for col in self.columns[2:]:
+            if keep is None or col["id"] in keep:
+                value = f"valore {n}-{col['index']}"
+                cells.append({"columnId": col["id"], "value": value, "displayValue": value})
+        return {"id": row_id, "rowNumber": n + 1, "cells": cells}
+
+    def page(self, page: int, page_size: int, keep: Optional[set] = None, skip_empty: bool = False) -> Dict[str, Any]:
+        start = (page - 1) * page_size
+        stop = min(self.config.rows, start + page_size)
+        return {"id": self.config.sheet_id, "name": "Foglio sintetico", "version": self.version,
+                "totalRowCount": self.config.rows, "columns": self.columns,
+                "rows": [self.row(n, keep, skip_empty) for n in range(start, stop)]}
+
+
+# ---------------- Server ----------------
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"    # keep-alive: come il servizio reale
+    server: "_Server"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", ctype: str = "application/json",
+              extra: Optional[Dict[str, str]] = None, bandwidth: float = 0.0):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (extra or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        for i in range(0, len(body), WRITE_CHUNK):
+            part = body[i:i + WRITE_CHUNK]
+            self.wfile.write(part)
+            time.sleep(len(part) / bandwidth)
+
+    def _json(self, status: int, data: Any, extra: Optional[Dict[str, str]] = None):
+        body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        self.server.owner.count("api_bytes", len(body))
+        self._send(status, body, extra=extra)
+
+    def _error(self, status: int, code: int, message: str):
+        self._json(status, {"errorCode": code, "message": message})
+
+    def _fault(self, api: bool) -> bool:
+        """Limite al minuto ed errori iniettati; True se la risposta è già stata inviata."""
+        owner = self.server.owner
+        status, retry_after = owner.fault(api)
+        if status is None:
+            return False
+        if status == 429:
+            self._json(429, {"errorCode": 4003, "message": "Rate limit exceeded."},
+                       extra={"Retry-After": f"{retry_after:g}"})
+        else:
+            self._error(status, 4002, "Server timeout exceeded. Request has failed.")
+        return True
+
+    def _authorized(self) -> bool:
+        if self.headers.get("Authorization", "").startswith("Bearer "):
+            return True
+        self._error(401, 1002, "Your Access Token is invalid.")
+        return False
+
+    def do_GET(self):
+        owner = self.server.owner
+        url = urlparse(self.path)
+        if url.path.startswith(IMAGE_PREFIX):
+            owner.count("image_requests")
+            if self._fault(api=False):
+                return
+            data = owner.image(url.path[len(IMAGE_PREFIX):])
+            if data is None:
+                self._send(404, b"", "text/plain")
+                return
+            time.sleep(owner.config.image_latency)
+            owner.count("images")
+            owner.count("image_bytes", len(data))
+            self._send(200, data, "image/" + owner.config.image_format.lower(), bandwidth=owner.config.bandwidth)
+            return
+
+        parts = url.path[len(API_PREFIX):].strip("/").split("/")
+        if (not url.path.startswith(API_PREFIX + "/") or len(parts) not in (2, 3) or parts[0] != "sheets"
+                or parts[2:] not in ([], ["version"])):
+            self._error(404, 1006, "Not Found")
+            return
+        owner.count("api_requests")
+        if self._fault(api=True) or not self._authorized():
+            return
+        if parts[1] != str(owner.config.sheet_id):
+            self._error(404, 1006, "Not Found")
+            return
+        if parts[2:] == ["version"]:
+            time.sleep(owner.config.api_latency)
+            owner.count("version_requests")
+            self._json(200, {"version": owner.sheet.version})
+            return
+        q = parse_qs(url.query)
+        try:
+            page_size = max(1, int(q.get("pageSize", ["100"])[0]))
+            page = max(1, int(q.get("page", ["1"])[0]))
+            keep = {int(c) for c in q["columnIds"][0].split(",")} if "columnIds" in q else None
+        except ValueError:
+            self._error(400, 1018, "The value for an argument is not valid.")
+            return
+        skip_empty = "nonexistentCells" in q.get("exclude", [""])[0]
+        time.sleep(owner.config.api_latency)
+        owner.count("sheet_pages")
+        self._json(200, owner.sheet.page(page, page_size, keep, skip_empty))
+
+    def do_POST(self):
+        owner = self.server.owner
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if url.path != API_PREFIX + "/imageurls":
+            self._error(404, 1006, "Not Found")
+            return
+        owner.count("api_requests")
+        if self._fault(api=True) or not self._authorized():
+            return
+        try:
+            ids = [str(d["imageId"]) for d in json.loads(body)]
+        except (ValueError, TypeError, KeyError):
+            self._error(400, 1008, "Unable to parse request.")
+            return
+        time.sleep(owner.config.api_latency)
+        owner.count("url_requests")
+        host = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+        urls = []
+        for iid in ids:
+            if owner.image_index(iid) is None:
+                urls.append({"imageId": iid, "error": {"errorCode": 1006, "message": "Not Found"}})
+            else:
+                urls.append({"imageId": iid, "url": f"{host}{IMAGE_PREFIX}{iid}"})
+        self._json(200, {"urlExpiresInMillis": 1800000, "imageUrls": urls})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    owner: "FakeSmartsheetServer"
+
+    def handle_error(self, request, client_address):
+        # Connessioni keep-alive chiuse dal client (fine sessione, annullamento): normali
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError, ConnectionAbortedError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class FakeSmartsheetServer:
+    """
+    Server su 127.0.0.1 in un thread (porta 0 = libera, scelta dal sistema).
+    api_base va assegnato a smartsheet_export.API_BASE (o SMARTSHEET_API_BASE per la GUI).
+    stats(): richieste e byte serviti, errori iniettati; reset_stats() tra due misure.
+    """
+
+    def __init__(self, config: Optional[FakeSheetConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeSheetConfig()
+        self.config.validate()
+        self.sheet = SyntheticSheet(self.config)
+        self.images = synthetic_images(self.config.image_size, self.config.image_format, seed=self.config.seed)
+        self._rnd = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._window: deque = deque()   # istanti delle chiamate API nell'ultimo minuto
+        self._stats: Dict[str, int] = {}
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.owner = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_base(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def image_index(self, image_id: str) -> Optional[int]:
+        if not image_id.startswith("img"):
+            return None
+        try:
+            n = int(image_id[3:])
+        except ValueError:
+            return None
+        return n if 0 <= n < self.config.rows and self.sheet.has_image(n) else None
+
+    def image(self, image_id: str) -> Optional[bytes]:
+        n = self.image_index(image_id)
+        return None if n is None else self.images[n % len(self.images)]
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + n
+
+    def fault(self, api: bool) -> Tuple[Optional[int], float]:
+        """(stato HTTP di errore 429/503 o None, secondi per Retry-After)."""
+        cfg = self.config
+        with self._lock:
+            if api and cfg.rate_per_minute:
+                now = time.monotonic()
+                while self._window and now - self._window[0] >= 60.0:
+                    self._window.popleft()
+                if len(self._window) >= cfg.rate_per_minute:
+                    self._stats["rate_limited"] = self._stats.get("rate_limited", 0) + 1
+                    return 429, float(math.ceil(60.0 - (now - self._window[0])))
+                self._window.append(now)
+            r = self._rnd.random()
+            if r < cfg.fail_429:
+                self._stats["injected_429"] = self._stats.get("injected_429", 0) + 1
+                return 429, cfg.retry_after
+            if r < cfg.fail_429 + cfg.fail_5xx:
+                self._stats["injected_5xx"] = self._stats.get("injected_5xx", 0) + 1
+                return 503, 0.0
+        return None, 0.0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def bump_version(self) -> int:
+        """Simula una modifica al foglio: nuova versione (i dati sintetici restano gli stessi)."""
+        with self._lock:
+            self.sheet.version += 1
+            return self.sheet.version
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+            self._window.clear()
+
+    def start(self) -> "FakeSmartsheetServer":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-smartsheet", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ---------------- CLI ----------------
+def add_config_arguments(p: argparse.ArgumentParser):
+    """Opzioni di FakeSheetConfig (condivise con bench_exporter.py)."""
+    d = FakeSheetConfig()
+    p.add_argument("--rows", type=int, default=d.rows, help="righe del foglio")
+    p.add_argument("--image-ratio", type=float, default=d.image_ratio, help="quota di righe con immagine (0-1)")
+    p.add_argument("--extra-columns", type=int, default=d.extra_columns, help="colonne di testo aggiuntive")
+    p.add_argument("--image-size", type=int, nargs=2, default=list(d.image_size), metavar=("W", "H"))
+    p.add_argument("--image-format", type=str.upper, choices=("PNG", "JPEG", "WEBP"), default=d.image_format)
+    p.add_argument("--api-latency", type=float, default=d.api_latency, help="secondi per chiamata API")
+    p.add_argument("--image-latency", type=float, default=d.image_latency, help="secondi prima di ogni download")
+    p.add_argument("--bandwidth", type=float, default=d.bandwidth, help="byte/s per download (0 = illimitata)")
+    p.add_argument("--rate-limit", type=int, default=d.rate_per_minute, help="chiamate API al minuto (0 = nessun limite)")
+    p.add_argument("--fail-429", type=float, default=d.fail_429, help="probabilità di 429 per richiesta")
+    p.add_argument("--fail-5xx", type=float, default=d.fail_5xx, help="probabilità di 503 per richiesta")
+    p.add_argument("--retry-after", type=float, default=d.retry_after, help="secondi in Retry-After")
+    p.add_argument("--seed", type=int, default=d.seed)
+
+def config_from_args(args: argparse.Namespace) -> FakeSheetConfig:
+    return FakeSheetConfig(rows=args.rows, image_ratio=args.image_ratio, extra_columns=args.extra_columns,
+                           image_size=tuple(args.image_size), image_format=args.image_format,
+                           api_latency=args.api_latency, image_latency=args.image_latency,
+                           bandwidth=args.bandwidth, rate_per_minute=args.rate_limit,
+                           fail_429=args.fail_429, fail_5xx=args.fail_5xx,
+                           retry_after=args.retry_after, seed=args.seed)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(description="Smartsheet finto in locale (foglio sintetico con immagini in cella).")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    add_config_arguments(p)
+    args = p.parse_args(argv)
+    try:
+        srv = FakeSmartsheetServer(config_from_args(args), args.host, args.port)
+    except (ValueError, OSError) as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 2
+    print(f"API: {srv.api_base}  foglio {srv.config.sheet_id}  ({srv.config.rows} righe)")
+    print(f"Colonne: Foto={IMAGE_COLUMN_ID}, Nome={NAME_COLUMN_ID}. Ctrl+C per terminare.")
+    srv.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.stop()
+        print(json.dumps(srv.stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Log e avanzamento per le GUI Tk (web_image_resizer_gui.py, export_smartsheet_images_gui.py)
+
+- LogSink: i messaggi (da qualsiasi thread) vengono accodati e inseriti nel tk.Text con un
+  solo insert per frame; il widget mantiene solo le ultime max_lines righe (ring buffer),
+  il log completo viene scritto su file. Il costo per frame non dipende dalla durata del lotto.
+- ProgressTracker: barra determinata con conteggio, velocità e tempo residuo stimato;
+  indeterminata (con il conteggio) finché il totale non è noto.
+
+Uso:
+    self.sink = LogSink(self, self.txt_log, log_file=default_log_path("resizer"),
+                        progress=ProgressTracker(self.progress, self.lbl_progress))
+    self.sink.write("messaggio")           # da qualsiasi thread
+    self.sink.progress.start(total)        # poi .advance() per ogni elemento, .finish() alla fine
+"""
+
+import time
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional, List
+
+import tkinter as tk
+from tkinter import ttk
+
+MAX_LINES = 2000     # righe visibili nel widget
+FRAME_MS = 100       # intervallo di aggiornamento della GUI
+
+
+def default_log_path(tool: str) -> Path:
+    """logs/TOOL_AAAAMMGG_HHMMSS.log accanto agli script; cartella temporanea se non scrivibile."""
+    name = f"{tool}_{time.strftime('%Y%m%d_%H%M%S')}.log"
+    for folder in (Path(__file__).resolve().parent / "logs", Path(tempfile.gettempdir()) / "web_image_tools"):
+        try:
+            folder.mkdir(parents=True, exist_ok=True)
+            return folder / name
+        except OSError:
+            continue
+    return Path(tempfile.gettempdir()) / name
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+
+class ProgressTracker:
+    """
+    Avanzamento determinato: start(total) / advance(n) / finish() da qualsiasi thread,
+    render() dal thread della GUI (lo chiama LogSink a ogni frame).
+    Velocità media dall'avvio; il tempo residuo compare dopo i primi elementi.
+    """
+
+    def __init__(self, bar: ttk.Progressbar, label: Optional[ttk.Label] = None, unit: str = "file"):
+        self.bar = bar
+        self.label = label
+        self.unit = unit
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None
+        self._done = 0
+        self._started = 0.0
+        self._running = False
+        self._dirty = False
+        self._indeterminate = False
+
+    def start(self, total: Optional[int] = None, unit: Optional[str] = None):
+        """Nuovo lotto; total=None: barra indeterminata finché set_total() non lo fissa."""
+        with self._lock:
+            self._total = total
+            self._done = 0
+            self._started = time.perf_counter()
+            self._running = True
+            self._dirty = True
+            if unit:
+                self.unit = unit
+
+    def set_total(self, total: int):
+        """Fissa il totale, anche a lotto avviato (elenchi in streaming): il conteggio resta."""
+        with self._lock:
+            self._total = total
+            self._dirty = True
+
+    def advance(self, n: int = 1):
+        with self._lock:
+            self._done += n
+            self._dirty = True
+
+    def finish(self):
+        with self._lock:
+            self._running = False
+            self._dirty = True
+
+    def render(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            total, done, running = self._total, self._done, self._running
+            elapsed = time.perf_counter() - self._started
+
+        if running and not total:
+            if not self._indeterminate:
+                self.bar.configure(mode="indeterminate")
+                self.bar.start(80)
+                self._indeterminate = True
+            text = f"{done} {self.unit} · in corso…" if done else "In corso…"
+        else:
+            if self._indeterminate:
+                self.bar.stop()
+                self.bar.configure(mode="determinate")
+                self._indeterminate = False
+            self.bar.configure(maximum=max(1, total or 1), value=min(done, total or 0))
+            rate = done / elapsed if elapsed > 0 else 0.0
+            text = f"{done}/{total or 0} {self.unit}"
+            if rate > 0:
+                text += f" · {rate:.1f}/s"
+            if running and total and done and rate > 0:
+                text += f" · restano {format_duration((total - done) / rate)}"
+            elif not running:
+                text += f" · {format_duration(elapsed)}"
+        if self.label is not None:
+            self.label.configure(text=text)
+
+
+class LogSink:
+    """
+    Log della GUI a costo costante per frame. write() è sicuro da qualsiasi thread;
+    l'aggiornamento del widget avviene solo nel thread Tk, ogni FRAME_MS.
+    """
+
+    def __init__(self, root: tk.Misc, widget: tk.Text, log_file: Optional[Path] = None,
+                 max_lines: int = MAX_LINES, interval_ms: int = FRAME_MS,
+                 progress: Optional[ProgressTracker] = None):
+        self.root = root
+        self.widget = widget
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self.progress = progress
+        self.log_file = log_file
+        self._file = None
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+        self._shown = int(widget.index("end-1c").split(".")[0]) - 1  # righe già presenti
+        self._closed = False
+        self.root.after(self.interval_ms, self._tick)
+
+    def write(self, msg: str):
+        line = msg.rstrip() + "\n"
+        with self._lock:
+            self._pending.append(line)
+
+    __call__ = write
+
+    def _open_file(self):
+        if self._file is None and self.log_file is not None:
+            try:
+                self._file = open(self.log_file, "a", encoding="utf-8")
+            except OSError:
+                self.log_file = None
+
+    def _tick(self):
+        try:
+            self.flush()
+            if self.progress is not None:
+                self.progress.render()
+        finally:
+            if not self._closed:
+                self.root.after(self.interval_ms, self._tick)
+
+    def flush(self):
+        """Svuota la coda: una scrittura su file, un insert e al più un delete nel widget."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self._open_file()
+        if self._file is not None:
+            stamp = time.strftime("%H:%M:%S ")
+            self._file.write("".join(stamp + line for line in batch))
+            self._file.flush()
+
+        visible = batch[-self.max_lines:]
+        self.widget.insert("end", "".join(visible))
+        self._shown += sum(line.count("\n") for line in visible)
+        excess = self._shown - self.max_lines
+        if excess > 0:
+            self.widget.delete("1.0", f"{excess + 1}.0")
+            self._shown -= excess
+        self.widget.see("end")
+
+    def close(self):
+        self._closed = True
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
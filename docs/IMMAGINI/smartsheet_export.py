@@ -0,0 +1,1263 @@
+# -*- coding: utf-8 -*-
+"""
+Smartsheet Export - motore di esportazione immagini senza interfaccia grafica
+Usato da export_smartsheet_images_gui.py e utilizzabile da altri script Python.
+
+Funzioni principali:
+- Chiamate API Smartsheet: colonne, righe paginate, URL temporanei delle immagini in cella
+- ImageDownloader: download concorrenti su un pool di thread con una requests.Session
+  condivisa (connessioni keep-alive riusate: un solo handshake TCP+TLS per connessione),
+  risultati nell'ordine dei job, errori isolati per file, annullamento con stop_flag;
+  ogni file arriva a blocchi in un temporaneo rinominato a download completo (memoria fissa
+  per download) e viene convertito solo se i magic byte indicano un formato diverso
+- SheetImageExporter: esportazione a stadi sovrapposti (pagine di righe -> celle immagine ->
+  richieste URL a lotti -> download) collegati da code limitate: il primo file arriva dopo la
+  prima pagina e un lotto di URL, la memoria non cresce con la dimensione del foglio
+- Righe lette solo per le colonne necessarie (columnIds) e decodificate in streaming, una
+  riga alla volta, senza costruire il dizionario dell'intera pagina
+- RequestScheduler: tutte le chiamate passano da qui; token bucket sul limite al minuto
+  dell'API (adattivo: dimezzato a ogni 429, poi recuperato gradualmente), rispetto di
+  Retry-After, ritentativi con backoff esponenziale e jitter su 429/5xx/errori di rete,
+  concorrenza massima verso l'API e contatori (richieste, ritentativi, attese)
+- Modalità incrementale: un manifest nella cartella di destinazione (riga -> imageId, file,
+  byte, sha256) permette di saltare le immagini invariate prima di chiedere gli URL, di
+  rinominare i file quando cambia il valore della colonna di rinomina e di riprendere
+  un'esportazione annullata o interrotta
+- SheetCache: colonne e righe proiettate su disco per ID e versione del foglio; una chiamata
+  leggera alla versione decide se riusarle, i fogli usati meno di recente vengono eliminati
+  oltre CACHE_MAX_BYTES
+- Esportazione diretta in formato web (resize=ResizeSettings): i byte scaricati passano in
+  memoria da web_image_pipeline.process_file e su disco vengono scritti solo i file finali,
+  senza il PNG intermedio da rileggere e ridecodificare
+
+Dipendenze:
+- requests (pip install requests)
+- Pillow (opzionale, per forzare conversione in PNG - pip install pillow)
+- web_image_pipeline.py (opzionale, nella stessa cartella: esportazione diretta in formato web)
+
+Uso da Python:
+    from smartsheet_export import SheetImageExporter
+    exp = SheetImageExporter(token, sheet_id, img_col_id, name_col_id, Path("img_export"), workers=8)
+    for res in exp.run():
+        print(res.path.name, res.ok, res.error)
+
+    from web_image_pipeline import ResizeSettings
+    web = ResizeSettings(mode="exact", exact_w=600, exact_h=600, exact_mode="fill", format="WEBP")
+    exp = SheetImageExporter(token, sheet_id, img_col_id, name_col_id, Path("img_web"), resize=web)
+
+    from smartsheet_export import ImageDownloader
+    with ImageDownloader(token, workers=8) as dl:
+        for res in dl.download([(url, Path("out/nome.png")), ...]):
+            print(res.path.name, res.ok, res.error)
+"""
+
+import os
+import re
+import json
+import time
+import queue
+import codecs
+import random
+import hashlib
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from PIL import Image
+    PIL_OK = True
+except Exception:
+    PIL_OK = False
+
+try:
+    # Esportazione diretta in formato web (resize in memoria, vedi SheetImageExporter)
+    from web_image_pipeline import ResizeSettings, process_file, settings_digest
+    HAVE_PIPELINE = True
+except Exception:
+    HAVE_PIPELINE = False
+
+# SMARTSHEET_API_BASE: altro endpoint (es. fake_smartsheet_server.py per prove e benchmark)
+API_BASE = os.environ.get("SMARTSHEET_API_BASE", "https://api.smartsheet.com/2.0").rstrip("/")
+DOWNLOAD_WORKERS = 8   # download paralleli di default
+MAX_DOWNLOAD_WORKERS = 32
+API_RATE_PER_MINUTE = 300   # limite Smartsheet per token
+API_CONCURRENCY = 4         # chiamate API contemporanee (i download hanno il proprio limite: workers)
+MAX_RETRIES = 5
+RETRY_STATUS = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 1.0          # secondi; raddoppia a ogni tentativo
+BACKOFF_MAX = 60.0
+REQUEST_TIMEOUT = (10, 60)  # connessione, lettura (secondi)
+URL_BATCH = 80         # imageId per richiesta /imageurls
+QUEUE_SIZE = 4 * URL_BATCH  # elementi in attesa tra uno stadio e il successivo
+STREAM_CHUNK = 64 * 1024    # byte letti per volta dalle risposte in streaming
+SNIFF_BYTES = 16            # byte iniziali per riconoscere il formato di un download
+TRANSCODE_WORKERS = 2       # conversioni di formato contemporanee (immagine decodificata in RAM)
+PART_SUFFIX = ".part"       # download in corso (rinominato a file completo)
+MANIFEST_NAME = ".smartsheet_export_manifest.json"
+MANIFEST_VERSION = 1
+MANIFEST_SAVE_EVERY = 25    # download registrati tra un salvataggio e l'altro (ripresa dopo un crash)
+CACHE_VERSION = 2
+CACHE_MAX_BYTES = 64 * 2**20  # dimensione massima della cache delle risposte (SheetCache)
+
+def sanitize_filename(s: str) -> str:
+    s = (s or "").strip()
+    s = re.sub(r'[\\/:*?"<>|]+', "_", s)
+    s = re.sub(r"\s+", " ", s)
+    return s[:150] or "senza_nome"
+
+def headers(token: str, json_mode: bool=False) -> Dict[str, str]:
+    h = {"Authorization": f"Bearer {token}"}
+    if json_mode:
+        h["Content-Type"] = "application/json"
+    return h
+
+def make_session(pool_size: int = DOWNLOAD_WORKERS) -> requests.Session:
+    """Session con un pool di almeno pool_size connessioni per host (una per thread di download)."""
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size))
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+# ---------------- Limiti di frequenza (rate limit) ----------------
+class Cancelled(Exception):
+    """Attesa interrotta da stop_flag."""
+
+
+class TokenBucket:
+    """
+    Token bucket sul limite al minuto, con capacità burst. Adattivo (AIMD): throttled()
+    dimezza la frequenza, ogni successo la riporta gradualmente verso il massimo.
+    """
+
+    def __init__(self, rate_per_minute: float = API_RATE_PER_MINUTE, burst: int = 10):
+        self.max_rate = rate_per_minute / 60.0
+        self.rate = self.max_rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def reserve(self) -> float:
+        """Prenota un token; ritorna i secondi da attendere prima di usarlo (0 = subito)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def throttled(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+def retry_after_seconds(resp: requests.Response) -> Optional[float]:
+    """Valore di Retry-After in secondi (intero o data HTTP); None se assente o non valido."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """
+    Esegue le richieste HTTP per conto del motore; si usa al posto di una requests.Session
+    (stessi metodi get/post/close) in tutte le funzioni API e in ImageDownloader. Le funzioni
+    API chiamate senza session usano default_scheduler().
+
+    Chiamate all'API (URL che iniziano con API_BASE): token bucket sul limite al minuto e al più
+    api_concurrency contemporanee. Tutte le richieste: su 429/5xx o errore di rete fino a
+    max_retries ritentativi con backoff esponenziale e jitter; Retry-After, se presente, viene
+    rispettato e un 429 mette in pausa tutte le chiamate API (non solo quella rifiutata).
+    Dopo l'ultimo tentativo la risposta (o l'eccezione) passa al chiamante.
+    stop_flag interrompe le attese (eccezione Cancelled). Contatori: stats().
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, stop_flag: Optional[threading.Event] = None,
+                 rate_per_minute: float = API_RATE_PER_MINUTE, api_concurrency: int = API_CONCURRENCY,
+                 max_retries: int = MAX_RETRIES, backoff_base: float = BACKOFF_BASE,
+                 timeout=REQUEST_TIMEOUT):
+        self.session = session or make_session()
+        self.stop_flag = stop_flag or threading.Event()
+        self.bucket = TokenBucket(rate_per_minute)
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(1, int(api_concurrency)))
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.requests = self.retries = self.throttled = self.failures = 0
+        self.throttle_waits = 0
+        self.throttle_wait_s = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": self.requests, "retries": self.retries, "throttled": self.throttled,
+                    "failures": self.failures, "throttle_waits": self.throttle_waits,
+                    "throttle_wait_s": round(self.throttle_wait_s, 2),
+                    "rate_per_minute": round(self.bucket.rate * 60, 1)}
+
+    def _sleep(self, seconds: float, throttle: bool = False):
+        if seconds <= 0:
+            return
+        if throttle:
+            with self._lock:
+                self.throttle_waits += 1
+                self.throttle_wait_s += seconds
+        if self.stop_flag.wait(seconds):
+            raise Cancelled("operazione annullata")
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 0.1 * retry_after + 0.1)
+        delay = min(BACKOFF_MAX, self.backoff_base * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _throttle(self):
+        """Attesa prima di una chiamata API: pausa dopo un 429, poi un token del bucket."""
+        pause = self._paused_until - time.monotonic()
+        self._sleep(pause, throttle=True)
+        self._sleep(self.bucket.reserve(), throttle=True)
+
+    def request(self, method: str, url: str, **kw) -> requests.Response:
+        kw.setdefault("timeout", self.timeout)
+        api = url.startswith(API_BASE)
+        attempt = 0
+        while True:
+            if api:
+                self._throttle()
+                self._slots.acquire()
+            try:
+                with self._lock:
+                    self.requests += 1
+                resp = self.session.request(method, url, **kw)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                resp, error = None, e
+            finally:
+                if api:
+                    self._slots.release()
+
+            if error is None and resp.status_code not in RETRY_STATUS:
+                if api:
+                    self.bucket.succeeded()
+                return resp
+            retry_after = None
+            if resp is not None:
+                retry_after = retry_after_seconds(resp)
+                if resp.status_code == 429:
+                    with self._lock:
+                        self.throttled += 1
+                    if api:
+                        self.bucket.throttled()
+            if attempt >= self.max_retries:
+                with self._lock:
+                    self.failures += 1
+                if error is not None:
+                    raise error
+                return resp
+            delay = self._backoff(attempt, retry_after)
+            if resp is not None:
+                resp.close()
+                if resp.status_code == 429 and api:
+                    with self._lock:
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            with self._lock:
+                self.retries += 1
+            attempt += 1
+            self._sleep(delay, throttle=resp is not None and resp.status_code == 429)
+
+    def get(self, url: str, **kw) -> requests.Response:
+        return self.request("GET", url, **kw)
+
+    def post(self, url: str, **kw) -> requests.Response:
+        return self.request("POST", url, **kw)
+
+    def close(self):
+        self.session.close()
+
+
+_default_scheduler: Optional[RequestScheduler] = None
+_default_lock = threading.Lock()
+
+def default_scheduler() -> RequestScheduler:
+    """Scheduler condiviso dalle funzioni API chiamate senza session (stesso limite di frequenza)."""
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler(make_session(MAX_DOWNLOAD_WORKERS))
+        return _default_scheduler
+
+def get_sheet_version(token: str, sheet_id: int, session: Optional[requests.Session] = None) -> int:
+    """Versione corrente del foglio (cambia a ogni modifica); nessuna riga trasferita."""
+    r = (session or default_scheduler()).get(f"{API_BASE}/sheets/{sheet_id}/version", headers=headers(token))
+    r.raise_for_status()
+    return int(r.json()["version"])
+
+def get_sheet_columns(token: str, sheet_id: int, session: Optional[requests.Session] = None,
+                      cache: Optional["SheetCache"] = None) -> List[Dict[str, Any]]:
+    # Recupera solo metadati del foglio (incluse colonne). Una singola pagina è sufficiente.
+    # Con cache: se la versione del foglio non è cambiata le colonne arrivano dal disco.
+    version = None
+    if cache is not None:
+        version = get_sheet_version(token, sheet_id, session)
+        cols = cache.columns(sheet_id, version)
+        if cols is not None:
+            return cols
+    url = f"{API_BASE}/sheets/{sheet_id}?pageSize=1"
+    r = (session or default_scheduler()).get(url, headers=headers(token))
+    r.raise_for_status()
+    data = r.json()
+    cols = data.get("columns", [])
+    if cache is not None:
+        cache.store(sheet_id, data.get("version", version), columns=cols)
+    return cols
+
+def iter_json_array(chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+    """
+    Elementi dell'array `key` al primo livello di un oggetto JSON, decodificati uno alla volta
+    mentre i chunk (bytes) arrivano: in memoria restano solo l'elemento corrente e il chunk.
+    Le altre chiavi vengono scorse senza costruire oggetti. Nessun elemento se la chiave manca.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf, pos = "", 0
+
+    def more() -> bool:
+        nonlocal buf, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            tail = utf8.decode(b"", final=True)
+            buf, pos = buf[pos:] + tail, 0
+            return bool(tail)
+        buf, pos = buf[pos:] + utf8.decode(chunk), 0
+        return True
+
+    # Fase 1: scansione fino a  "key": [  al primo livello (stringhe ed escape compresi)
+    depth, in_str, esc = 0, False, False
+    text: Optional[List[str]] = None  # stringa in lettura al primo livello (possibile chiave)
+    last = None
+    while True:
+        if pos >= len(buf) and not more():
+            return
+        c = buf[pos]
+        pos += 1
+        if in_str:
+            if esc:
+                esc = False
+            elif c == "\\":
+                esc = True
+            elif c == '"':
+                in_str = False
+                if text is not None:
+                    last, text = "".join(text), None
+                continue
+            if text is not None:
+                text.append(c)
+        elif c == '"':
+            in_str = True
+            text = [] if depth == 1 else None
+        elif c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth -= 1
+        elif c == ",":
+            last = None
+        elif c == ":" and depth == 1 and last == key:
+            break
+    while pos >= len(buf) or buf[pos].isspace():
+        if pos < len(buf):
+            pos += 1
+        elif not more():
+            return
+    if buf[pos] != "[":
+        return  # la chiave non contiene un array
+    pos += 1
+
+    # Fase 2: un elemento alla volta
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+            pos += 1
+        if pos >= len(buf):
+            if not more():
+                raise ValueError(f"JSON troncato nell'array {key!r}")
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if not more():
+                raise
+            continue
+        if buf[pos] not in "{[\"" and (end == len(buf) or buf[end] not in ",]" and not buf[end].isspace()):
+            # Numero/letterale non ancora seguito da un separatore: può continuare nel chunk
+            # successivo anche se il prefisso è già JSON valido ("-2500." -> -2500, "1.5e" -> 1.5)
+            if more():
+                continue
+        pos = end
+        yield obj
+
+def iter_sheet_rows(token: str, sheet_id: int, page_size: int = 500, session: Optional[requests.Session] = None,
+                    column_ids: Optional[Iterable[int]] = None):
+    """
+    Itera tutte le righe con paginazione per evitare timeouts su fogli grandi.
+    column_ids: solo le celle di queste colonne (proiezione lato server, celle vuote escluse).
+    Ogni pagina viene letta in streaming: le righe arrivano mentre la risposta è in download.
+    """
+    query = f"pageSize={page_size}"
+    if column_ids:
+        query += "&columnIds=" + ",".join(str(c) for c in column_ids) + "&exclude=nonexistentCells"
+    page = 1
+    while True:
+        url = f"{API_BASE}/sheets/{sheet_id}?{query}&page={page}"
+        with (session or default_scheduler()).get(url, headers=headers(token), stream=True) as r:
+            r.raise_for_status()
+            n = 0
+            for row in iter_json_array(r.iter_content(STREAM_CHUNK), "rows"):
+                n += 1
+                yield row
+        # Heuristica: se arriviamo a meno del page_size, presumiamo fine
+        if n < page_size:
+            break
+        page += 1
+
+def post_image_urls(token: str, image_ids: List[str], session: Optional[requests.Session] = None) -> List[str]:
+    # Richiede URL temporanei per imageId
+    payload = [{"imageId": iid} for iid in image_ids]
+    r = (session or default_scheduler()).post(f"{API_BASE}/imageurls", headers=headers(token, json_mode=True), json=payload)
+    r.raise_for_status()
+    data = r.json()
+    return [item.get("url") for item in data.get("imageUrls", []) if item.get("url")]
+
+def post_image_url_map(token: str, image_ids: List[str], session: Optional[requests.Session] = None) -> Dict[str, str]:
+    """Come post_image_urls, ma {imageId: url}: le immagini senza URL non spostano le altre."""
+    payload = [{"imageId": iid} for iid in image_ids]
+    r = (session or default_scheduler()).post(f"{API_BASE}/imageurls", headers=headers(token, json_mode=True), json=payload)
+    r.raise_for_status()
+    data = r.json()
+    return {item["imageId"]: item["url"] for item in data.get("imageUrls", []) if item.get("imageId") and item.get("url")}
+
+# Firme dei formati (primi byte del file) -> nome formato Pillow
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+)
+_SUFFIX_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG", ".webp": "WEBP", ".gif": "GIF",
+                   ".bmp": "BMP", ".tif": "TIFF", ".tiff": "TIFF"}
+# Modi che il formato di destinazione salva così come sono; gli altri passano da RGB(A)
+_SAVE_MODES = {"PNG": {"1", "L", "LA", "I", "I;16", "P", "RGB", "RGBA"}, "JPEG": {"L", "RGB", "CMYK"}}
+
+_transcode_slots = threading.BoundedSemaphore(TRANSCODE_WORKERS)
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """Formato dai magic byte (primi SNIFF_BYTES byte); None se non riconosciuto."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for magic, fmt in _MAGIC:
+        if head.startswith(magic):
+            return fmt
+    return None
+
+def _transcode(src: Path, dst: Path, fmt: str):
+    """Converte il file src nel formato fmt scrivendo dst (decodifica dal file, non da memoria)."""
+    with _transcode_slots, Image.open(src) as img:
+        params = {}
+        if img.info.get("icc_profile"):
+            params["icc_profile"] = img.info["icc_profile"]
+        if img.mode not in _SAVE_MODES.get(fmt, {img.mode}):
+            has_alpha = "A" in img.getbands() or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha and fmt != "JPEG" else "RGB")
+        img.save(dst, format=fmt, **params)
+
+def download_and_save_png(token: str, url: str, out_path: Path, session: Optional[requests.Session] = None) -> int:
+    """
+    Scarica url in out_path; ritorna i byte scaricati.
+    La risposta viene scritta a blocchi di STREAM_CHUNK in un file temporaneo nella stessa
+    cartella e poi rinominata (os.replace): in memoria c'è un solo blocco per download e un
+    file interrotto non prende mai il nome definitivo. Il formato di destinazione viene
+    dall'estensione di out_path (default PNG): se i magic byte dicono che il file è già in
+    quel formato (o non è un'immagine riconosciuta) resta com'è, altrimenti viene convertito
+    con Pillow leggendo dal file temporaneo, al più TRANSCODE_WORKERS conversioni insieme.
+    """
+    fmt = _SUFFIX_FORMATS.get(out_path.suffix.lower(), "PNG")
+    fd, name = tempfile.mkstemp(prefix=f".{out_path.name}.", suffix=PART_SUFFIX, dir=out_path.parent)
+    tmp = Path(name)
+    conv = None
+    try:
+        n = 0
+        head = b""
+        with os.fdopen(fd, "wb") as f, \
+                (session or default_scheduler()).get(url, headers=headers(token), stream=True) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(STREAM_CHUNK):
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                f.write(chunk)
+                n += len(chunk)
+        found = sniff_image_format(head)
+        if PIL_OK and found is not None and found != fmt:
+            conv = tmp.with_name(tmp.name + ".conv")
+            try:
+                _transcode(tmp, conv, fmt)
+                os.replace(conv, out_path)
+                return n
+            except Exception:
+                pass  # conversione non riuscita: si salva il file scaricato così com'è
+        os.replace(tmp, out_path)
+        return n
+    finally:
+        for leftover in (tmp, conv):
+            if leftover is not None:
+                try:
+                    leftover.unlink()
+                except OSError:
+                    pass
+
+def fetch_image_bytes(token: str, url: str, session: Optional[requests.Session] = None) -> bytes:
+    """Scarica url in memoria (per l'elaborazione diretta, senza file intermedio)."""
+    buf = bytearray()
+    with (session or default_scheduler()).get(url, headers=headers(token), stream=True) as resp:
+        resp.raise_for_status()
+        for chunk in resp.iter_content(STREAM_CHUNK):
+            buf += chunk
+    return bytes(buf)
+
+def remove_partial_downloads(folder: Path) -> int:
+    """Elimina i temporanei lasciati da download interrotti (processo terminato); ritorna quanti."""
+    removed = 0
+    for tmp in Path(folder).glob(f".*{PART_SUFFIX}*"):
+        try:
+            tmp.unlink()
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+# ---------------- Download concorrenti ----------------
+@dataclass
+class DownloadResult:
+    """Esito del download di un singolo file."""
+    url: str
+    path: Path
+    ok: bool
+    error: str = ""
+    bytes: int = 0
+    item: Any = None     # dato del chiamante associato al job (es. ExportItem)
+    unchanged: bool = False   # modalità incrementale: già esportato, nessun download
+    renamed_from: str = ""    # modalità incrementale: file esistente rinominato (nome precedente)
+    written: int = 0          # con resize: byte del file web scritto (bytes = byte scaricati)
+
+
+class ImageDownloader:
+    """
+    Scarica file su un pool di workers thread con una requests.Session condivisa,
+    attraverso un RequestScheduler (ritentativi, limiti di frequenza).
+
+    download(jobs) accetta (url, percorso[, item]) e restituisce i DownloadResult nello stesso
+    ordine dei job (log leggibile), con al più workers * 2 download in volo: i job vengono
+    letti man mano, anche da un generatore. Un errore su un file non interrompe gli altri.
+    Un job che è già un DownloadResult (es. file invariato) viene restituito al suo posto.
+    stop_flag (threading.Event, opzionale) interrompe: i download non avviati vengono
+    scartati, quelli in corso completati ma non restituiti.
+    resize (ResizeSettings, opzionale): i byte scaricati restano in memoria e passano da
+    process_file (decodifica, sRGB, resize, codifica) nello stesso thread; su disco va solo
+    il file finale, percorso del job con l'estensione del formato scelto.
+    """
+
+    def __init__(self, token: str, workers: int = DOWNLOAD_WORKERS,
+                 stop_flag: Optional[threading.Event] = None,
+                 session: Optional[requests.Session] = None,
+                 resize: Optional["ResizeSettings"] = None):
+        self.token = token
+        self.workers = max(1, int(workers))
+        self.resize = resize
+        self.stop_flag = stop_flag or threading.Event()
+        self._own_session = session is None
+        if isinstance(session, RequestScheduler):
+            self.session = session
+        else:
+            self.session = RequestScheduler(session or make_session(self.workers), self.stop_flag)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.stop_flag.is_set()
+
+    def _fetch(self, url: Optional[str], path: Path, item: Any = None) -> DownloadResult:
+        if not url:
+            return DownloadResult(url or "", path, ok=False, error="URL di download non disponibile", item=item)
+        try:
+            if self.resize is not None:
+                return self._fetch_resized(url, path, item)
+            n = download_and_save_png(self.token, url, path, self.session)
+            return DownloadResult(url, path, ok=True, bytes=n, item=item)
+        except Exception as e:
+            return DownloadResult(url, path, ok=False, error=str(e), item=item)
+
+    def _fetch_resized(self, url: str, path: Path, item: Any) -> DownloadResult:
+        data = fetch_image_bytes(self.token, url, self.session)
+        ext = self.resize.extension
+        base = path.with_name(path.name[:-len(ext)] if path.name.endswith(ext) else path.name)
+        res = process_file(path, path.name, base, self.resize, data=data)
+        if not res.ok:
+            return DownloadResult(url, path, ok=False, error=res.error, bytes=len(data), item=item)
+        return DownloadResult(url, res.out_path, ok=True, bytes=len(data), written=res.new_size, item=item)
+
+    def download(self, jobs: Iterable[Tuple[str, Path]]) -> Iterator[DownloadResult]:
+        jobs = iter(jobs)
+        max_in_flight = self.workers * 2
+        in_flight = deque()
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+        try:
+            while True:
+                while len(in_flight) < max_in_flight and not self.cancelled:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    if isinstance(job, DownloadResult):
+                        fut = Future()
+                        fut.set_result(job)
+                    else:
+                        fut = pool.submit(self._fetch, *job)
+                    in_flight.append(fut)
+                if not in_flight or self.cancelled:
+                    return
+                # Attende il più vecchio: ordine dei job, annullamento verificato a intervalli
+                try:
+                    res = in_flight[0].result(timeout=0.2)
+                except FutureTimeout:
+                    continue
+                in_flight.popleft()
+                yield res
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def close(self):
+        if self._own_session:
+            self.session.close()
+
+    def __enter__(self) -> "ImageDownloader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------------- Manifest (modalità incrementale) ----------------
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def write_json_atomic(path: Path, data: Any):
+    """Scrive su un file temporaneo nella stessa cartella e rinomina: mai manifest scritti a metà."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class ExportManifest:
+    """
+    Stato delle esportazioni, salvato in DESTINAZIONE/.smartsheet_export_manifest.json.
+
+    Per ogni riga (chiave: row id) registra imageId, file prodotto, byte e sha256.
+    Un'immagine è invariata se la riga ha ancora lo stesso imageId (Smartsheet assegna un
+    nuovo id a ogni immagine caricata) e il file esiste con la stessa dimensione.
+    Le voci di un altro foglio vengono ignorate. Quelle prodotte con parametri di conversione
+    diversi (params: digest di ResizeSettings nell'esportazione diretta, "" per i PNG originali)
+    non valgono come invariate ma restano in "stale" finché la riga non viene riesportata:
+    record() elimina allora il vecchio file se ha un altro nome (es. .webp -> .jpg), come
+    ResizeManifest. Sicuro da più thread.
+    """
+
+    def __init__(self, out_dir: Path, sheet_id: int, params: str = ""):
+        self.out_dir = out_dir
+        self.path = out_dir / MANIFEST_NAME
+        self.sheet_id = sheet_id
+        self.params = params
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._previous: Dict[str, Dict[str, Any]] = {}  # voci con parametri diversi (file da sostituire)
+        self._owners: Dict[str, str] = {}  # nome file -> row id (anche delle voci in _previous)
+        self._lock = threading.Lock()
+        self._unsaved = 0
+
+    @classmethod
+    def load(cls, out_dir: Path, sheet_id: int, params: str = "") -> "ExportManifest":
+        m = cls(out_dir, sheet_id, params)
+        try:
+            data = json.loads(m.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return m
+        if data.get("version") != MANIFEST_VERSION or data.get("sheet_id") != sheet_id:
+            return m
+        m._previous = data.get("stale", {})
+        if data.get("params", "") == params:
+            m.entries = data.get("rows", {})
+        else:
+            # Parametri cambiati: tutto da riesportare; le vecchie voci servono solo a
+            # rimuovere i file con nome diverso (es. cambio formato)
+            m._previous = {**m._previous, **data.get("rows", {})}
+        m._owners = {e["file"]: row for rows in (m._previous, m.entries) for row, e in rows.items()}
+        return m
+
+    def owner(self, fname: str) -> Optional[str]:
+        """Row id a cui appartiene il file (None: file non prodotto da questo manifest)."""
+        with self._lock:
+            return self._owners.get(fname)
+
+    def current(self, item: "ExportItem") -> Optional[str]:
+        """Nome del file già esportato per item se l'immagine è invariata, altrimenti None."""
+        with self._lock:
+            entry = self.entries.get(str(item.row_id))
+        if not entry or entry["image_id"] != item.image_id:
+            return None
+        try:
+            if (self.out_dir / entry["file"]).stat().st_size != entry["bytes"]:
+                return None
+        except OSError:
+            return None
+        return entry["file"]
+
+    def matches(self, item: "ExportItem", fname: str) -> bool:
+        """True se il file (non registrato) è quello già esportato per item: stessa immagine, byte e sha256."""
+        with self._lock:
+            entry = self.entries.get(str(item.row_id))
+        if not entry or entry["image_id"] != item.image_id:
+            return False
+        path = self.out_dir / fname
+        try:
+            return path.stat().st_size == entry["bytes"] and file_sha256(path) == entry["sha256"]
+        except OSError:
+            return False
+
+    def rename(self, item: "ExportItem", old: str, new: str):
+        os.replace(self.out_dir / old, self.out_dir / new)
+        with self._lock:
+            key = str(item.row_id)
+            self.entries[key]["file"] = new
+            self._owners.pop(old, None)
+            self._owners[new] = key
+            self._unsaved += 1
+
+    def record(self, item: "ExportItem", path: Path):
+        entry = {"image_id": item.image_id, "file": path.name,
+                 "bytes": path.stat().st_size, "sha256": file_sha256(path)}
+        with self._lock:
+            key = str(item.row_id)
+            old = self.entries.get(key)
+            stale = self._previous.pop(key, None)
+            for prev in (old, stale):
+                if prev and self._owners.get(prev["file"]) == key:
+                    del self._owners[prev["file"]]
+                    if prev["file"] != path.name:
+                        (self.out_dir / prev["file"]).unlink(missing_ok=True)
+            self.entries[key] = entry
+            self._owners[path.name] = key
+            self._unsaved += 1
+            flush = self._unsaved >= MANIFEST_SAVE_EVERY
+        if flush:
+            self.save()
+
+    def forget(self, keep: Iterable[str]):
+        """Dimentica le righe non più presenti nel foglio (i file restano su disco)."""
+        keep = set(keep)
+        with self._lock:
+            for rows in (self.entries, self._previous):
+                for key in [k for k in rows if k not in keep]:
+                    self._owners.pop(rows.pop(key)["file"], None)
+                    self._unsaved += 1
+
+    def save(self):
+        with self._lock:
+            if not self._unsaved:
+                return
+            data = {"version": MANIFEST_VERSION, "sheet_id": self.sheet_id, "params": self.params,
+                    "rows": dict(self.entries), "stale": dict(self._previous)}
+            self._unsaved = 0
+        write_json_atomic(self.path, data)
+
+
+# ---------------- Cache delle risposte (per versione del foglio) ----------------
+def default_cache_dir() -> Path:
+    """
+    Cartella di cache dell'utente, fuori dal repository: %LOCALAPPDATA% su Windows,
+    $XDG_CACHE_HOME o ~/.cache altrove; cartella temporanea se non scrivibile.
+    """
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    for folder in (Path(base) / "smartsheet_export", Path(tempfile.gettempdir()) / "smartsheet_export_cache"):
+        try:
+            folder.mkdir(parents=True, exist_ok=True)
+            return folder
+        except OSError:
+            continue
+    return Path(tempfile.gettempdir())
+
+def _projection_key(column_ids: Optional[Iterable[int]]) -> str:
+    key = ",".join(sorted(str(c) for c in column_ids)) if column_ids else "*"
+    return hashlib.sha256(key.encode("ascii")).hexdigest()[:16]
+
+
+class RowCacheWriter:
+    """
+    Righe di SheetCache scritte una alla volta (JSON Lines) in un temporaneo nella cartella
+    della cache: commit() lo rinomina al posto del file delle righe, abort() lo elimina.
+    Se la cache non è scrivibile le righe vengono scartate senza errori.
+    """
+
+    def __init__(self, cache: "SheetCache", path: Path, header: Dict[str, Any]):
+        self.cache = cache
+        self.path = path
+        self._tmp: Optional[str] = None
+        self._file = None
+        try:
+            cache.folder.mkdir(parents=True, exist_ok=True)
+            fd, self._tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=cache.folder)
+            self._file = os.fdopen(fd, "w", encoding="utf-8")
+            self.write(header)
+        except OSError:
+            self.abort()
+
+    def write(self, row: Dict[str, Any]):
+        if self._file is None:
+            return
+        try:
+            self._file.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n")
+        except OSError:
+            self.abort()
+
+    def commit(self):
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+            os.replace(self._tmp, self.path)
+        except OSError:
+            self.abort()
+            return
+        self._file = self._tmp = None
+        self.cache.evict(keep=self.path)
+
+    def abort(self):
+        """Scarta le righe scritte (nessun effetto dopo commit)."""
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+        if self._tmp is not None:
+            try:
+                os.unlink(self._tmp)
+            except OSError:
+                pass
+            self._tmp = None
+
+
+class SheetCache:
+    """
+    Cache su disco di colonne e righe proiettate (solo le colonne richieste) per ID e versione
+    del foglio: Smartsheet incrementa la versione a ogni modifica, quindi get_sheet_version (una
+    chiamata leggera, senza righe) basta a decidere se i dati salvati sono ancora quelli del
+    foglio. Colonne in sheet_ID.json; righe in sheet_ID_PROIEZIONE.jsonl, un'intestazione con
+    la versione e poi una riga JSON per riga del foglio, scritte (writer) e rilette (rows) in
+    streaming: la memoria non dipende dal numero di righe. Una versione diversa sostituisce i
+    file. La dimensione totale resta entro max_bytes eliminando i file usati meno di recente
+    (mtime, aggiornato a ogni lettura). Sicura da più thread.
+    """
+
+    def __init__(self, folder: Optional[Path] = None, max_bytes: int = CACHE_MAX_BYTES):
+        self.folder = Path(folder) if folder else default_cache_dir()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, sheet_id: int) -> Path:
+        return self.folder / f"sheet_{sheet_id}.json"
+
+    def _rows_path(self, sheet_id: int, column_ids: Optional[Iterable[int]]) -> Path:
+        return self.folder / f"sheet_{sheet_id}_{_projection_key(column_ids)}.jsonl"
+
+    @staticmethod
+    def _header(sheet_id: int, version: int) -> Dict[str, Any]:
+        return {"cache": CACHE_VERSION, "sheet_id": sheet_id, "version": version}
+
+    @staticmethod
+    def _touch(path: Path):
+        try:
+            os.utime(path)  # usato di recente: ultimo a essere eliminato
+        except OSError:
+            pass
+
+    def columns(self, sheet_id: int, version: int) -> Optional[List[Dict[str, Any]]]:
+        path = self._path(sheet_id)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if {k: data.get(k) for k in ("cache", "sheet_id", "version")} != self._header(sheet_id, version):
+            return None
+        self._touch(path)
+        return data.get("columns")
+
+    def rows(self, sheet_id: int, version: int, column_ids: Optional[Iterable[int]] = None) -> Optional[Iterator[Dict[str, Any]]]:
+        """Iteratore sulle righe salvate per la versione e la proiezione indicate (None se assenti)."""
+        path = self._rows_path(sheet_id, column_ids)
+        try:
+            f = open(path, encoding="utf-8")
+        except OSError:
+            return None
+        try:
+            header = json.loads(f.readline())
+        except (OSError, ValueError):
+            header = None
+        if header != self._header(sheet_id, version):
+            f.close()
+            return None
+        self._touch(path)
+        return self._read_rows(f)
+
+    @staticmethod
+    def _read_rows(f) -> Iterator[Dict[str, Any]]:
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+    def writer(self, sheet_id: int, version: int, column_ids: Optional[Iterable[int]] = None) -> RowCacheWriter:
+        """Scrittura in streaming delle righe (proiezione column_ids) della versione indicata."""
+        return RowCacheWriter(self, self._rows_path(sheet_id, column_ids), self._header(sheet_id, version))
+
+    def store(self, sheet_id: int, version: int, columns: List[Dict[str, Any]]):
+        """Salva le colonne della versione indicata."""
+        path = self._path(sheet_id)
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            data = {**self._header(sheet_id, version), "columns": columns}
+            tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            return  # cache non scrivibile: si continua senza
+        self.evict(keep=path)
+
+    def evict(self, keep: Optional[Path] = None):
+        """Elimina i file usati meno di recente finché la cache supera max_bytes (keep escluso)."""
+        with self._lock:
+            files = []
+            for f in self.folder.glob("sheet_*.json*"):
+                try:
+                    st = f.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, f))
+            total = sum(size for _, size, _ in files)
+            for _, size, f in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if f == keep:
+                    continue
+                try:
+                    f.unlink()
+                    total -= size
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            for pattern in ("sheet_*.json*", ".sheet_*.tmp"):
+                for f in self.folder.glob(pattern):
+                    f.unlink(missing_ok=True)
+
+
+# ---------------- Esportazione a stadi ----------------
+class _StageError:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+def prefetch(items: Iterable, maxsize: int = QUEUE_SIZE,
+             stop_flag: Optional[threading.Event] = None) -> Iterator:
+    """
+    Consuma items in un thread dedicato attraverso una coda di al più maxsize elementi:
+    lo stadio a monte avanza mentre quello a valle lavora, senza accumulare più di maxsize
+    elementi. Le eccezioni del produttore vengono rilanciate nel consumatore.
+    """
+    q: "queue.Queue" = queue.Queue(maxsize)
+    end = object()
+    closed = threading.Event()
+    stop_flag = stop_flag or threading.Event()
+
+    def put(x) -> bool:
+        while not closed.is_set():
+            try:
+                q.put(x, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for x in items:
+                if stop_flag.is_set() or not put(x):
+                    return
+            put(end)
+        except BaseException as e:
+            if not stop_flag.is_set():  # annullamento: nessun errore da riportare
+                put(_StageError(e))
+
+    t = threading.Thread(target=produce, name="prefetch", daemon=True)
+    t.start()
+    try:
+        while True:
+            try:
+                x = q.get(timeout=0.2)
+            except queue.Empty:
+                if not t.is_alive() and q.empty():
+                    return  # produttore fermato da stop_flag
+                continue
+            if x is end:
+                return
+            if isinstance(x, _StageError):
+                raise x.exc
+            yield x
+    finally:
+        closed.set()  # consumatore chiuso o annullato: sblocca il produttore
+
+
+@dataclass
+class ExportItem:
+    """Immagine in cella da esportare: solo i dati necessari, non l'intera riga."""
+    row_id: int
+    image_id: str
+    name: str           # valore della colonna di rinomina (o row_ID se vuoto)
+    path: Optional[Path] = None   # file di destinazione (nome univoco assegnato in ordine di riga)
+    done: Optional[DownloadResult] = field(default=None, repr=False)  # invariato/rinominato: nessun download
+
+
+class SheetImageExporter:
+    """
+    Esporta le immagini della colonna img_col_id in out_dir, nominate con il valore di name_col_id.
+
+    Stadi sovrapposti, ognuno nel proprio thread e collegato al successivo da una coda limitata
+    (QUEUE_SIZE): pagine di righe -> ExportItem -> lotti di batch imageId a /imageurls ->
+    download su ImageDownloader. run() restituisce i DownloadResult (item = ExportItem)
+    nell'ordine delle righe, mentre le pagine successive sono ancora in lettura.
+    Contatori: rows, images, url_requests; listed diventa True a elenco righe completato.
+    incremental=True usa il manifest in destinazione (ExportManifest): le immagini invariate
+    sono restituite con unchanged=True senza richiedere URL, quelle con un nuovo nome vengono
+    rinominate su disco (renamed_from); il manifest viene salvato ogni MANIFEST_SAVE_EVERY
+    download, quindi un'esportazione interrotta riprende dall'ultimo salvataggio.
+    resize (ResizeSettings senza varianti): esportazione diretta in formato web, ogni immagine
+    scaricata viene ridimensionata e codificata in memoria e su disco va solo il file finale
+    (NOME.webp/.jpg/.png); il manifest è legato ai parametri: cambiandoli si riesporta tutto e i
+    file prodotti con i parametri precedenti vengono sostituiti.
+    cache (SheetCache): se la versione del foglio è quella salvata, le righe vengono lette dal
+    disco senza elencarle dall'API (from_cache=True); altrimenti vengono scritte man mano in un
+    temporaneo che diventa la cache a elenco completo.
+    """
+
+    def __init__(self, token: str, sheet_id: int, img_col_id: int, name_col_id: int, out_dir: Path,
+                 prefix: str = "", workers: int = DOWNLOAD_WORKERS, batch: int = URL_BATCH,
+                 stop_flag: Optional[threading.Event] = None, session: Optional[requests.Session] = None,
+                 incremental: bool = True, resize: Optional["ResizeSettings"] = None,
+                 cache: Optional[SheetCache] = None):
+        if resize is not None:
+            if not HAVE_PIPELINE:
+                raise RuntimeError("L'esportazione web richiede web_image_pipeline.py e Pillow (pip install pillow)")
+            resize = resize.validate()
+            if resize.variants:
+                raise ValueError("Le varianti non sono supportate nell'esportazione diretta")
+        self.resize = resize
+        self.ext = resize.extension if resize else ".png"
+        self.token, self.sheet_id = token, sheet_id
+        self.img_col_id, self.name_col_id = img_col_id, name_col_id
+        self.out_dir = Path(out_dir)
+        self.prefix = prefix
+        self.batch = max(1, int(batch))
+        self.stop_flag = stop_flag or threading.Event()
+        self.downloader = ImageDownloader(token, workers, self.stop_flag, session, resize)
+        self.session = self.downloader.session
+        self.incremental = incremental
+        self.cache = cache
+        self.manifest: Optional[ExportManifest] = None
+        self.rows = self.images = self.url_requests = 0
+        self.listed = False
+        self.version: Optional[int] = None   # versione del foglio (solo con cache)
+        self.from_cache = False
+        self._row_ids: List[str] = []   # righe con immagine viste (per aggiornare il manifest)
+        self._seen: set = set()         # nomi file già assegnati in questa esecuzione
+
+    @property
+    def cancelled(self) -> bool:
+        return self.stop_flag.is_set()
+
+    # ---- Stadio 1: righe -> celle immagine (nome file, confronto con il manifest)
+    def _items(self) -> Iterator[ExportItem]:
+        column_ids = (self.img_col_id, self.name_col_id)
+        rows, writer = None, None
+        if self.cache is not None:
+            self.version = get_sheet_version(self.token, self.sheet_id, self.session)
+            rows = self.cache.rows(self.sheet_id, self.version, column_ids)
+            self.from_cache = rows is not None
+            if rows is None:
+                # Righe proiettate (due celle) scritte man mano, al loro posto a elenco completo
+                writer = self.cache.writer(self.sheet_id, self.version, column_ids)
+        if rows is None:
+            rows = iter_sheet_rows(self.token, self.sheet_id, session=self.session, column_ids=column_ids)
+        try:
+            yield from self._cells(rows, writer)
+            self.listed = True
+            if writer is not None and not self.cancelled:
+                writer.commit()
+        finally:
+            if writer is not None:
+                writer.abort()  # elenco interrotto: nessuna cache parziale
+
+    def _cells(self, rows: Iterable[Dict[str, Any]], writer: Optional[RowCacheWriter]) -> Iterator[ExportItem]:
+        for row in rows:
+            if writer is not None:
+                writer.write(row)
+            self.rows += 1
+            cells = {c.get("columnId"): c for c in row.get("cells", ())}  # una sola scansione per riga
+            img = cells.get(self.img_col_id, {}).get("image")
+            image_id = img.get("id") if isinstance(img, dict) else None
+            name_cell = cells.get(self.name_col_id, {})
+            name = name_cell.get("displayValue") or name_cell.get("value")
+            if image_id:
+                self.images += 1
+                item = ExportItem(row.get("id"), image_id, str(name) if name else f"row_{row.get('id')}")
+                self._row_ids.append(str(item.row_id))
+                item.path = self._assign_path(item)
+                if self.manifest is not None:
+                    self._check_current(item)
+                yield item
+
+    def _assign_path(self, item: ExportItem) -> Path:
+        """
+        Nome univoco: un file esistente è un conflitto, salvo se il manifest lo assegna alla
+        stessa riga o se, non registrato, ha contenuto identico a quello esportato per la riga.
+        Gli altri file già presenti in destinazione non vengono mai sovrascritti.
+        """
+        def taken(fname: str) -> bool:
+            if fname in self._seen:
+                return True
+            if self.manifest is not None:
+                owner = self.manifest.owner(fname)
+                if owner is not None:
+                    return owner != str(item.row_id)
+            if not (self.out_dir / fname).exists():
+                return False
+            return self.manifest is None or not self.manifest.matches(item, fname)
+
+        base = sanitize_filename(item.name)
+        fname = f"{self.prefix}{base}{self.ext}"
+        j = 2
+        while taken(fname):
+            fname = f"{self.prefix}{base} ({j}){self.ext}"
+            j += 1
+        self._seen.add(fname)
+        return self.out_dir / fname
+
+    def _check_current(self, item: ExportItem):
+        old = self.manifest.current(item)
+        if old is None:
+            return
+        res = DownloadResult("", item.path, ok=True, item=item, unchanged=True)
+        if old != item.path.name:
+            try:
+                self.manifest.rename(item, old, item.path.name)
+                res = DownloadResult("", item.path, ok=True, item=item, renamed_from=old)
+            except OSError:
+                return  # rinomina non riuscita: nuovo download
+        item.done = res
+
+    # ---- Stadio 2: lotti di imageId -> URL temporanei (solo immagini da scaricare)
+    def _urls(self, items: Iterable[ExportItem]) -> Iterator[Tuple[ExportItem, Optional[str]]]:
+        chunk: List[ExportItem] = []
+        needed = 0
+        for item in items:
+            chunk.append(item)
+            needed += item.done is None
+            # Lotto pieno, oppure molte invariate in attesa: si procede per non bloccare l'ordine
+            if needed >= self.batch or len(chunk) >= QUEUE_SIZE:
+                yield from self._resolve(chunk)
+                chunk, needed = [], 0
+        if chunk:
+            yield from self._resolve(chunk)
+
+    def _resolve(self, chunk: List[ExportItem]) -> List[Tuple[ExportItem, Optional[str]]]:
+        ids = [it.image_id for it in chunk if it.done is None]
+        urls = {}
+        if ids:
+            urls = post_image_url_map(self.token, ids, self.session)
+            self.url_requests += 1
+        return [(it, urls.get(it.image_id)) for it in chunk]
+
+    # ---- Stadio 3: download (o risultato già pronto per le invariate)
+    def _jobs(self, resolved: Iterable[Tuple[ExportItem, Optional[str]]]):
+        for item, url in resolved:
+            yield item.done or (url, item.path, item)
+
+    def run(self) -> Iterator[DownloadResult]:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        remove_partial_downloads(self.out_dir)
+        self._row_ids.clear()
+        self._seen.clear()
+        self.listed = False
+        params = settings_digest(self.resize) if self.resize else ""
+        self.manifest = ExportManifest.load(self.out_dir, self.sheet_id, params) if self.incremental else None
+        items = prefetch(self._items(), QUEUE_SIZE, self.stop_flag)
+        resolved = prefetch(self._urls(items), QUEUE_SIZE, self.stop_flag)
+        try:
+            for res in self.downloader.download(self._jobs(resolved)):
+                if self.manifest is not None and res.ok and not (res.unchanged or res.renamed_from):
+                    self.manifest.record(res.item, res.path)
+                yield res
+            if self.manifest is not None and self.listed and not self.cancelled:
+                self.manifest.forget(self._row_ids)
+        finally:
+            resolved.close()
+            items.close()
+            if self.manifest is not None:
+                self.manifest.save()  # anche se annullato: la prossima esecuzione riprende da qui
+
+    def close(self):
+        self.downloader.close()
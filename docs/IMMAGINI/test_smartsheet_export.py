@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Prove di smartsheet_export.py sul server finto locale (fake_smartsheet_server.py).
+
+Uso:
+    python -m pytest -q test_smartsheet_export.py
+"""
+
+import json
+import random
+import threading
+
+import pytest
+
+import smartsheet_export
+from smartsheet_export import (SheetImageExporter, SheetCache, RequestScheduler, make_session, iter_json_array,
+                               iter_sheet_rows)
+from web_image_pipeline import ResizeSettings
+from fake_smartsheet_server import (FakeSmartsheetServer, FakeSheetConfig, IMAGE_COLUMN_ID, NAME_COLUMN_ID,
+                                    EXTRA_COLUMN_BASE)
+
+TOKEN = "test-token"
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeSmartsheetServer(FakeSheetConfig(rows=4, extra_columns=2, image_size=(40, 60))) as srv:
+        monkeypatch.setattr(smartsheet_export, "API_BASE", srv.api_base)
+        yield srv
+
+def export(server, out_dir, **kw):
+    """Esportazione completa: DownloadResult per nome del file prodotto."""
+    stop_flag = threading.Event()
+    http = RequestScheduler(make_session(2), stop_flag=stop_flag)
+    exporter = SheetImageExporter(TOKEN, server.config.sheet_id, IMAGE_COLUMN_ID, NAME_COLUMN_ID, out_dir,
+                                  workers=2, stop_flag=stop_flag, session=http, **kw)
+    try:
+        results = {res.path.name: res for res in exporter.run()}
+    finally:
+        exporter.close()
+        http.close()
+    assert all(res.ok for res in results.values())
+    return results
+
+
+# ---------------- Lettura in streaming ----------------
+# Numeri il cui prefisso è già JSON valido, stringhe con escape e virgole, UTF-8 multibyte
+PAYLOAD = json.dumps({"name": "a,[\"b", "rows": [-2500.5, 1.5e10, -0.0, 7, True, None, "città \u2013 ok",
+                                                  {"id": 1, "cells": [{"value": 3.25}]}, [], {}, 12e-3],
+                      "totalRowCount": 11}, ensure_ascii=False).encode("utf-8")
+
+def test_json_array_survives_any_chunk_split():
+    expected = json.loads(PAYLOAD)["rows"]
+    for size in range(1, len(PAYLOAD) + 1):
+        chunks = [PAYLOAD[i:i + size] for i in range(0, len(PAYLOAD), size)]
+        assert list(iter_json_array(chunks, "rows")) == expected, size
+    rnd = random.Random(1)
+    for _ in range(500):
+        cuts = sorted(rnd.sample(range(1, len(PAYLOAD)), rnd.randrange(1, 12)))
+        chunks = [PAYLOAD[a:b] for a, b in zip([0] + cuts, cuts + [len(PAYLOAD)])]
+        assert list(iter_json_array(chunks, "rows")) == expected, cuts
+
+def test_json_array_missing_key_and_truncation():
+    assert list(iter_json_array([b'{"rows_x": [1], "n": {"rows": [2]}}'], "rows")) == []
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'{"rows": [1, 2'], "rows"))
+
+def test_sheet_rows_projection(server):
+    """Con columnIds arrivano solo le colonne richieste, senza celle vuote, su tutte le pagine."""
+    server.config.image_ratio = 0.5
+    http = RequestScheduler(make_session(1))
+    try:
+        full = list(iter_sheet_rows(TOKEN, server.config.sheet_id, page_size=3, session=http))
+        rows = list(iter_sheet_rows(TOKEN, server.config.sheet_id, page_size=3, session=http,
+                                    column_ids=(IMAGE_COLUMN_ID, NAME_COLUMN_ID)))
+    finally:
+        http.close()
+    assert [r["id"] for r in rows] == [r["id"] for r in full] == [100000 + n for n in range(4)]
+    assert server.stats()["sheet_pages"] == 4
+    assert {c["columnId"] for c in full[0]["cells"]} == {IMAGE_COLUMN_ID, NAME_COLUMN_ID, EXTRA_COLUMN_BASE,
+                                                          EXTRA_COLUMN_BASE + 1}
+    for row in rows:
+        assert {c["columnId"] for c in row["cells"]} <= {IMAGE_COLUMN_ID, NAME_COLUMN_ID}
+        assert all(len(c) > 1 for c in row["cells"])
+    assert sum("image" in c for r in rows for c in r["cells"]) == 2
+
+
+# ---------------- Nomi dei file (modalità incrementale) ----------------
+def test_first_run_keeps_unowned_file(server, tmp_path):
+    """Prima esecuzione con manifest in una cartella già usata: i file presenti restano."""
+    foreign = tmp_path / "Persona 00000.png"
+    foreign.write_bytes(b"file dell'utente")
+    results = export(server, tmp_path)
+    assert foreign.read_bytes() == b"file dell'utente"
+    assert "Persona 00000 (2).png" in results
+    assert "Persona 00000.png" not in results
+
+def test_later_run_keeps_unowned_file(server, tmp_path):
+    """Con manifest esistente, un file non registrato con il nome di una nuova riga non è suo."""
+    server.config.rows = 3
+    export(server, tmp_path)
+    foreign = tmp_path / "Persona 00003.png"
+    foreign.write_bytes(b"file dell'utente")
+    server.config.rows = 4
+    results = export(server, tmp_path)
+    assert foreign.read_bytes() == b"file dell'utente"
+    assert "Persona 00003 (2).png" in results
+    assert results["Persona 00000.png"].unchanged
+
+
+# ---------------- Esportazione diretta in formato web ----------------
+def test_format_change_replaces_previous_outputs(server, tmp_path):
+    """Cambiando i parametri (WEBP -> JPEG) i file del formato precedente vengono sostituiti."""
+    export(server, tmp_path, resize=ResizeSettings(format="WEBP", long_side=32, suffix=""))
+    assert sorted(p.suffix for p in tmp_path.glob("*.*") if not p.name.startswith(".")) == [".webp"] * 4
+    results = export(server, tmp_path, resize=ResizeSettings(format="JPEG", long_side=32, suffix=""))
+    assert sorted(results) == [f"Persona {n:05d}.jpg" for n in range(4)]
+    assert sorted(p.name for p in tmp_path.iterdir() if not p.name.startswith(".")) == sorted(results)
+    rerun = export(server, tmp_path, resize=ResizeSettings(format="JPEG", long_side=32, suffix=""))
+    assert all(res.unchanged for res in rerun.values())
+
+
+# ---------------- Cache delle righe ----------------
+def test_cache_streams_rows_and_reuses_them(server, tmp_path):
+    cache = SheetCache(tmp_path / "cache")
+    export(server, tmp_path / "a", cache=cache, incremental=False)
+    assert not list(cache.folder.glob(".*.tmp"))
+    rows = cache.rows(server.config.sheet_id, server.sheet.version, (IMAGE_COLUMN_ID, NAME_COLUMN_ID))
+    assert [r["id"] for r in rows] == [100000 + n for n in range(4)]
+
+    server.reset_stats()
+    results = export(server, tmp_path / "b", cache=cache, incremental=False)
+    assert len(results) == 4
+    assert "sheet_pages" not in server.stats()
+
+def test_cache_discards_incomplete_listing(server, tmp_path):
+    cache = SheetCache(tmp_path / "cache")
+    exporter = SheetImageExporter(TOKEN, server.config.sheet_id, IMAGE_COLUMN_ID, NAME_COLUMN_ID, tmp_path,
+                                  cache=cache, incremental=False)
+    items = exporter._items()
+    next(items)
+    items.close()
+    exporter.close()
+    assert cache.rows(server.config.sheet_id, exporter.version, (IMAGE_COLUMN_ID, NAME_COLUMN_ID)) is None
+    assert not list(cache.folder.iterdir())
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Prove di web_image_pipeline.py:
+- la decodifica ridotta (shrink-on-load) deve dare lo stesso risultato della decodifica
+  completa (shrink_on_load="off"): stessa geometria e differenze entro una soglia di PSNR
+  per modalità (REDUCING_GAP);
+- l'ottimizzazione PNG non cambia i pixel visibili e rispetta il budget di tempo.
+
+Uso:
+    python -m pytest -q test_web_image_pipeline.py
+"""
+
+import io
+import math
+import random
+import threading
+import time
+from concurrent.futures import wait
+from dataclasses import replace
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+from web_image_pipeline import (ResizeSettings, REDUCING_GAP, PNG_SEARCH_THREADS, decode_image, resize_scale,
+                                resize_exact, optimize_png, _png_executor)
+
+# PSNR minimo (dB) rispetto alla decodifica completa, per modalità di shrink-on-load
+MIN_PSNR = {"quality": 40.0, "fast": 35.0}
+
+# Sorgenti: (nome, dimensione salvata nel file, formato, orientamento EXIF).
+# Dimensioni dispari: l'ultima riga/colonna della decodifica ridotta è parziale e, con
+# gli orientamenti 3/6/8, dopo la rotazione si trova a sinistra o in alto (SourceSize.box).
+SOURCES = (
+    ("foto.jpg", (2401, 1799), "JPEG", 1),
+    ("ruotata_6.jpg", (2000, 1501), "JPEG", 6),
+    ("ruotata_8.jpg", (2001, 1503), "JPEG", 8),
+    ("capovolta.jpg", (1999, 1501), "JPEG", 3),
+    ("grande.png", (1803, 2405), "PNG", 1),
+)
+
+CASES = {
+    "scale-long": dict(mode="scale", scale_type="long", long_side=480),
+    "scale-width": dict(mode="scale", scale_type="width", target_w=500),
+    "exact-fit": dict(mode="exact", exact_w=400, exact_h=400, exact_mode="fit"),
+    "exact-fill": dict(mode="exact", exact_w=300, exact_h=300, exact_mode="fill"),
+}
+
+
+def synthetic_photo(size, seed: int) -> Image.Image:
+    """Sfumature, forme e rumore: dettagli fini su cui una riduzione sbagliata si vede."""
+    rnd = random.Random(seed)
+    w, h = size
+    img = Image.merge("RGB", [Image.linear_gradient("L").rotate(rnd.choice((0, 90, 180, 270))).resize(size)
+                              for _ in range(3)])
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rnd.randrange(w), rnd.randrange(h)
+        draw.ellipse((x0, y0, x0 + rnd.randrange(w // 20, w // 3), y0 + rnd.randrange(h // 20, h // 3)),
+                     fill=tuple(rnd.randrange(256) for _ in range(3)))
+    for _ in range(60):
+        x0, y0 = rnd.randrange(w), rnd.randrange(h)
+        draw.line((x0, y0, rnd.randrange(w), rnd.randrange(h)), fill=tuple(rnd.randrange(256) for _ in range(3)),
+                  width=rnd.randrange(1, 6))
+    noise = Image.frombytes("L", (w // 8, h // 8), rnd.randbytes((w // 8) * (h // 8))).resize(size)
+    return Image.blend(img, Image.merge("RGB", (noise, noise, noise)), 0.15)
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    rms = ImageStat.Stat(ImageChops.difference(a.convert("RGB"), b.convert("RGB"))).rms
+    mse = sum(r * r for r in rms) / len(rms)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def render(path, settings: ResizeSettings) -> Image.Image:
+    img, source_size = decode_image(path, settings)
+    resize = resize_scale if settings.mode == "scale" else resize_exact
+    return resize(img, settings, source_size)
+
+
+@pytest.fixture(scope="module")
+def sources(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("shrink")
+    paths = {}
+    for seed, (name, size, fmt, orientation) in enumerate(SOURCES):
+        img = synthetic_photo(size, seed)
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        params = {"quality": 92} if fmt == "JPEG" else {"compress_level": 1}
+        img.save(folder / name, format=fmt, exif=exif.tobytes(), **params)
+        paths[name] = folder / name
+    return paths
+
+
+@pytest.mark.parametrize("mode", sorted(REDUCING_GAP))
+@pytest.mark.parametrize("case", sorted(CASES))
+@pytest.mark.parametrize("name", [s[0] for s in SOURCES])
+def test_shrink_on_load_matches_full_decode(sources, name, case, mode):
+    settings = ResizeSettings(**CASES[case], shrink_on_load=mode).validate()
+    full = render(sources[name], replace(settings, shrink_on_load="off"))
+    reduced = render(sources[name], settings)
+    assert reduced.size == full.size
+    assert psnr(reduced, full) >= MIN_PSNR[mode]
+
+def test_shrink_on_load_decodes_less(sources):
+    """La riduzione avviene davvero: altrimenti il confronto sopra non prova nulla."""
+    settings = ResizeSettings(**CASES["scale-long"]).validate()
+    for name, size, _, _ in SOURCES:
+        img, source_size = decode_image(sources[name], settings)
+        assert img.width * img.height < source_size[0] * source_size[1]
+        assert sorted(source_size) == sorted(size)
+
+
+# ---------------- Ottimizzazione PNG ----------------
+def png_sources():
+    """Un caso per ciascuna riduzione di png_reductions (e una foto che non ne ha)."""
+    photo = synthetic_photo((300, 200), 7)
+    rgba = photo.convert("RGBA")
+    rgba.putalpha(Image.linear_gradient("L").resize(photo.size).point(lambda a: 0 if a < 60 else a))
+    few = photo.quantize(12).convert("RGBA")
+    few.putalpha(Image.linear_gradient("L").resize(photo.size).point(lambda a: a // 64 * 85))
+    return {"photo": photo, "rgba": rgba, "opaque-rgba": photo.convert("RGBA"),
+            "gray": photo.convert("L").convert("RGB"), "few-colors": few,
+            "palette": photo.quantize(200), "bilevel": photo.convert("1")}
+
+def visible(img: Image.Image) -> bytes:
+    """Pixel RGBA visibili: il colore sotto alpha 0 non conta (png_reductions lo azzera)."""
+    img = img.convert("RGBA")
+    img.paste((0, 0, 0, 0), mask=img.getchannel("A").point(lambda a: 255 if a == 0 else 0))
+    return img.tobytes()
+
+@pytest.mark.parametrize("name", sorted(png_sources()))
+def test_optimize_png_is_lossless(name):
+    img = png_sources()[name]
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    out = optimize_png(img, buf.getvalue(), {}, budget=30.0)
+    assert len(out) <= len(buf.getvalue())
+    with Image.open(io.BytesIO(out)) as back:
+        assert back.size == img.size
+        assert visible(back) == visible(img)
+
+def test_optimize_png_respects_budget():
+    """Su un'immagine grande il tempo resta vicino al budget e il pool condiviso si libera subito."""
+    img = Image.merge("RGB", [Image.effect_noise((4000, 3000), 64)] * 3)
+    budget = 0.3
+    start = time.perf_counter()
+    optimize_png(img, b"", {}, budget)  # nessun tentativo può vincere: conta solo il tempo
+    elapsed = time.perf_counter() - start
+    # Tutti i thread del pool liberi insieme: i tentativi rimasti si sono fermati
+    barrier = threading.Barrier(PNG_SEARCH_THREADS)
+    wait([_png_executor().submit(barrier.wait, 10) for _ in range(PNG_SEARCH_THREADS)])
+    drained = time.perf_counter() - start
+    assert elapsed < budget + 0.25
+    assert drained < budget + 0.5
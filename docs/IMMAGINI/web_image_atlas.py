@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Web Image Atlas - fogli sprite per i ritratti dell'organigramma
+Impacchetta i ritratti, tutti alla stessa dimensione esatta, in uno o più fogli (WebP/JPEG/PNG)
+e scrive un indice JSON che associa a ogni nome file (il nome del dipendente usato nel CSV)
+il foglio e le coordinate del relativo riquadro. Al posto di centinaia di richieste per le
+singole immagini, il browser ne scarica poche.
+
+Funzioni principali:
+- Riquadri generati con web_image_pipeline.py (dimensione esatta ADATTA/RIEMPI, sRGB, ecc.)
+  e conservati senza perdita in DESTINAZIONE/.NOME_tiles con il manifest incrementale
+- Posizioni stabili: ogni nome mantiene il suo riquadro tra un'esecuzione e l'altra,
+  i nuovi nomi occupano i posti liberati; vengono ricodificati solo i fogli modificati
+- Indice NOME.json: dimensione riquadro, elenco fogli, {nome: {sheet, x, y, w, h}}
+- Fogli PNG: ottimizzazione senza perdita opzionale (--png-optimize, vedi optimize_png)
+
+Dipendenze: Pillow (PIL)  ->  pip install pillow
+
+Uso:
+    python web_image_atlas.py SORGENTE DESTINAZIONE --tile 160x200 --cols 16 --rows 16 --format WEBP
+"""
+
+import os
+import io
+import sys
+import json
+import math
+import argparse
+import threading
+from dataclasses import replace
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Iterator
+
+from PIL import Image
+
+from web_image_pipeline import (
+    ResizeSettings, ResizePipeline, FileResult, EXACT_MODES, FORMATS,
+    prepare_for_encode, optimize_png, settings_digest, write_json_atomic, _hex_to_rgb,
+)
+
+ATLAS_VERSION = 1
+WEBP_MAX_SIDE = 16383
+
+
+class AtlasBuilder:
+    """
+    Costruisce i fogli sprite da una cartella di ritratti.
+
+    settings: parametri del riquadro (mode viene forzato a "exact": exact_w/exact_h/exact_mode)
+    e del foglio (format, quality, bg, transparent_bg). cols x rows riquadri per foglio.
+    """
+
+    def __init__(self, settings: ResizeSettings, cols: int = 16, rows: int = 16, name: str = "atlas",
+                 workers: int = 1, stop_flag: Optional[threading.Event] = None):
+        self.settings = replace(settings, mode="exact", variants=()).validate()
+        if cols <= 0 or rows <= 0:
+            raise ValueError("cols e rows devono essere maggiori di zero")
+        if self.settings.format == "WEBP" and max(cols * self.settings.exact_w, rows * self.settings.exact_h) > WEBP_MAX_SIDE:
+            raise ValueError(f"foglio troppo grande per WebP (max {WEBP_MAX_SIDE}px per lato): ridurre cols/rows")
+        self.cols, self.rows, self.name = cols, rows, name
+        # Riquadri intermedi: PNG senza perdita, trasparenza solo se il foglio la supporta
+        self.tile_settings = replace(
+            self.settings, format="PNG", optimize=False, png_optimize=False, suffix="",
+            transparent_bg=self.settings.transparent_bg and self.settings.format in ("PNG", "WEBP"),
+        )
+        # Riquadri con l'estensione della sorgente nel nome: a.jpg e a.png non condividono il file
+        self.pipeline = ResizePipeline(self.tile_settings, workers=workers, stop_flag=stop_flag, incremental=True,
+                                       keep_extension=True)
+        self._tiles: Dict[str, Path] = {}      # chiave sprite -> riquadro in cache
+        self._changed: set = set()             # chiavi rielaborate in questa esecuzione
+
+    @property
+    def per_sheet(self) -> int:
+        return self.cols * self.rows
+
+    @property
+    def sprite_count(self) -> int:
+        return len(self._tiles)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.pipeline.cancelled
+
+    def _digest(self) -> str:
+        return settings_digest(replace(self.settings, suffix="", recursive=False)) + f":{self.cols}x{self.rows}"
+
+    @staticmethod
+    def sprite_key(rel: str) -> str:
+        # Nome file senza estensione (con eventuale sottocartella): il nome usato dal CSV
+        return Path(rel).with_suffix("").as_posix()
+
+    # ---------------- Fase 1: riquadri ----------------
+    def tiles(self, src: Path, dst: Path, files: Optional[List[Path]] = None) -> Iterator[FileResult]:
+        """Genera/aggiorna i riquadri in cache; restituisce i FileResult della pipeline."""
+        self._tiles.clear()
+        self._changed.clear()
+        tile_dir = dst / f".{self.name}_tiles"
+        tile_dir.mkdir(parents=True, exist_ok=True)
+        if files is None:
+            files = self.pipeline.collect_files(src)
+        # Nomi duplicati (es. a.jpg e a.png), prima dell'elaborazione: vale la prima sorgente
+        # in ordine di nome, le altre sono segnalate e non generano riquadri
+        unique: Dict[str, Path] = {}
+        for path in sorted(files):
+            rel = str(path.relative_to(src) if self.tile_settings.recursive else Path(path.name))
+            key = self.sprite_key(rel)
+            if key in unique:
+                yield FileResult(path, rel, ok=False, skipped=True,
+                                 error=f"nome duplicato nell'atlas: {key} (già usato da {unique[key].name})")
+            else:
+                unique[key] = path
+        for res in self.pipeline.process(list(unique.values()), src, tile_dir):
+            if res.ok and not res.pruned:
+                key = self.sprite_key(res.rel)
+                self._tiles[key] = res.out_path
+                if not res.unchanged:
+                    self._changed.add(key)
+            yield res
+
+    # ---------------- Fase 2: fogli ----------------
+    def compose(self, dst: Path) -> List[Dict[str, Any]]:
+        """
+        Assegna i riquadri ai fogli e ricodifica solo i fogli modificati.
+        Ritorna l'elenco dei fogli (dict con file, size, bytes, sprites, rebuilt).
+        """
+        index_path = dst / f"{self.name}.json"
+        try:
+            prev = json.loads(index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            prev = {}
+        digest = self._digest()
+        same_layout = prev.get("version") == ATLAS_VERSION and prev.get("settings") == digest
+        prev_sprites = prev.get("sprites", {}) if same_layout else {}
+        prev_sheets = {s["file"]: s for s in prev.get("sheets", [])} if same_layout else {}
+
+        # Posizioni stabili per i nomi già presenti, posti liberi per i nuovi
+        slots = {k: v["slot"] for k, v in prev_sprites.items() if k in self._tiles}
+        removed = set(prev_sprites) - set(slots)
+        used = set(slots.values())
+        top = max(used, default=-1) + 1
+        free = iter(sorted(set(range(top)) - used))
+        for key in sorted(k for k in self._tiles if k not in slots):
+            slot = next(free, None)
+            if slot is None:
+                slot, top = top, top + 1
+            slots[key] = slot
+        # Compatta la coda: senza nomi oltre l'ultimo slot occupato l'ultimo foglio si accorcia
+        n_sheets = math.ceil((max(slots.values(), default=-1) + 1) / self.per_sheet)
+
+        dirty = {slots[k] // self.per_sheet for k in self._changed}
+        dirty |= {slots[k] // self.per_sheet for k in slots if k not in prev_sprites}
+        dirty |= {prev_sprites[k]["slot"] // self.per_sheet for k in removed}
+
+        W, H = self.settings.exact_w, self.settings.exact_h
+        by_sheet: Dict[int, List[str]] = {}
+        for key, slot in slots.items():
+            by_sheet.setdefault(slot // self.per_sheet, []).append(key)
+
+        sheets = []
+        for n in range(n_sheets):
+            fname = f"{self.name}_{n}{self.settings.extension}"
+            keys = by_sheet.get(n, [])
+            used_rows = math.ceil((max(slots[k] % self.per_sheet for k in keys) + 1) / self.cols) if keys else 1
+            size = (self.cols * W, used_rows * H)
+            info = prev_sheets.get(fname)
+            rebuild = n in dirty or info is None or not (dst / fname).exists() or tuple(info.get("size", ())) != size
+            if rebuild:
+                if self.cancelled:
+                    break
+                self._write_sheet(dst / fname, size, keys, slots)
+                info = {"file": fname, "size": list(size), "bytes": (dst / fname).stat().st_size}
+            info = {**info, "sprites": len(keys)}
+            sheets.append({**info, "rebuilt": rebuild})
+
+        if self.cancelled:
+            return sheets
+
+        # Fogli in eccesso (atlas ridotto)
+        for old in prev.get("sheets", []):
+            if old["file"] not in {s["file"] for s in sheets}:
+                (dst / old["file"]).unlink(missing_ok=True)
+
+        sprites = {}
+        for key in sorted(slots):
+            slot = slots[key]
+            n, pos = divmod(slot, self.per_sheet)
+            r, c = divmod(pos, self.cols)
+            sprites[key] = {"sheet": n, "x": c * W, "y": r * H, "w": W, "h": H, "slot": slot}
+        write_json_atomic(index_path, {
+            "version": ATLAS_VERSION,
+            "settings": digest,
+            "tile": {"width": W, "height": H},
+            "cols": self.cols,
+            "rows": self.rows,
+            "sheets": [{k: v for k, v in s.items() if k != "rebuilt"} for s in sheets],
+            "sprites": sprites,
+        })
+        return sheets
+
+    def _write_sheet(self, path: Path, size, keys: List[str], slots: Dict[str, int]):
+        W, H = self.settings.exact_w, self.settings.exact_h
+        if self.tile_settings.transparent_bg:
+            sheet = Image.new("RGBA", size, (0, 0, 0, 0))
+        else:
+            sheet = Image.new("RGB", size, _hex_to_rgb(self.settings.bg))
+        for key in keys:
+            r, c = divmod(slots[key] % self.per_sheet, self.cols)
+            with Image.open(self._tiles[key]) as tile:
+                tile.load()
+                sheet.paste(tile, (c * W, r * H), tile if tile.mode in ("RGBA", "LA") else None)
+        img, params = prepare_for_encode(sheet, self.settings)
+        tmp = path.with_name(path.name + ".tmp")
+        if self.settings.format == "PNG" and self.settings.png_optimize:
+            buf = io.BytesIO()
+            img.save(buf, format="PNG", **params)
+            tmp.write_bytes(optimize_png(img, buf.getvalue(), params, self.settings.png_budget))
+        else:
+            img.save(tmp, format=self.settings.format, **params)
+        os.replace(tmp, path)
+
+    def build(self, src: Path, dst: Path) -> List[Dict[str, Any]]:
+        """Fasi 1 e 2 senza log intermedio."""
+        for _ in self.tiles(src, dst):
+            pass
+        return [] if self.cancelled else self.compose(dst)
+
+
+# ---------------- CLI ----------------
+def main(argv: Optional[List[str]] = None) -> int:
+    d = ResizeSettings()
+    p = argparse.ArgumentParser(description="Genera fogli sprite (atlas) con indice JSON dai ritratti.")
+    p.add_argument("src", type=Path, help="cartella sorgente")
+    p.add_argument("dst", type=Path, help="cartella di destinazione")
+    p.add_argument("--tile", default="160x200", help="dimensione riquadro LxA (px)")
+    p.add_argument("--exact-mode", choices=EXACT_MODES, default="fill", help="fit = bordi, fill = ritaglio")
+    p.add_argument("--cols", type=int, default=16)
+    p.add_argument("--rows", type=int, default=16)
+    p.add_argument("--name", default="atlas", help="prefisso dei fogli e dell'indice")
+    p.add_argument("--format", type=str.upper, choices=FORMATS, default=d.format)
+    p.add_argument("--quality", type=int, default=d.quality)
+    p.add_argument("--bg", default=d.bg, help="colore di sfondo #RRGGBB")
+    p.add_argument("--transparent-bg", action="store_true", help="sfondo trasparente (PNG/WEBP)")
+    p.add_argument("--png-optimize", action="store_true", help="fogli PNG: ottimizzazione senza perdita")
+    p.add_argument("--png-budget", type=float, default=d.png_budget, metavar="SEC",
+                   help="tempo massimo per foglio della ricerca PNG (secondi)")
+    p.add_argument("--recursive", action="store_true", help="includi sottocartelle")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processi paralleli")
+    args = p.parse_args(argv)
+
+    try:
+        w, _, h = args.tile.lower().partition("x")
+        settings = ResizeSettings(mode="exact", exact_w=int(w), exact_h=int(h), exact_mode=args.exact_mode,
+                                  format=args.format, quality=args.quality, bg=args.bg,
+                                  transparent_bg=args.transparent_bg, png_optimize=args.png_optimize,
+                                  png_budget=args.png_budget, recursive=args.recursive)
+        builder = AtlasBuilder(settings, cols=args.cols, rows=args.rows, name=args.name, workers=args.workers)
+    except ValueError as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 2
+    if not args.src.is_dir():
+        print(f"Errore: cartella sorgente non valida: {args.src}", file=sys.stderr)
+        return 2
+
+    failed = 0
+    try:
+        for res in builder.tiles(args.src, args.dst):
+            if not res.ok:
+                failed += 1
+                print(f"[ERRORE] {res.rel}: {res.error}", file=sys.stderr)
+        sheets = builder.compose(args.dst)
+    except KeyboardInterrupt:
+        builder.pipeline.stop_flag.set()
+        print("Operazione annullata.", file=sys.stderr)
+        return 130
+
+    for s in sheets:
+        state = "ricodificato" if s["rebuilt"] else "invariato"
+        print(f"{s['file']}: {s['sprites']} ritratti, {s['bytes']/1024:.0f} KB ({state})")
+    print(f"Completato. Ritratti: {builder.sprite_count}. Fogli: {len(sheets)}. Errori: {failed}.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1798 @@
+# -*- coding: utf-8 -*-
+"""
+Web Image Pipeline - motore di ridimensionamento senza interfaccia grafica
+Usato da web_image_resizer_gui.py e utilizzabile da riga di comando o da altri script Python.
+
+Funzioni principali:
+- ResizeSettings: parametri di elaborazione (record semplice e serializzabile con pickle)
+- ResizePipeline: elabora una cartella e restituisce i risultati file per file (generatore),
+  in sequenza o su un pool di processi
+- CLI per elaborazioni batch non presidiate (server di build, cron, script di pubblicazione)
+- Rimozione metadata a livello di encoder (nessuna copia dei pixel)
+- Modalità incrementale: un manifest nella cartella di destinazione (percorso, dimensione,
+  mtime e hash del contenuto di ogni sorgente + digest dei parametri) permette di saltare
+  i file invariati e di rimuovere gli output delle sorgenti eliminate
+- Varianti: da una sola decodifica (orientamento + sRGB) N output con dimensione, modalità,
+  formato e qualità propri, nominati NOME{suffix}_{variante}.ext, più un indice variants.json
+  con dimensioni e peso di ogni variante
+- Cache LRU delle trasformazioni ICC -> sRGB (profili ripetuti: solo la conversione dei pixel)
+- Decodifica ridotta (shrink-on-load): per sorgenti grandi il JPEG viene decodificato già
+  scalato (DCT 1/2, 1/4, 1/8) e gli altri formati ridotti per fattori interi prima del filtro
+  LANCZOS finale, mantenendo sempre un margine sopra la dimensione di destinazione
+- Budget di peso (max_bytes): per JPEG/WEBP la qualità viene cercata per bisezione con
+  codifiche in memoria sulla bitmap già ridimensionata; il log riporta la qualità scelta
+- Tempi per fase (decode, exif_transpose, to_srgb, resize, metadata, encode, write) con
+  contatori di pixel e byte: report JSON/CSV con p50/p95 per fase, immagini/s e MB/s
+- Scrittura separata dal calcolo (write-behind): output codificati in memoria, scritti da
+  thread dedicati su file temporanei con rinomina atomica (mai file scritti a metà)
+- Quasi-duplicati: hash percettivo (dHash/pHash, in blocco con NumPy se disponibile) di tutte
+  le sorgenti; per ogni gruppo entro la distanza di Hamming indicata si codifica solo la
+  sorgente più grande, gli altri ricevono gli stessi output (hardlink o copia) + report
+- Ottimizzazione PNG senza perdita (png_optimize): palette esatta con profondità 1/2/4/8 bit,
+  scala di grigi, pulizia del canale alpha; filtri PNG e strategie zlib provati in parallelo
+  entro un tempo massimo per file, si tiene il risultato più piccolo
+
+Dipendenze: Pillow (PIL)  ->  pip install pillow
+             NumPy opzionale (hash percettivi in blocco, pHash, palette e filtri PNG)  ->  pip install numpy
+
+Uso da riga di comando:
+    python web_image_pipeline.py SORGENTE DESTINAZIONE --format WEBP --long-side 1600 --workers 4
+    python web_image_pipeline.py SORGENTE DESTINAZIONE --mode exact --exact-w 600 --exact-h 600 --exact-mode fill
+    python web_image_pipeline.py SORGENTE DESTINAZIONE --variant card=160x200:fill --variant detail=1200:jpeg:q85
+    python web_image_pipeline.py SORGENTE DESTINAZIONE --mode exact --exact-w 160 --exact-h 200 --format JPEG --max-kb 40
+    python web_image_pipeline.py SORGENTE DESTINAZIONE --workers 4 --timing-report tempi.json
+    python web_image_pipeline.py SORGENTE DESTINAZIONE --dedup 4 --dedup-report duplicati.csv
+    python web_image_pipeline.py SORGENTE DESTINAZIONE --format PNG --transparent-bg --png-optimize --png-budget 2
+
+Uso da Python:
+    from web_image_pipeline import ResizeSettings, ResizePipeline
+    pipe = ResizePipeline(ResizeSettings(format="JPEG", quality=85), workers=4)
+    for res in pipe.run(Path("foto"), Path("out_web")):
+        print(res.rel, res.ok, res.new_size)
+"""
+
+import os
+import io
+import sys
+import csv
+import json
+import time
+import math
+import zlib
+import struct
+import hashlib
+import queue
+import shutil
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import OrderedDict
+from dataclasses import dataclass, replace, asdict
+from pathlib import Path
+from typing import Tuple, Optional, List, Iterator, Iterable, Dict, Any, Sequence, Callable
+
+from PIL import Image, ImageOps
+
+# Conversione sRGB: ImageCms è opzionale ma consigliata
+try:
+    from PIL import ImageCms
+    HAVE_CMS = True
+    # Pillow >= 9.1: ImageCms.Intent; le costanti INTENT_* sono state rimosse in Pillow 12
+    INTENT_PERCEPTUAL = ImageCms.Intent.PERCEPTUAL if hasattr(ImageCms, "Intent") else ImageCms.INTENT_PERCEPTUAL
+except Exception:
+    HAVE_CMS = False
+
+# Hash percettivi in blocco (rilevamento duplicati): NumPy è opzionale
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
+SUPPORTED_EXT = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+# Valori ammessi per le modalità
+MODES = ("scale", "exact")
+SCALE_TYPES = ("long", "width")   # lato lungo | larghezza fissa
+EXACT_MODES = ("fit", "fill")     # ADATTA (bordi) | RIEMPI (ritaglio)
+FORMATS = ("WEBP", "JPEG", "PNG")
+SHRINK_MODES = ("quality", "fast", "off")
+
+# Margine minimo (decodifica ridotta / destinazione) per modalità di shrink-on-load.
+# Con 2x il risultato del LANCZOS finale non è distinguibile dalla decodifica completa;
+# 1.5x è più veloce con differenze visibili solo al confronto pixel per pixel.
+REDUCING_GAP = {"quality": 2.0, "fast": 1.5}
+
+# Formati con qualità regolabile: solo per questi vale il budget di peso (max_bytes)
+BUDGET_FORMATS = ("JPEG", "WEBP")
+
+@dataclass(frozen=True)
+class Variant:
+    """
+    Un output aggiuntivo per ogni sorgente (modalità varianti).
+    height == 0: riduzione sul lato lungo a `width` px; height > 0: dimensione esatta.
+    format/quality/max_bytes vuoti o 0 ereditano i valori principali di ResizeSettings.
+    """
+    name: str
+    width: int
+    height: int = 0
+    exact_mode: str = "fill"        # "fit" | "fill" (solo dimensione esatta)
+    format: str = ""
+    quality: int = 0
+    max_bytes: int = 0              # budget di peso per file (byte)
+
+    @classmethod
+    def parse(cls, spec: str) -> "Variant":
+        """
+        Formato testuale: NOME=LARGHEZZA[xALTEZZA][:fit|fill][:FORMATO][:qQUALITA][:NNkb]
+        es. "card=160x200:fill:webp:q75:40kb", "detail=1200:jpeg".
+        """
+        name, sep, rest = spec.strip().partition("=")
+        if not sep or not name or not rest:
+            raise ValueError(f"variante non valida: {spec!r} (atteso NOME=LARGHEZZA[xALTEZZA][:opzioni])")
+        size, *opts = rest.split(":")
+        try:
+            w, _, h = size.lower().partition("x")
+            kw = {"width": int(w), "height": int(h or 0)}
+            for opt in opts:
+                o = opt.strip()
+                if o.lower() in EXACT_MODES:
+                    kw["exact_mode"] = o.lower()
+                elif o.upper() in FORMATS:
+                    kw["format"] = o.upper()
+                elif o[:1].lower() == "q" and o[1:].isdigit():
+                    kw["quality"] = int(o[1:])
+                elif o[-2:].lower() == "kb" and o[:-2].isdigit():
+                    kw["max_bytes"] = int(o[:-2]) * 1024
+                else:
+                    raise ValueError(f"opzione sconosciuta {o!r}")
+        except ValueError as e:
+            raise ValueError(f"variante non valida: {spec!r} ({e})") from None
+        return cls(name.strip(), **kw)
+
+def parse_variants(text: str) -> Tuple[Variant, ...]:
+    """Elenco di varianti separate da spazi, virgole o punto e virgola."""
+    return tuple(Variant.parse(t) for t in text.replace(",", " ").replace(";", " ").split())
+
+
+@dataclass(frozen=True)
+class ResizeSettings:
+    """Parametri di elaborazione. Valori di default allineati alla GUI."""
+    mode: str = "scale"             # "scale" | "exact"
+    # Scale
+    scale_type: str = "long"        # "long" | "width"
+    long_side: int = 1600           # px
+    target_w: int = 1280            # px
+    no_upscale: bool = True
+    # Exact
+    exact_w: int = 1200
+    exact_h: int = 1200
+    exact_mode: str = "fit"         # "fit" | "fill"
+    bg: str = "#FFFFFF"
+    transparent_bg: bool = False
+    # Output
+    format: str = "WEBP"            # "JPEG" | "PNG" | "WEBP"
+    quality: int = 82               # 1..100 (con max_bytes: qualità massima della ricerca)
+    max_bytes: int = 0              # budget di peso per file (JPEG/WEBP); 0 = disattivato
+    progressive: bool = True        # solo JPEG
+    optimize: bool = True
+    png_optimize: bool = False      # solo PNG: ricerca lossless di modo/filtri/zlib (vedi optimize_png)
+    png_budget: float = 1.0         # secondi massimi per file della ricerca PNG
+    # Metadata / profili
+    strip_meta: bool = True
+    to_srgb: bool = True
+    # Decodifica
+    shrink_on_load: str = "quality"  # "quality" | "fast" | "off"
+    # Nomi file
+    suffix: str = "_web"
+    recursive: bool = False
+    # Varianti: se presenti sostituiscono l'output principale
+    variants: Tuple[Variant, ...] = ()
+
+    def validate(self) -> "ResizeSettings":
+        """Normalizza e verifica i valori; solleva ValueError se non validi."""
+        s = replace(self, format=self.format.upper())
+        if s.mode not in MODES:
+            raise ValueError(f"mode non valido: {s.mode!r} (ammessi: {', '.join(MODES)})")
+        if s.scale_type not in SCALE_TYPES:
+            raise ValueError(f"scale_type non valido: {s.scale_type!r} (ammessi: {', '.join(SCALE_TYPES)})")
+        if s.exact_mode not in EXACT_MODES:
+            raise ValueError(f"exact_mode non valido: {s.exact_mode!r} (ammessi: {', '.join(EXACT_MODES)})")
+        if s.shrink_on_load not in SHRINK_MODES:
+            raise ValueError(f"shrink_on_load non valido: {s.shrink_on_load!r} (ammessi: {', '.join(SHRINK_MODES)})")
+        if s.format not in FORMATS:
+            raise ValueError(f"format non valido: {s.format!r} (ammessi: {', '.join(FORMATS)})")
+        if not 1 <= s.quality <= 100:
+            raise ValueError("quality deve essere compresa tra 1 e 100")
+        if s.max_bytes < 0:
+            raise ValueError("max_bytes non può essere negativo")
+        if s.png_budget <= 0:
+            raise ValueError("png_budget deve essere maggiore di zero")
+        for name in ("long_side", "target_w", "exact_w", "exact_h"):
+            if getattr(s, name) <= 0:
+                raise ValueError(f"{name} deve essere maggiore di zero")
+        _hex_to_rgb(s.bg)
+        names = [v.name for v in s.variants]
+        if len(set(names)) != len(names):
+            raise ValueError("i nomi delle varianti devono essere univoci")
+        for _, vs in s.output_targets():
+            if vs is not s:
+                vs.validate()
+        return s
+
+    def for_variant(self, v: Variant) -> "ResizeSettings":
+        """Parametri completi di una variante (derivati da quelli principali)."""
+        if v.height:
+            geometry = dict(mode="exact", exact_w=v.width, exact_h=v.height, exact_mode=v.exact_mode)
+        else:
+            geometry = dict(mode="scale", scale_type="long", long_side=v.width)
+        return replace(self, variants=(), format=(v.format or self.format).upper(),
+                       quality=v.quality or self.quality, max_bytes=v.max_bytes or self.max_bytes, **geometry)
+
+    def output_targets(self) -> List[Tuple[str, "ResizeSettings"]]:
+        """[(nome variante, parametri)]; senza varianti un solo output con nome vuoto."""
+        if not self.variants:
+            return [("", self)]
+        return [(v.name, self.for_variant(v)) for v in self.variants]
+
+    @property
+    def extension(self) -> str:
+        return ".jpg" if self.format == "JPEG" else (".png" if self.format == "PNG" else ".webp")
+
+
+@dataclass
+class FileResult:
+    """Esito dell'elaborazione di un singolo file."""
+    src: Path
+    rel: str
+    ok: bool
+    skipped: bool = False
+    error: str = ""
+    out_path: Optional[Path] = None
+    orig_size: int = 0
+    new_size: int = 0
+    unchanged: bool = False   # modalità incrementale: sorgente invariata, non rielaborata
+    pruned: bool = False      # modalità incrementale: output rimosso (sorgente eliminata)
+    icc: str = ""             # cache trasformazioni ICC: "hit" | "miss" | "" (nessun profilo)
+    quality: int = 0          # qualità scelta dalla ricerca sul budget (0 = budget non attivo)
+    pixels_in: int = 0        # pixel della sorgente (piena risoluzione)
+    pixels_out: int = 0       # pixel scritti (somma delle varianti)
+    timings: Optional[Dict[str, float]] = None  # secondi per fase (solo con timing attivo)
+    # Write-behind: [(percorso finale, dati codificati)] ancora da scrivere (vedi OutputWriter)
+    pending: Optional[List[Tuple[Path, bytes]]] = None
+    duplicate_of: str = ""    # rilevamento duplicati: output collegati a quelli di questa sorgente
+    # Modalità varianti: un dict per variante (name, path, width, height, bytes, format, quality)
+    outputs: Optional[List[Dict[str, Any]]] = None
+
+    @property
+    def out_paths(self) -> List[Path]:
+        if self.outputs:
+            return [o["path"] for o in self.outputs]
+        return [self.out_path] if self.out_path else []
+
+    @property
+    def out_labels(self) -> List[str]:
+        """Nomi degli output per il log, con la qualità scelta dalla ricerca sul budget."""
+        if self.outputs:
+            return [o["path"].name + (f" q={o['quality']}" if o.get("quality") else "") for o in self.outputs]
+        if not self.out_path:
+            return []
+        return [self.out_path.name + (f" q={self.quality}" if self.quality else "")]
+
+
+def _hex_to_rgb(value: str) -> Tuple[int, int, int]:
+    bg_hex = value.lstrip("#")
+    if len(bg_hex) != 6:
+        raise ValueError(f"colore non valido: {value!r} (atteso #RRGGBB)")
+    return int(bg_hex[0:2], 16), int(bg_hex[2:4], 16), int(bg_hex[4:6], 16)
+
+# ---------------- Tempi per fase ----------------
+STAGES = ("decode", "exif_transpose", "to_srgb", "resize", "metadata", "encode", "optimize", "write")
+
+class StageTimer:
+    """
+    Tempi di un singolo file, per fase (secondi; cumulati se una fase si ripete, es. varianti).
+    Uso: `with timer.stage("resize"): ...`. Le fasi non vanno annidate.
+    """
+    __slots__ = ("times", "_name", "_t0")
+
+    def __init__(self):
+        self.times: Dict[str, float] = {}
+        self._name = ""
+        self._t0 = 0.0
+
+    def stage(self, name: str) -> "StageTimer":
+        self._name = name
+        return self
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.times[self._name] = self.times.get(self._name, 0.0) + time.perf_counter() - self._t0
+        return False
+
+class _NullTimer:
+    """Timer disattivato: nessuna misura, costo di una chiamata a metodo per fase."""
+    __slots__ = ()
+    times = None
+
+    def stage(self, name: str) -> "_NullTimer":
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+# ---------------- Image utils ----------------
+def collect_files(root: Path, recursive: bool = False) -> List[Path]:
+    it = root.rglob("*") if recursive else root.iterdir()
+    return [p for p in it if p.is_file() and p.suffix.lower() in SUPPORTED_EXT]
+
+def target_scale(size: Tuple[int, int], settings: ResizeSettings) -> Optional[float]:
+    """
+    Fattore di scala che resize_scale/resize_exact applicheranno a un'immagine di
+    dimensione `size` (già orientata). None se l'immagine non verrà ridimensionata.
+    """
+    w, h = size
+    if settings.mode == "scale":
+        if settings.scale_type == "long":
+            if max(w, h) <= settings.long_side and settings.no_upscale:
+                return None
+            return settings.long_side / float(max(w, h))
+        if w <= settings.target_w and settings.no_upscale:
+            return None
+        return settings.target_w / float(w)
+    if settings.exact_mode == "fit":
+        return min(settings.exact_w / w, settings.exact_h / h)
+    return max(settings.exact_w / w, settings.exact_h / h)
+
+class SourceSize(tuple):
+    """
+    (w, h) orientati della sorgente a piena risoluzione. box: area dell'immagine decodificata
+    ridotta che corrisponde all'intera sorgente (vedi decode_image), None senza riduzione.
+    """
+
+    def __new__(cls, size: Tuple[int, int], box: Optional[Tuple[float, float, float, float]] = None):
+        self = super().__new__(cls, size)
+        self.box = box
+        return self
+
+# Orientamenti EXIF che portano a sinistra / in alto l'ultima colonna / riga salvata nel file
+# (2 specchio, 3 180°, 4 capovolta, 6 e 8 rotazioni di 90°, 7 trasversa)
+_EDGE_LEFT = (2, 3, 6, 7)
+_EDGE_TOP = (3, 4, 7, 8)
+
+def open_image(path: Path, settings: Optional[ResizeSettings] = None) -> Image.Image:
+    return decode_image(path, settings)[0]
+
+def decode_image(path: Path, settings: Optional[ResizeSettings] = None,
+                 timer: StageTimer = NULL_TIMER) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Apre l'immagine e corregge l'orientamento EXIF.
+    Con settings e shrink_on_load attivo decodifica/riduce direttamente alla dimensione
+    più piccola che mantiene il margine REDUCING_GAP sopra la destinazione.
+    Ritorna (immagine, SourceSize: dimensione orientata della sorgente a piena risoluzione):
+    le funzioni di resize calcolano la geometria finale su quest'ultima, così l'output non
+    dipende dalla riduzione applicata.
+    """
+    with timer.stage("decode"):
+        img = Image.open(path)
+        orientation = img.getexif().get(0x0112, 1)
+        rotated = orientation in (5, 6, 7, 8)
+        w, h = img.size
+        source_size = (h, w) if rotated else (w, h)
+
+        gap = REDUCING_GAP.get(settings.shrink_on_load) if settings else None
+        scale = None
+        if gap:
+            # Con più varianti serve la più grande; se una non ridimensiona, decodifica completa
+            scales = [target_scale(source_size, vs) for _, vs in settings.output_targets()]
+            scale = None if None in scales else max(scales)
+        shrink = scale is not None and scale * gap < 1.0
+        if shrink:
+            # Dimensione minima da decodificare, nell'orientamento salvato nel file
+            need = (max(1, math.ceil(w * scale * gap)), max(1, math.ceil(h * scale * gap)))
+            if img.format == "JPEG":
+                img.draft(None, need)  # scala DCT 1/2, 1/4, 1/8: dimensione >= need
+        img.load()
+    with timer.stage("exif_transpose"):
+        img = ImageOps.exif_transpose(img)  # orientazione corretta
+    if not shrink:
+        return img, SourceSize(source_size)
+
+    # La scala DCT arrotonda per eccesso: l'ultima colonna/riga del file può essere parziale
+    # e, dopo l'orientamento, trovarsi a sinistra o in alto. Il box la esclude da quel lato.
+    sw, sh = source_size
+    draft = max(1, round(sw / img.width))
+    bw, bh = sw / draft, sh / draft
+    x0 = img.width - bw if orientation in _EDGE_LEFT else 0.0
+    y0 = img.height - bh if orientation in _EDGE_TOP else 0.0
+
+    # Riduzione per fattore intero (formati senza draft o JPEG ancora troppo grandi)
+    with timer.stage("decode"):
+        need_w, need_h = (need[1], need[0]) if rotated else need
+        factor = min(img.width // need_w, img.height // need_h)
+        if factor >= 2:
+            img = img.reduce(factor)
+        else:
+            factor = 1
+    x0, y0, bw, bh = x0 / factor, y0 / factor, bw / factor, bh / factor
+    box = (max(0.0, x0), max(0.0, y0), min(img.width, x0 + bw), min(img.height, y0 + bh))
+    return img, SourceSize(source_size, box)
+
+# Parametri encoder che sostituiscono i metadata ereditati da img.info (EXIF, ICC, XMP,
+# commenti JPEG): i chunk non vengono scritti, senza copiare i pixel.
+STRIP_META_PARAMS = {"exif": b"", "icc_profile": None, "xmp": b"", "comment": b""}
+
+def metadata_params(settings: ResizeSettings) -> dict:
+    return dict(STRIP_META_PARAMS) if settings.strip_meta else {}
+
+class ICCTransformCache:
+    """
+    Cache LRU delle trasformazioni LittleCMS verso sRGB, chiave: sha256 del profilo ICC
+    + modi di ingresso/uscita + rendering intent. Un lotto dalla stessa fotocamera o
+    scanner condivide pochi profili: dopo il primo file resta solo la trasformazione
+    dei pixel. Condivisibile tra thread (ogni processo del pool ha la sua istanza).
+    """
+
+    def __init__(self, maxsize: int = 16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._srgb = None
+
+    def get(self, icc: bytes, in_mode: str, out_mode: str, intent: int) -> Tuple[Any, bool]:
+        """Ritorna (trasformazione, hit)."""
+        key = (hashlib.sha256(icc).digest(), in_mode, out_mode, intent)
+        with self._lock:
+            transform = self._items.get(key)
+            if transform is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return transform, True
+            if self._srgb is None:
+                self._srgb = ImageCms.createProfile("sRGB")
+            srgb = self._srgb
+        # Costruzione fuori dal lock: un doppione in concorrenza è innocuo
+        src = ImageCms.ImageCmsProfile(io.BytesIO(icc))
+        transform = ImageCms.buildTransform(src, srgb, in_mode, out_mode, renderingIntent=intent)
+        with self._lock:
+            self.misses += 1
+            self._items[key] = transform
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return transform, False
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+
+ICC_CACHE = ICCTransformCache()
+
+def to_srgb(img: Image.Image, settings: ResizeSettings) -> Image.Image:
+    return to_srgb_info(img, settings)[0]
+
+def to_srgb_info(img: Image.Image, settings: ResizeSettings) -> Tuple[Image.Image, str]:
+    """Come to_srgb; ritorna anche l'esito della cache ICC: "hit", "miss" o "" (nessun profilo)."""
+    if not HAVE_CMS or not settings.to_srgb:
+        # fallback: se ha alpha e salveremo in JPEG, convertiremo con bg in seguito
+        return (img.convert("RGB") if img.mode not in ("RGB", "RGBA") else img), ""
+    status = ""
+    try:
+        icc = img.info.get("icc_profile")
+        if icc:
+            transform, hit = ICC_CACHE.get(icc, img.mode, "RGB", INTENT_PERCEPTUAL)
+            status = "hit" if hit else "miss"
+            img = transform.apply(img)
+        else:
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGB")
+    except Exception:
+        img = img.convert("RGB")
+    return img, status
+
+def _source_box(img: Image.Image, source_size: Optional[Tuple[int, int]]):
+    """
+    Area di img che corrisponde all'intera sorgente. Con la decodifica ridotta l'ultima
+    riga/colonna può essere parziale (arrotondamento per eccesso): il box la esclude
+    in modo che la geometria finale coincida con quella della decodifica completa.
+    Il box di decode_image (SourceSize.box) tiene conto dell'orientamento EXIF.
+    """
+    if not source_size or source_size == img.size:
+        return None
+    box = getattr(source_size, "box", None)
+    if box is not None:
+        return box
+    factor = max(1, round(source_size[0] / img.width))
+    return (0, 0, min(img.width, source_size[0] / factor), min(img.height, source_size[1] / factor))
+
+def resize_scale(img: Image.Image, settings: ResizeSettings,
+                 source_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    # source_size: dimensione originale se img è stata decodificata ridotta
+    no_up = settings.no_upscale
+    if settings.scale_type == "long":
+        max_side = settings.long_side
+        w, h = source_size or img.size
+        long_curr = max(w, h)
+        if long_curr <= max_side and no_up:
+            return img.copy()
+        scale = max_side / float(long_curr)
+        nw, nh = int(round(w * scale)), int(round(h * scale))
+        return img.resize((nw, nh), Image.LANCZOS, box=_source_box(img, source_size))
+    else:  # larghezza fissa
+        target_w = settings.target_w
+        w, h = source_size or img.size
+        if w <= target_w and no_up:
+            return img.copy()
+        scale = target_w / float(w)
+        nw, nh = target_w, int(round(h * scale))
+        return img.resize((nw, nh), Image.LANCZOS, box=_source_box(img, source_size))
+
+def resize_exact(img: Image.Image, settings: ResizeSettings,
+                 source_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    # source_size: dimensione originale se img è stata decodificata ridotta
+    W = settings.exact_w
+    H = settings.exact_h
+    if settings.exact_mode == "fit":
+        # contain: ridimensiona per entrare, poi letterbox
+        iw, ih = source_size or img.size
+        scale = min(W / iw, H / ih)
+        nw, nh = int(round(iw * scale)), int(round(ih * scale))
+        resized = img.resize((nw, nh), Image.LANCZOS, box=_source_box(img, source_size))
+        # canvas
+        use_alpha = settings.transparent_bg and (settings.format in ("PNG", "WEBP"))
+        if use_alpha:
+            canvas = Image.new("RGBA", (W, H), (0,0,0,0))
+        else:
+            canvas = Image.new("RGB", (W, H), _hex_to_rgb(settings.bg))
+        x = (W - nw) // 2
+        y = (H - nh) // 2
+        canvas.paste(resized, (x, y), resized if resized.mode in ("RGBA", "LA") else None)
+        return canvas
+    else:
+        # cover: ridimensiona per coprire, poi crop centrale
+        iw, ih = source_size or img.size
+        scale = max(W / iw, H / ih)
+        nw, nh = int(round(iw * scale)), int(round(ih * scale))
+        resized = img.resize((nw, nh), Image.LANCZOS, box=_source_box(img, source_size))
+        # crop centrale
+        left = (nw - W) // 2
+        top = (nh - H) // 2
+        right = left + W
+        bottom = top + H
+        return resized.crop((left, top, right, bottom))
+
+def resize_image(img: Image.Image, settings: ResizeSettings,
+                 source_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    if settings.mode == "scale":
+        return resize_scale(img, settings, source_size)
+    return resize_exact(img, settings, source_size)
+
+def prepare_for_encode(img: Image.Image, settings: ResizeSettings) -> Tuple[Image.Image, dict]:
+    """Ritorna (immagine nel modo adatto al formato, parametri per Image.save)."""
+    fmt = settings.format
+    progressive = settings.progressive if fmt == "JPEG" else False
+
+    params = {}
+    if fmt in ("JPEG", "WEBP"):
+        params["quality"] = settings.quality
+    if fmt == "JPEG":
+        params["progressive"] = progressive
+        params["subsampling"] = "4:2:0"  # default web-friendly
+    if fmt == "WEBP":
+        # method 5 ~ buon compromesso; riduce dimensione
+        params["method"] = 5
+    if fmt in ("JPEG", "PNG", "WEBP"):
+        params["optimize"] = settings.optimize
+
+    # Trasparenza e alpha per JPEG: appiattire su bg
+    if fmt == "JPEG":
+        if img.mode in ("RGBA", "LA"):
+            base = Image.new("RGB", img.size, _hex_to_rgb(settings.bg))
+            base.paste(img, mask=img.split()[-1])
+            img = base
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+    # Rimozione metadata (a livello di encoder)
+    params.update(metadata_params(settings))
+    return img, params
+
+def _encode(img: Image.Image, settings: ResizeSettings, params: Dict[str, Any], quality: Optional[int] = None) -> bytes:
+    buf = io.BytesIO()
+    if quality is not None:
+        params = {**params, "quality": quality}
+    img.save(buf, format=settings.format, **params)
+    return buf.getvalue()
+
+def encode_image(img: Image.Image, settings: ResizeSettings, timer: StageTimer = NULL_TIMER) -> Tuple[bytes, int]:
+    """
+    Codifica in memoria. Con max_bytes (solo JPEG/WEBP) cerca per bisezione la qualità più
+    alta, entro settings.quality, il cui risultato rientra nel budget: la bitmap già
+    ridimensionata viene solo ricodificata, senza scritture su disco tra un tentativo e l'altro.
+    Se nemmeno la qualità 1 rientra nel budget viene usata comunque quella.
+    Ritorna (dati, qualità scelta); qualità 0 se il budget non è attivo.
+    """
+    with timer.stage("metadata"):
+        img, params = prepare_for_encode(img, settings)
+    if settings.format == "PNG":
+        with timer.stage("encode"):
+            data = _encode(img, settings, params)
+        if settings.png_optimize:
+            with timer.stage("optimize"):
+                data = optimize_png(img, data, params, settings.png_budget)
+        return data, 0
+    with timer.stage("encode"):
+        if not settings.max_bytes or settings.format not in BUDGET_FORMATS:
+            return _encode(img, settings, params), 0
+
+        data = _encode(img, settings, params, settings.quality)
+        if len(data) <= settings.max_bytes:
+            return data, settings.quality
+        best: Optional[Tuple[bytes, int]] = None
+        lo, hi = 1, settings.quality - 1
+        while lo <= hi:
+            q = (lo + hi) // 2
+            data = _encode(img, settings, params, q)
+            if len(data) <= settings.max_bytes:
+                best, lo = (data, q), q + 1
+            else:
+                hi = q - 1
+        # Nessuna qualità rientra: l'ultimo tentativo è stato q=1
+        return best or (data, 1)
+
+# ---------------- Ottimizzazione PNG (lossless) ----------------
+# Filtri PNG per riga (RFC 2083, 6.2) e strategie zlib provate dalla ricerca.
+# "adaptive": per ogni riga il filtro con la minima somma dei valori assoluti (come libpng).
+PNG_FILTERS = ("none", "sub", "up", "avg", "paeth", "adaptive")
+PNG_STRATEGIES = {"default": zlib.Z_DEFAULT_STRATEGY, "filtered": zlib.Z_FILTERED, "rle": zlib.Z_RLE}
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_SEARCH_THREADS = min(4, os.cpu_count() or 1)
+# Tipo colore PNG -> (canali, modo "raw" di Pillow per le righe non filtrate a 8 bit)
+_PNG_COLOR_TYPES = {0: (1, "L"), 2: (3, "RGB"), 3: (1, "P"), 4: (2, "LA"), 6: (4, "RGBA")}
+# Righe per blocco di filtraggio e byte per blocco di compressione: tra un blocco e l'altro
+# il lavoro controlla lo stop, così un tentativo oltre il budget lascia subito il pool
+PNG_BAND_ROWS = 256
+PNG_CHUNK_BYTES = 1 << 18
+
+_png_pool: Optional[ThreadPoolExecutor] = None
+
+def _png_executor() -> ThreadPoolExecutor:
+    # Un pool per processo (creato al primo uso anche nei processi worker): zlib e l'encoder
+    # di Pillow rilasciano il GIL, quindi i tentativi procedono davvero in parallelo
+    global _png_pool
+    if _png_pool is None:
+        _png_pool = ThreadPoolExecutor(PNG_SEARCH_THREADS, thread_name_prefix="png-opt")
+    return _png_pool
+
+def png_reductions(img: Image.Image, stop: threading.Event) -> List[Callable[[], Optional[Image.Image]]]:
+    """
+    Rappresentazioni equivalenti (stessi pixel visibili) più compatte di img, la più compatta per prima:
+    - alpha sempre opaca -> canale rimosso; pixel del tutto trasparenti -> colore azzerato
+    - RGB con R=G=B -> scala di grigi
+    - al più 256 colori (alpha compresa) -> palette esatta; con <= 16 colori Pillow scrive
+      l'immagine a 1/2/4 bit per pixel
+    Ogni rappresentazione è una funzione senza argomenti (None se non applicabile): la palette
+    esatta, costosa sulle immagini grandi, viene calcolata nel pool insieme ai tentativi.
+    """
+    if img.mode == "P":
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):
+        return [lambda: img]
+    if img.mode in ("RGBA", "LA"):
+        lo, hi = img.getextrema()[-1]
+        if lo == 255:
+            img = img.convert(img.mode[:-1])
+        else:
+            # Il colore sotto alpha 0 non è visibile: azzerarlo rende le righe più comprimibili
+            img = img.copy()
+            img.paste((0,) * len(img.getbands()), mask=img.getchannel("A").point(lambda a: 255 if a == 0 else 0))
+    if img.mode in ("RGB", "RGBA"):
+        r, g, b = img.getchannel("R"), img.getchannel("G"), img.getchannel("B")
+        if r.tobytes() == g.tobytes() == b.tobytes():
+            img = img.convert("LA" if img.mode == "RGBA" else "L")  # conversione esatta con R=G=B
+    return [lambda: _exact_palette(img, stop), lambda: img]
+
+def _exact_palette(img: Image.Image, stop: threading.Event) -> Optional[Image.Image]:
+    """
+    Immagine "P" con gli stessi colori di img (nessuna quantizzazione); None se > 256 colori
+    o se stop viene impostato (gli indici sono calcolati a blocchi di PNG_BAND_ROWS righe).
+    """
+    found = img.getcolors(256) if HAVE_NUMPY else None
+    if found is None:
+        return None
+    bands = len(img.getbands())
+    shifts = np.arange(bands, dtype=np.uint32) * 8
+    colors = np.sort((np.array([c for _, c in found], dtype=np.uint32).reshape(-1, bands) << shifts).sum(axis=1))
+    # Scala di grigi (chiavi a 8/16 bit): tabella diretta; colori: ricerca binaria tra <= 256 chiavi
+    lut = None
+    if bands <= 2:
+        lut = np.zeros(1 << (8 * bands), dtype=np.uint8)
+        lut[colors] = np.arange(len(colors))
+    pixels = np.asarray(img).reshape(img.height, -1, bands)
+    index = np.empty((img.height, img.width), dtype=np.uint8)
+    for start in range(0, img.height, PNG_BAND_ROWS):
+        if stop.is_set():
+            return None
+        key = (pixels[start:start + PNG_BAND_ROWS].astype(np.uint32) << shifts).sum(axis=2)
+        index[start:start + PNG_BAND_ROWS] = lut[key] if lut is not None else np.searchsorted(colors, key)
+    chan = [(colors >> (8 * c)) & 0xFF for c in range(bands)]
+    gray = img.mode in ("L", "LA")
+    rgb = [chan[0]] * 3 if gray else chan[:3]
+    alpha = chan[-1] if img.mode in ("LA", "RGBA") else None
+    if alpha is not None:
+        # Voci semitrasparenti all'inizio: il chunk tRNS si ferma all'ultima voce non opaca
+        order = np.argsort(alpha, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        index = rank[index]
+        rgb = [c[order] for c in rgb]
+        alpha = alpha[order]
+    pal = Image.frombytes("P", img.size, index.astype(np.uint8).tobytes())
+    pal.putpalette(np.stack(rgb, axis=1).astype(np.uint8).tobytes())
+    if alpha is not None:
+        n = int(np.count_nonzero(alpha < 255))
+        if n:
+            pal.info["transparency"] = alpha[:n].astype(np.uint8).tobytes()
+    return pal
+
+def _png_chunks(data: bytes) -> List[Tuple[bytes, bytes]]:
+    chunks, pos = [], len(PNG_SIGNATURE)
+    while pos < len(data):
+        length, ctype = struct.unpack(">I4s", data[pos:pos + 8])
+        chunks.append((ctype, data[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+    return chunks
+
+def _png_chunk(ctype: bytes, body: bytes) -> bytes:
+    return struct.pack(">I", len(body)) + ctype + body + struct.pack(">I", zlib.crc32(ctype + body))
+
+def _filtered_scanlines(raw, bpp: int, stop: threading.Event) -> Optional[Dict[str, bytes]]:
+    """
+    Righe raw (array h x byte_per_riga) filtrate con ogni filtro PNG, byte di tipo in testa.
+    Lavora a blocchi di PNG_BAND_ROWS righe; None se stop viene impostato nel frattempo.
+    """
+    parts: Dict[str, List[bytes]] = {name: [] for name in PNG_FILTERS}
+    prev = np.zeros((1, raw.shape[1]), dtype=np.int16)  # riga sopra la prima: tutta zero
+    for start in range(0, len(raw), PNG_BAND_ROWS):
+        if stop.is_set():
+            return None
+        x = raw[start:start + PNG_BAND_ROWS].astype(np.int16)
+        left = np.zeros_like(x)
+        left[:, bpp:] = x[:, :-bpp]
+        up = np.vstack([prev, x[:-1]])
+        upleft = np.zeros_like(x)
+        upleft[:, bpp:] = up[:, :-bpp]
+        prev = x[-1:]
+        p = left + up - upleft
+        pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - upleft)
+        paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upleft))
+        rows = [x, x - left, x - up, x - ((left + up) >> 1), x - paeth]
+        rows = [(r & 0xFF).astype(np.uint8) for r in rows]
+        # Euristica di libpng: per ogni riga il filtro con la minima somma dei byte letti con segno
+        cost = np.stack([np.abs(r.view(np.int8).astype(np.int32)).sum(axis=1) for r in rows])
+        best = cost.argmin(axis=0)
+        rows.append(np.choose(best[:, None], rows))
+        for ftype, (name, r) in enumerate(zip(PNG_FILTERS, rows)):
+            types = best[:, None] if name == "adaptive" else np.full((len(r), 1), ftype)
+            parts[name].append(np.hstack([types.astype(np.uint8), r]).tobytes())
+    return {name: b"".join(chunks) for name, chunks in parts.items()}
+
+def _png_header(img: Image.Image, params: Dict[str, Any]) -> List[Tuple[bytes, bytes]]:
+    """
+    Chunk di intestazione (IHDR, PLTE, tRNS, profilo ICC, ...) che Pillow scriverebbe per img.
+    Si salva solo la prima riga (stessi modo, palette e info) e si corregge l'altezza in IHDR:
+    la codifica dell'immagine intera costerebbe quanto un tentativo e non si può interrompere.
+    """
+    buf = io.BytesIO()
+    img.crop((0, 0, img.width, 1)).save(buf, format="PNG", compress_level=0, **params)
+    chunks = [(t, b) for t, b in _png_chunks(buf.getvalue()) if t not in (b"IDAT", b"IEND")]
+    chunks[0] = (b"IHDR", chunks[0][1][:4] + struct.pack(">I", img.height) + chunks[0][1][8:])
+    return chunks
+
+def _png_candidates(reduce: Callable[[], Optional[Image.Image]], params: Dict[str, Any],
+                    stop: threading.Event) -> List[Tuple[int, Any]]:
+    """
+    [(priorità, funzione senza argomenti -> PNG completo)] per una rappresentazione di
+    png_reductions. Gira nel pool come i tentativi; con stop impostato restituisce [] e le
+    funzioni None.
+    """
+    params = {k: v for k, v in params.items() if k != "optimize"}
+    img = None if stop.is_set() else reduce()
+    if img is None or stop.is_set():
+        return []
+    if not HAVE_NUMPY:
+        # Solo strategie zlib dell'encoder di Pillow (filtro adattivo di Pillow)
+        def pillow(strategy):
+            if stop.is_set():
+                return None
+            buf = io.BytesIO()
+            img.save(buf, format="PNG", compress_level=9, compress_type=strategy, **params)
+            return buf.getvalue()
+        return [(i, lambda s=s: pillow(s)) for i, s in enumerate(PNG_STRATEGIES.values())]
+
+    # Intestazione scritta da Pillow; IDAT filtrato e compresso qui
+    chunks = _png_header(img, params)
+    width, height, depth, ctype, _, _, interlace = struct.unpack(">IIBBBBB", chunks[0][1])
+    if interlace or depth not in (1, 2, 4, 8) or ctype not in _PNG_COLOR_TYPES:
+        return []
+    channels, rawmode = _PNG_COLOR_TYPES[ctype]
+    if depth < 8:
+        # Le immagini "1" hanno un packer proprio; le palette a 1/2/4 bit usano "P;n"
+        rawmode = "1" if img.mode == "1" else f"{rawmode};{depth}"
+    row_bytes = (width * channels * depth + 7) // 8
+    raw = np.frombuffer(img.tobytes("raw", rawmode), dtype=np.uint8)
+    if raw.size != row_bytes * height:
+        return []
+    scanlines = _filtered_scanlines(raw.reshape(height, row_bytes), max(1, channels * depth // 8), stop)
+    if scanlines is None:
+        return []
+    head = PNG_SIGNATURE + b"".join(_png_chunk(t, b) for t, b in chunks)
+    tail = _png_chunk(b"IEND", b"")
+
+    def build(filt, strategy):
+        z = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+        lines = memoryview(scanlines[filt])
+        idat = []
+        for pos in range(0, len(lines), PNG_CHUNK_BYTES):
+            if stop.is_set():
+                return None
+            idat.append(z.compress(lines[pos:pos + PNG_CHUNK_BYTES]))
+        idat.append(z.flush())
+        return head + _png_chunk(b"IDAT", b"".join(idat)) + tail
+
+    # Prima i tentativi che vincono più spesso: nessun filtro per palette/basse profondità, adattivo per il resto
+    preferred = "none" if ctype == 3 or depth < 8 else "adaptive"
+    filters = sorted(PNG_FILTERS, key=lambda f: f != preferred)
+    return [(i * len(PNG_STRATEGIES) + j, lambda f=f, s=s: build(f, s))
+            for i, f in enumerate(filters) for j, s in enumerate(PNG_STRATEGIES.values())]
+
+def optimize_png(img: Image.Image, data: bytes, params: Dict[str, Any], budget: float = 1.0) -> bytes:
+    """
+    Ottimizzazione PNG senza perdita: prova le rappresentazioni di png_reductions con più
+    combinazioni filtro/strategia zlib in parallelo e restituisce il PNG più piccolo, oppure
+    data (la codifica standard di Pillow) se nessun tentativo è più piccolo.
+    budget: secondi massimi; allo scadere si tiene il migliore tra i tentativi già conclusi.
+    Preparazione delle righe e tentativi girano nel pool condiviso e controllano un evento
+    di stop per chiamata: quelli ancora in corso si fermano al blocco successivo e non
+    occupano il pool durante il file seguente.
+    """
+    deadline = time.perf_counter() + budget
+    stop = threading.Event()
+    pool = _png_executor()
+    preparing, pending = set(), set()
+    best = data
+    try:
+        for reduce in png_reductions(img, stop):
+            if time.perf_counter() >= deadline:
+                break
+            preparing.add(pool.submit(_png_candidates, reduce, params, stop))
+        pending = set(preparing)
+        while pending:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is not None:
+                    continue
+                if f in preparing:
+                    pending |= {pool.submit(fn) for _, fn in f.result()}
+                elif f.result() is not None and len(f.result()) < len(best):
+                    best = f.result()
+    finally:
+        stop.set()
+        for f in pending:
+            f.cancel()
+    return best
+
+
+def save_image(img: Image.Image, out_path: Path, settings: ResizeSettings,
+               timer: StageTimer = NULL_TIMER) -> Tuple[Path, int]:
+    """
+    Codifica (vedi encode_image) e scrive il file; ritorna (percorso, qualità scelta).
+    out_path è il percorso senza estensione: quella del formato viene aggiunta al nome.
+    """
+    data, quality = encode_image(img, settings, timer)
+
+    # Estensione coerente
+    out_path = out_path.with_name(out_path.name + settings.extension)
+
+    with timer.stage("write"):
+        out_path.write_bytes(data)
+    return out_path, quality
+
+def process_file(path: Path, rel: str, out_base: Path, settings: ResizeSettings,
+                 timing: bool = False, write: bool = True, data: Optional[bytes] = None) -> FileResult:
+    """
+    Elabora un singolo file (apertura, sRGB, resize, codifica, salvataggio).
+    Funzione a livello di modulo: viene eseguita anche nei processi del pool.
+    Non solleva eccezioni: gli errori sono riportati nel FileResult.
+    timing=True misura ogni fase (FileResult.timings, vedi STAGES).
+    write=False non tocca la destinazione: gli output codificati restano in
+    FileResult.pending per lo stadio di scrittura (OutputWriter).
+    data: sorgente già in memoria (es. appena scaricata), decodificata senza passare dal
+    disco; path resta solo il nome riportato nel FileResult.
+    """
+    timer = StageTimer() if timing else NULL_TIMER
+    t0 = time.perf_counter()
+    try:
+        img, source_size = decode_image(io.BytesIO(data) if data is not None else path, settings, timer)
+    except Exception as e:
+        return FileResult(path, rel, ok=False, skipped=True, error=str(e))
+    try:
+        # Colori (una sola volta, anche con più varianti)
+        icc = ""
+        if settings.to_srgb:
+            with timer.stage("to_srgb"):
+                img, icc = to_srgb_info(img, settings)
+
+        if write:
+            out_base.parent.mkdir(parents=True, exist_ok=True)
+        orig_size = len(data) if data is not None else path.stat().st_size
+        outputs = []
+        pending = []
+        for name, vs in settings.output_targets():
+            # Ridimensionamento
+            with timer.stage("resize"):
+                out_img = resize_image(img, vs, source_size)
+            base = out_base.with_name(f"{out_base.name}_{name}") if name else out_base
+            out_file = base.with_name(base.name + vs.extension)  # non with_suffix: nomi con punti ("Uff. Standardizzazione")
+            encoded, quality = encode_image(out_img, vs, timer)
+            if write:
+                with timer.stage("write"):
+                    write_bytes_atomic(out_file, encoded)
+            else:
+                pending.append((out_file, encoded))
+            outputs.append({
+                "name": name, "path": out_file, "width": out_img.width, "height": out_img.height,
+                "bytes": len(encoded), "format": vs.format, "quality": quality,
+            })
+        timings = timer.times
+        if timings is not None:
+            timings["total"] = time.perf_counter() - t0
+        return FileResult(path, rel, ok=True, out_path=outputs[0]["path"], orig_size=orig_size,
+                          new_size=sum(o["bytes"] for o in outputs), quality=outputs[0]["quality"],
+                          outputs=outputs if settings.variants else None, icc=icc,
+                          pixels_in=source_size[0] * source_size[1],
+                          pixels_out=sum(o["width"] * o["height"] for o in outputs), timings=timings,
+                          pending=pending or None)
+    except Exception as e:
+        return FileResult(path, rel, ok=False, error=str(e))
+
+
+# ---------------- Scrittura (write-behind) ----------------
+def write_bytes_atomic(path: Path, data: bytes):
+    """Scrive su un file temporaneo nella stessa cartella e rinomina: mai file scritti a metà."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+class OutputWriter:
+    """
+    Stadio di scrittura separato dal calcolo. I FileResult con gli output già codificati
+    (FileResult.pending) vengono consegnati con submit(); uno o più thread li scrivono con
+    write_bytes_atomic, creando ogni cartella una sola volta, e li restituiscono completati
+    da completed()/drain(). Su cartelle di rete l'attesa del disco si sovrappone alla
+    decodifica/codifica dei file successivi. Coda limitata: se il disco non tiene il passo
+    il calcolo rallenta invece di accumulare dati in memoria.
+    """
+
+    def __init__(self, threads: int = 2, max_pending: int = 32):
+        self._in: "queue.Queue[Optional[FileResult]]" = queue.Queue(maxsize=max_pending)
+        self._out: "queue.Queue[FileResult]" = queue.Queue()
+        self._dirs: set = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(max(1, threads))]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, res: FileResult):
+        self._in.put(res)
+
+    def completed(self) -> Iterator[FileResult]:
+        """Risultati già scritti (non bloccante)."""
+        while True:
+            try:
+                yield self._out.get_nowait()
+            except queue.Empty:
+                return
+
+    def drain(self) -> Iterator[FileResult]:
+        """Chiude l'ingresso e restituisce i risultati man mano che le scritture terminano."""
+        self._close_input()
+        while any(t.is_alive() for t in self._threads):
+            try:
+                yield self._out.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        yield from self.completed()
+
+    def shutdown(self):
+        """Completa le scritture in coda e termina i thread (risultati non più restituiti)."""
+        self._close_input()
+        for t in self._threads:
+            t.join()
+
+    def _close_input(self):
+        if not self._closed:
+            self._closed = True
+            for _ in self._threads:
+                self._in.put(None)
+
+    def _mkdir(self, folder: Path):
+        with self._lock:
+            if folder in self._dirs:
+                return
+        folder.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._dirs.add(folder)
+
+    def _run(self):
+        while True:
+            res = self._in.get()
+            if res is None:
+                return
+            self._out.put(self._write(res))
+
+    def _write(self, res: FileResult) -> FileResult:
+        t0 = time.perf_counter()
+        try:
+            for path, data in res.pending:
+                self._mkdir(path.parent)
+                write_bytes_atomic(path, data)
+        except Exception as e:
+            res = replace(res, ok=False, error=f"scrittura non riuscita: {e}")
+        res.pending = None
+        if res.timings is not None:
+            elapsed = time.perf_counter() - t0
+            res.timings["write"] = res.timings.get("write", 0.0) + elapsed
+            res.timings["total"] = res.timings.get("total", 0.0) + elapsed
+        return res
+
+
+# ---------------- Duplicati percettivi ----------------
+HASH_METHODS = ("dhash", "phash")
+# Lato della miniatura in scala di grigi da cui si calcola l'hash (64 bit)
+HASH_THUMB = {"dhash": (9, 8), "phash": (32, 32)}
+DEDUP_DISTANCE = 4           # distanza di Hamming massima di default (su 64 bit)
+ASPECT_TOLERANCE = 0.01      # stesse proporzioni (1%): stesso ritaglio/geometria dell'output
+
+def _hash_thumb(path: Path, method: str) -> Tuple[Image.Image, float, int]:
+    """Miniatura in scala di grigi (orientata), proporzioni e pixel della sorgente."""
+    size = HASH_THUMB[method]
+    with Image.open(path) as img:
+        pixels = img.width * img.height
+        img.draft("L", (size[0] * 4, size[1] * 4))  # JPEG: decodifica DCT ridotta
+        img = ImageOps.exif_transpose(img)
+        aspect = img.width / img.height
+        return img.convert("L").resize(size, Image.LANCZOS), aspect, pixels
+
+def _dct_matrix(n: int):
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m.astype(np.float32)
+
+def perceptual_hashes(thumbs: Sequence[Image.Image], method: str = "dhash") -> List[int]:
+    """
+    Hash a 64 bit delle miniature (vedi HASH_THUMB). Con NumPy in blocco su tutte le
+    miniature; senza NumPy solo dhash, calcolato in Python.
+    dhash: confronto tra pixel adiacenti di una riga; phash: coefficienti DCT 8x8 a bassa
+    frequenza confrontati con la mediana (più robusto a ricompressione e piccoli ritocchi).
+    """
+    if not thumbs:
+        return []
+    if not HAVE_NUMPY:
+        if method != "dhash":
+            raise ValueError(f"{method} richiede NumPy (pip install numpy)")
+        hashes = []
+        for t in thumbs:
+            px = list(t.getdata())
+            w, h = t.size
+            bits = 0
+            for y in range(h):
+                for x in range(w - 1):
+                    bits = (bits << 1) | (px[y * w + x + 1] > px[y * w + x])
+            hashes.append(bits)
+        return hashes
+
+    a = np.stack([np.asarray(t, dtype=np.float32) for t in thumbs])  # (N, H, W)
+    if method == "dhash":
+        bits = a[:, :, 1:] > a[:, :, :-1]
+    else:
+        d = _dct_matrix(a.shape[1])
+        low = (d @ a @ d.T)[:, :8, :8].reshape(len(a), 64)
+        bits = low > np.median(low[:, 1:], axis=1, keepdims=True)  # mediana senza la componente DC
+    packed = np.packbits(bits.reshape(len(a), 64), axis=1)
+    return [int.from_bytes(row.tobytes(), "big") for row in packed]
+
+def _hamming_to(hashes, h: int):
+    """Distanze di Hamming tra h e tutti gli hash (array NumPy se disponibile, altrimenti lista)."""
+    if not HAVE_NUMPY:
+        return [bin(x ^ h).count("1") for x in hashes]
+    x = hashes ^ np.uint64(h)
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(x)
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def find_duplicates(items: Sequence[Tuple[str, Path]], max_distance: int = DEDUP_DISTANCE,
+                    method: str = "dhash", workers: int = 1,
+                    stop_flag: Optional[threading.Event] = None) -> Dict[str, List[Tuple[str, int]]]:
+    """
+    Raggruppa i quasi-duplicati tra items [(rel, percorso)].
+    Ritorna {rel rappresentante: [(rel duplicato, distanza)]}, solo per i gruppi con almeno
+    un duplicato. Il rappresentante è la sorgente con più pixel (a parità, il nome minore);
+    ogni gruppo contiene solo immagini entro max_distance dal rappresentante e con le stesse
+    proporzioni, quindi nessuna catena di immagini via via diverse. I file non leggibili
+    vengono ignorati (l'errore emerge poi nell'elaborazione normale).
+    """
+    if method not in HASH_METHODS:
+        raise ValueError(f"metodo hash non valido: {method!r} (ammessi: {', '.join(HASH_METHODS)})")
+
+    def thumb(item):
+        if stop_flag is not None and stop_flag.is_set():
+            return None
+        try:
+            return _hash_thumb(item[1], method)
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        thumbs = list(pool.map(thumb, items))
+    valid = [(rel, path, t) for (rel, path), t in zip(items, thumbs) if t is not None]
+    if not valid or (stop_flag is not None and stop_flag.is_set()):
+        return {}
+
+    # Ordine: prima le sorgenti con più pixel, così diventano rappresentanti
+    valid.sort(key=lambda v: (-v[2][2], v[0]))
+    hashes = perceptual_hashes([t[0] for _, _, t in valid], method)
+    aspects = [t[1] for _, _, t in valid]
+    if HAVE_NUMPY:
+        hashes = np.array(hashes, dtype=np.uint64)
+        aspects = np.array(aspects)
+        free = np.ones(len(valid), dtype=bool)
+    else:
+        free = [True] * len(valid)
+
+    groups: Dict[str, List[Tuple[str, int]]] = {}
+    for i in range(len(valid)):
+        if not free[i]:
+            continue
+        free[i] = False
+        dist = _hamming_to(hashes, int(hashes[i]))
+        if HAVE_NUMPY:
+            found = np.flatnonzero(free & (dist <= max_distance)
+                                   & (np.abs(aspects - aspects[i]) <= ASPECT_TOLERANCE * aspects[i]))
+            free[found] = False
+        else:
+            found = [j for j in range(i + 1, len(valid)) if free[j] and dist[j] <= max_distance
+                     and abs(aspects[j] - aspects[i]) <= ASPECT_TOLERANCE * aspects[i]]
+            for j in found:
+                free[j] = False
+        if len(found):
+            groups[valid[i][0]] = sorted((valid[j][0], int(dist[j])) for j in found)
+    return groups
+
+def write_duplicates_report(path: Path, groups: Dict[str, List[Tuple[str, int]]]):
+    """Report dei duplicati: .csv = una riga per duplicato, altrimenti JSON."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix.lower() == ".csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["group", "file", "representative", "distance"])
+            for n, (rep, members) in enumerate(sorted(groups.items()), 1):
+                w.writerow([n, rep, rep, 0])
+                for rel, dist in members:
+                    w.writerow([n, rel, rep, dist])
+    else:
+        write_json_atomic(path, {
+            "groups": [{"representative": rep, "duplicates": [{"file": r, "distance": d} for r, d in members]}
+                       for rep, members in sorted(groups.items())],
+        })
+
+def link_or_copy(src: Path, dst: Path) -> str:
+    """Collega dst a src (hardlink) o, se non possibile, lo copia; sempre con rinomina atomica."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+        how = "link"
+    except OSError:  # file system diversi, FAT, alcune condivisioni di rete
+        shutil.copyfile(src, tmp)
+        how = "copy"
+    os.replace(tmp, dst)
+    return how
+
+
+# ---------------- Report tempi ----------------
+def percentile(values: List[float], p: float) -> float:
+    """Percentile p (0..100) per rango più vicino; 0.0 se la lista è vuota."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[k]
+
+class TimingReport:
+    """
+    Raccoglie i tempi per fase dei FileResult di un'esecuzione e ne calcola il riepilogo:
+    p50/p95 per fase, immagini/s, MB/s letti e scritti, megapixel/s.
+    Report su file: JSON (riepilogo + righe per file) oppure CSV (una riga per file).
+    """
+
+    def __init__(self):
+        self.rows: List[Dict[str, Any]] = []
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def add(self, res: FileResult):
+        if not res.ok or not res.timings:
+            return
+        self.rows.append({
+            "file": res.rel,
+            "bytes_in": res.orig_size, "bytes_out": res.new_size,
+            "pixels_in": res.pixels_in, "pixels_out": res.pixels_out,
+            **{k: round(v, 6) for k, v in res.timings.items()},
+        })
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = self.elapsed
+        n = len(self.rows)
+        bytes_in = sum(r["bytes_in"] for r in self.rows)
+        bytes_out = sum(r["bytes_out"] for r in self.rows)
+        pixels_in = sum(r["pixels_in"] for r in self.rows)
+        stages = {}
+        for name in STAGES + ("total",):
+            values = [r[name] for r in self.rows if name in r]
+            if values:
+                stages[name] = {
+                    "files": len(values),
+                    "total_s": round(sum(values), 4),
+                    "p50_ms": round(percentile(values, 50) * 1000, 2),
+                    "p95_ms": round(percentile(values, 95) * 1000, 2),
+                    "max_ms": round(max(values) * 1000, 2),
+                }
+        rate = (lambda x: round(x / elapsed, 2)) if elapsed > 0 else (lambda x: 0.0)
+        return {
+            "files": n,
+            "elapsed_s": round(elapsed, 3),
+            "images_per_s": rate(n),
+            "mb_in_per_s": rate(bytes_in / 2**20),
+            "mb_out_per_s": rate(bytes_out / 2**20),
+            "mpix_per_s": rate(pixels_in / 1e6),
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "pixels_in": pixels_in,
+            "pixels_out": sum(r["pixels_out"] for r in self.rows),
+            "stages": stages,
+        }
+
+    def summary_lines(self) -> List[str]:
+        """Riepilogo leggibile per il log: throughput e una riga per fase."""
+        sm = self.summary()
+        lines = [f"Tempi: {sm['files']} file in {sm['elapsed_s']:.1f} s — {sm['images_per_s']} img/s, "
+                 f"{sm['mb_in_per_s']} MB/s letti, {sm['mb_out_per_s']} MB/s scritti, {sm['mpix_per_s']} MP/s"]
+        total = sm["stages"].get("total", {}).get("total_s") or 0
+        for name, st in sm["stages"].items():
+            share = f" ({st['total_s'] / total * 100:.0f}%)" if total and name != "total" else ""
+            lines.append(f"  {name:<15} p50 {st['p50_ms']:>8.1f} ms  p95 {st['p95_ms']:>8.1f} ms"
+                         f"  tot {st['total_s']:>7.2f} s{share}")
+        return lines
+
+    def write(self, path: Path):
+        """Scrive il report: .csv = una riga per file, altrimenti JSON completo."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix.lower() == ".csv":
+            fields = ["file", "bytes_in", "bytes_out", "pixels_in", "pixels_out", *STAGES, "total"]
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                w = csv.DictWriter(f, fieldnames=fields, restval="")
+                w.writeheader()
+                w.writerows(self.rows)
+        else:
+            write_json_atomic(path, {"summary": self.summary(), "files": self.rows})
+
+
+# ---------------- Manifest (modalità incrementale) ----------------
+MANIFEST_NAME = ".web_resize_manifest.json"
+MANIFEST_VERSION = 2
+VARIANT_INDEX_NAME = "variants.json"
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def write_json_atomic(path: Path, data: Any):
+    write_bytes_atomic(path, json.dumps(data, ensure_ascii=False, indent=1).encode("utf-8"))
+
+def settings_digest(settings: ResizeSettings) -> str:
+    payload = json.dumps({"version": MANIFEST_VERSION, **asdict(settings)}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResizeManifest:
+    """
+    Stato dell'ultima elaborazione, salvato in DESTINAZIONE/.web_resize_manifest.json.
+
+    Per ogni sorgente (chiave: percorso relativo) registra dimensione, mtime, sha256 e
+    output prodotti (uno, o uno per variante). Se il digest dei parametri cambia, tutte le voci sono invalidate.
+    Una sorgente è invariata se dimensione e mtime coincidono (nessuna lettura del file)
+    oppure, se solo mtime è cambiato, se coincide l'hash del contenuto.
+    """
+
+    def __init__(self, dst: Path, settings: ResizeSettings):
+        self.dst = dst
+        self.path = dst / MANIFEST_NAME
+        self.digest = settings_digest(settings)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._previous: Dict[str, Dict[str, Any]] = {}  # voci con parametri diversi
+        self._hashes: Dict[str, str] = {}  # hash già calcolati in is_current()
+        self._dirty = False
+
+    @classmethod
+    def load(cls, dst: Path, settings: ResizeSettings) -> "ResizeManifest":
+        m = cls(dst, settings)
+        try:
+            data = json.loads(m.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return m
+        if data.get("version") == MANIFEST_VERSION and data.get("settings") == m.digest:
+            m.entries = data.get("files", {})
+        else:
+            # Parametri cambiati: tutto da rielaborare; le vecchie voci servono solo
+            # a rimuovere gli output con nome diverso (es. cambio formato o suffix)
+            m._previous = data.get("files", {})
+            m._dirty = True
+        return m
+
+    def is_current(self, path: Path, rel: str) -> bool:
+        entry = self.entries.get(rel)
+        if not entry or not all((self.dst / o).exists() for o in entry["outs"]):
+            return False
+        st = path.stat()
+        if st.st_size != entry["size"]:
+            return False
+        if st.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        digest = self._hashes[rel] = file_sha256(path)
+        if digest != entry["sha256"]:
+            return False
+        entry["mtime_ns"] = st.st_mtime_ns  # solo "toccato": aggiorna mtime
+        self._dirty = True
+        return True
+
+    def record(self, res: FileResult):
+        st = res.src.stat()
+        digest = self._hashes.pop(res.rel, None) or file_sha256(res.src)
+        outs = [p.relative_to(self.dst).as_posix() for p in res.out_paths]
+        old = self.entries.get(res.rel) or self._previous.pop(res.rel, None)
+        for o in set(old["outs"] if old else ()) - set(outs):
+            (self.dst / o).unlink(missing_ok=True)  # es. cambio formato/suffix/varianti
+        self.entries[res.rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest, "outs": outs}
+        self._dirty = True
+
+    def prune(self, current: Iterable[str]) -> List[Tuple[str, Path]]:
+        """Rimuove voci e output delle sorgenti non più presenti. Ritorna [(rel, output)]."""
+        keep = set(current)
+        removed = []
+        for entries in (self.entries, self._previous):
+            for rel in [r for r in entries if r not in keep]:
+                for o in entries.pop(rel)["outs"]:
+                    out = self.dst / o
+                    out.unlink(missing_ok=True)
+                    removed.append((rel, out))
+        if removed:
+            self._dirty = True
+        return removed
+
+    def save(self):
+        if not self._dirty:
+            return
+        write_json_atomic(self.path, {"version": MANIFEST_VERSION, "settings": self.digest, "files": self.entries})
+        self._dirty = False
+
+
+class VariantIndex:
+    """
+    Indice delle varianti prodotte, in DESTINAZIONE/variants.json:
+    {"sources": {percorso sorgente: {variante: {file, width, height, bytes, format}}}}
+    Aggiornato a ogni esecuzione (le voci delle sorgenti non rielaborate restano valide).
+    """
+
+    def __init__(self, dst: Path):
+        self.dst = dst
+        self.path = dst / VARIANT_INDEX_NAME
+        self.sources: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def load(cls, dst: Path) -> "VariantIndex":
+        idx = cls(dst)
+        try:
+            idx.sources = json.loads(idx.path.read_text(encoding="utf-8")).get("sources", {})
+        except (OSError, ValueError):
+            pass
+        return idx
+
+    def record(self, res: FileResult):
+        self.sources[Path(res.rel).as_posix()] = {
+            o["name"]: {"file": o["path"].relative_to(self.dst).as_posix(), "width": o["width"],
+                        "height": o["height"], "bytes": o["bytes"], "format": o["format"]}
+            for o in res.outputs or ()
+        }
+
+    def remove(self, rel: str):
+        self.sources.pop(Path(rel).as_posix(), None)
+
+    def save(self):
+        write_json_atomic(self.path, {"version": 1, "sources": dict(sorted(self.sources.items()))})
+
+
+# ---------------- Pipeline ----------------
+class ResizePipeline:
+    """
+    Elabora gruppi di immagini con i parametri di un ResizeSettings.
+
+    workers > 1 distribuisce i file su un pool di processi; i risultati sono restituiti
+    nell'ordine di completamento. stop_flag (threading.Event, opzionale) interrompe
+    l'elaborazione: i file non ancora avviati vengono scartati.
+    incremental=True usa il manifest in destinazione: le sorgenti invariate sono
+    restituite con unchanged=True senza essere aperte, gli output orfani con pruned=True.
+    timing=True misura le fasi di ogni file: il riepilogo dell'ultima esecuzione è in
+    self.report (TimingReport).
+    Gli output sono codificati in memoria e scritti da un OutputWriter con write_threads
+    thread (rinomina atomica): un FileResult viene restituito solo a file scritti.
+    dedup (distanza di Hamming, None = disattivato) raggruppa i quasi-duplicati prima
+    dell'elaborazione: viene codificato solo il rappresentante di ogni gruppo, gli altri
+    ricevono gli stessi output (hardlink o copia) con duplicate_of valorizzato. I gruppi
+    dell'ultima esecuzione sono in self.duplicates.
+    keep_extension=True conserva l'estensione della sorgente nel nome dell'output
+    (a.jpg -> a.jpg.png): sorgenti con lo stesso nome e formato diverso non si sovrascrivono.
+    """
+
+    def __init__(self, settings: ResizeSettings, workers: int = 1,
+                 stop_flag: Optional[threading.Event] = None, incremental: bool = False,
+                 timing: bool = False, write_threads: int = 2,
+                 dedup: Optional[int] = None, dedup_method: str = "dhash", keep_extension: bool = False):
+        self.settings = settings.validate()
+        self.keep_extension = keep_extension
+        self.workers = max(1, int(workers))
+        self.stop_flag = stop_flag or threading.Event()
+        self.incremental = incremental
+        self.timing = timing
+        self.write_threads = max(1, int(write_threads))
+        self.report: Optional[TimingReport] = None
+        if dedup_method not in HASH_METHODS:
+            raise ValueError(f"dedup_method non valido: {dedup_method!r} (ammessi: {', '.join(HASH_METHODS)})")
+        if dedup_method == "phash" and not HAVE_NUMPY:
+            raise ValueError("phash richiede NumPy (pip install numpy)")
+        self.dedup = dedup
+        self.dedup_method = dedup_method
+        self.duplicates: Dict[str, List[Tuple[str, int]]] = {}
+
+    @property
+    def cancelled(self) -> bool:
+        return self.stop_flag.is_set()
+
+    def collect_files(self, src: Path) -> List[Path]:
+        return collect_files(src, self.settings.recursive)
+
+    def _jobs(self, files: Iterable[Path], src: Path, dst: Path):
+        suffix = self.settings.suffix or ""
+        for path in files:
+            if self.settings.recursive:
+                rel = path.relative_to(src)
+                target_dir = dst / rel.parent
+            else:
+                rel = Path(path.name)
+                target_dir = dst
+            yield path, str(rel), target_dir / ((path.name if self.keep_extension else path.stem) + suffix)
+
+    def process(self, files: Iterable[Path], src: Path, dst: Path) -> Iterator[FileResult]:
+        """Elabora i file indicati (già raccolti da src) e restituisce un FileResult per file."""
+        manifest = ResizeManifest.load(dst, self.settings) if self.incremental else None
+        index = VariantIndex.load(dst) if self.settings.variants else None
+        report = self.report = TimingReport() if self.timing else None
+
+        current, stale = [], []
+        for path, rel, out_base in self._jobs(files, src, dst):
+            current.append(rel)
+            if manifest and manifest.is_current(path, rel):
+                yield FileResult(path, rel, ok=True, unchanged=True,
+                                 out_path=dst / manifest.entries[rel]["outs"][0])
+            else:
+                stale.append((path, rel, out_base))
+
+        # Pre-passata duplicati: si elaborano solo i rappresentanti
+        groups = self.duplicates = {}
+        if self.dedup is not None and len(stale) > 1:
+            groups = self.duplicates = find_duplicates(
+                [(rel, path) for path, rel, _ in stale], self.dedup, self.dedup_method,
+                self.workers, self.stop_flag)
+        jobs_by_rel = {rel: (path, rel, out_base) for path, rel, out_base in stale}
+        dup_rels = {rel for members in groups.values() for rel, _ in members}
+
+        def completed(res: FileResult):
+            if res.ok:
+                if manifest:
+                    manifest.record(res)
+                if index:
+                    index.record(res)
+                if report:
+                    report.add(res)
+            return res
+
+        try:
+            orphans = []  # duplicati il cui rappresentante non è riuscito: elaborati normalmente
+            for res in self._written(self._execute(j for j in stale if j[1] not in dup_rels)):
+                yield completed(res)
+                for rel, _ in groups.get(res.rel, ()):
+                    if res.ok:
+                        yield completed(self._link_duplicate(res, *jobs_by_rel[rel]))
+                    else:
+                        orphans.append(jobs_by_rel[rel])
+            for res in self._written(self._execute(iter(orphans))):
+                yield completed(res)
+            if manifest and not self.cancelled:
+                for rel, out in manifest.prune(current):
+                    if index:
+                        index.remove(rel)
+                    yield FileResult(src / rel, rel, ok=True, pruned=True, out_path=out)
+        finally:
+            # Anche se annullato: i file completati restano registrati
+            if report:
+                report.finish()
+            if manifest:
+                manifest.save()
+            if index:
+                index.save()
+
+    @staticmethod
+    def _link_duplicate(rep: FileResult, path: Path, rel: str, out_base: Path) -> FileResult:
+        """Output di un duplicato: gli stessi file del rappresentante con il proprio nome."""
+        try:
+            outputs = []
+            for o in rep.outputs or [{"name": "", "path": rep.out_path, "bytes": rep.new_size}]:
+                base = out_base.with_name(f"{out_base.name}_{o['name']}") if o["name"] else out_base
+                target = base.with_name(base.name + o["path"].suffix)
+                link_or_copy(o["path"], target)
+                outputs.append({**o, "path": target})
+            return FileResult(path, rel, ok=True, out_path=outputs[0]["path"], orig_size=path.stat().st_size,
+                              new_size=rep.new_size, quality=rep.quality, pixels_out=rep.pixels_out,
+                              outputs=outputs if rep.outputs else None, duplicate_of=rep.rel)
+        except Exception as e:
+            return FileResult(path, rel, ok=False, error=f"duplicato di {rep.rel}: {e}")
+
+    def _written(self, results: Iterator[FileResult]) -> Iterator[FileResult]:
+        """Passa gli output codificati allo stadio di scrittura; restituisce i file completati."""
+        writer = OutputWriter(self.write_threads)
+        try:
+            for res in results:
+                if res.pending:
+                    writer.submit(res)
+                else:
+                    yield res
+                yield from writer.completed()
+            yield from writer.drain()
+        finally:
+            # Anche se annullato: le scritture già in coda vengono completate
+            writer.shutdown()
+
+    def _execute(self, jobs: Iterable[Tuple[Path, str, Path]]) -> Iterator[FileResult]:
+        jobs = iter(jobs)
+        if self.workers == 1:
+            for path, rel, out_base in jobs:
+                if self.cancelled:
+                    return
+                yield process_file(path, rel, out_base, self.settings, self.timing, False)
+            return
+
+        # Finestra limitata di job in volo: l'annullamento resta reattivo
+        # e i risultati arrivano man mano che i processi completano.
+        max_in_flight = self.workers * 2
+        pending = {}
+        pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            while True:
+                while len(pending) < max_in_flight and not self.cancelled:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    path, rel, out_base = job
+                    pending[pool.submit(process_file, path, rel, out_base, self.settings, self.timing, False)] = (path, rel)
+                if not pending or self.cancelled:
+                    return
+                finished, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    path, rel = pending.pop(fut)
+                    try:
+                        yield fut.result()
+                    except Exception as e:  # es. processo worker terminato
+                        yield FileResult(path, rel, ok=False, error=str(e))
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def run(self, src: Path, dst: Path) -> Iterator[FileResult]:
+        """Raccoglie i file di src ed elabora tutto verso dst."""
+        return self.process(self.collect_files(src), src, dst)
+
+
+# ---------------- CLI ----------------
+def build_arg_parser() -> argparse.ArgumentParser:
+    d = ResizeSettings()
+    p = argparse.ArgumentParser(description="Riduce immagini per uso web (senza interfaccia grafica).")
+    p.add_argument("src", type=Path, help="cartella sorgente")
+    p.add_argument("dst", type=Path, help="cartella di destinazione")
+    p.add_argument("--mode", choices=MODES, default=d.mode)
+    p.add_argument("--scale-type", choices=SCALE_TYPES, default=d.scale_type, help="lato lungo o larghezza fissa")
+    p.add_argument("--long-side", type=int, default=d.long_side, help="max lato lungo (px)")
+    p.add_argument("--width", dest="target_w", type=int, default=d.target_w, help="larghezza fissa (px)")
+    p.add_argument("--allow-upscale", action="store_true", help="consente l'ingrandimento")
+    p.add_argument("--exact-w", type=int, default=d.exact_w)
+    p.add_argument("--exact-h", type=int, default=d.exact_h)
+    p.add_argument("--exact-mode", choices=EXACT_MODES, default=d.exact_mode, help="fit = bordi, fill = ritaglio")
+    p.add_argument("--bg", default=d.bg, help="colore di sfondo #RRGGBB")
+    p.add_argument("--transparent-bg", action="store_true", help="sfondo trasparente (PNG/WEBP)")
+    p.add_argument("--format", type=str.upper, choices=FORMATS, default=d.format)
+    p.add_argument("--quality", type=int, default=d.quality)
+    p.add_argument("--max-kb", type=int, default=0,
+                   help="budget di peso per file in KB (JPEG/WEBP): cerca la qualità più alta che rientra")
+    p.add_argument("--no-progressive", action="store_true")
+    p.add_argument("--no-optimize", action="store_true")
+    p.add_argument("--png-optimize", action="store_true",
+                   help="PNG: ricerca senza perdita di palette/profondità/filtri/zlib (più lenta)")
+    p.add_argument("--png-budget", type=float, default=d.png_budget, metavar="SEC",
+                   help="tempo massimo per file della ricerca PNG (secondi)")
+    p.add_argument("--keep-meta", action="store_true", help="non rimuovere i metadata")
+    p.add_argument("--no-srgb", action="store_true", help="non convertire a sRGB")
+    p.add_argument("--shrink-on-load", choices=SHRINK_MODES, default=d.shrink_on_load,
+                   help="decodifica ridotta per sorgenti grandi: quality (default), fast, off")
+    p.add_argument("--suffix", default=d.suffix)
+    p.add_argument("--recursive", action="store_true", help="includi sottocartelle")
+    p.add_argument("--variant", dest="variants", action="append", type=Variant.parse, default=[],
+                   metavar="NOME=L[xA][:fit|fill][:FORMATO][:qN]",
+                   help="output aggiuntivo per ogni sorgente (ripetibile); sostituisce l'output principale")
+    p.add_argument("--incremental", action="store_true",
+                   help="salta le sorgenti invariate e rimuove gli output orfani (manifest in destinazione)")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processi paralleli")
+    p.add_argument("--write-threads", type=int, default=2,
+                   help="thread di scrittura (più alto su cartelle di rete)")
+    p.add_argument("--dedup", type=int, nargs="?", const=DEDUP_DISTANCE, metavar="N",
+                   help=f"codifica una sola volta i quasi-duplicati (distanza di Hamming max, default {DEDUP_DISTANCE})")
+    p.add_argument("--dedup-method", choices=HASH_METHODS, default="dhash", help="hash percettivo (phash richiede NumPy)")
+    p.add_argument("--dedup-report", type=Path, metavar="FILE", help="report dei duplicati (.json oppure .csv)")
+    p.add_argument("--timing-report", type=Path, metavar="FILE",
+                   help="misura le fasi di ogni file e scrive il report (.json oppure .csv)")
+    p.add_argument("--quiet", action="store_true", help="stampa solo errori e riepilogo")
+    return p
+
+def settings_from_args(args: argparse.Namespace) -> ResizeSettings:
+    return ResizeSettings(
+        mode=args.mode,
+        scale_type=args.scale_type,
+        long_side=args.long_side,
+        target_w=args.target_w,
+        no_upscale=not args.allow_upscale,
+        exact_w=args.exact_w,
+        exact_h=args.exact_h,
+        exact_mode=args.exact_mode,
+        bg=args.bg,
+        transparent_bg=args.transparent_bg,
+        format=args.format,
+        quality=args.quality,
+        max_bytes=args.max_kb * 1024,
+        progressive=not args.no_progressive,
+        optimize=not args.no_optimize,
+        png_optimize=args.png_optimize,
+        png_budget=args.png_budget,
+        strip_meta=not args.keep_meta,
+        to_srgb=not args.no_srgb,
+        shrink_on_load=args.shrink_on_load,
+        suffix=args.suffix,
+        recursive=args.recursive,
+        variants=tuple(args.variants),
+    )
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    if not args.src.is_dir():
+        print(f"Errore: cartella sorgente non valida: {args.src}", file=sys.stderr)
+        return 2
+    try:
+        pipe = ResizePipeline(settings_from_args(args), workers=args.workers, incremental=args.incremental,
+                              timing=args.timing_report is not None, write_threads=args.write_threads,
+                              dedup=args.dedup, dedup_method=args.dedup_method)
+    except ValueError as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 2
+
+    args.dst.mkdir(parents=True, exist_ok=True)
+    files = pipe.collect_files(args.src)
+    total = len(files)
+    if total == 0:
+        print("Nessuna immagine valida trovata.")
+        return 0
+    if not args.quiet:
+        print(f"Trovati {total} file. Inizio… (processi: {pipe.workers})")
+
+    processed = failed = saved_bytes = unchanged = pruned = duplicates = i = 0
+    icc_stats = {"hit": 0, "miss": 0}
+    try:
+        for res in pipe.process(files, args.src, args.dst):
+            if res.pruned:
+                pruned += 1
+                if not args.quiet:
+                    print(f"[RIMOSSO] {res.out_path.name} (sorgente eliminata: {res.rel})")
+                continue
+            i += 1
+            if res.unchanged:
+                unchanged += 1
+                continue
+            if not res.ok:
+                failed += 1
+                tag = "SKIP" if res.skipped else "ERRORE"
+                print(f"[{i}/{total}] [{tag}] {res.rel}: {res.error}", file=sys.stderr)
+                continue
+            processed += 1
+            if res.icc:
+                icc_stats[res.icc] += 1
+            if res.orig_size and res.new_size:
+                saved_bytes += max(0, res.orig_size - res.new_size)
+            if res.duplicate_of:
+                duplicates += 1
+            if not args.quiet:
+                names = ", ".join(res.out_labels)
+                dup = f", duplicato di {res.duplicate_of}" if res.duplicate_of else ""
+                print(f"[{i}/{total}] {res.rel} → {names} ({res.new_size/1024:.0f} KB{dup})")
+    except KeyboardInterrupt:
+        pipe.stop_flag.set()
+        print("Operazione annullata.", file=sys.stderr)
+        return 130
+
+    summary = f"Completato. File processati: {processed}. Errori: {failed}. Risparmio stimato: {saved_bytes/1024:.0f} KB."
+    if pipe.incremental:
+        summary += f" Invariati: {unchanged}. Output rimossi: {pruned}."
+    if icc_stats["hit"] or icc_stats["miss"]:
+        summary += f" Cache ICC: {icc_stats['hit']} hit, {icc_stats['miss']} miss."
+    if pipe.dedup is not None:
+        summary += f" Duplicati non ricodificati: {duplicates} (gruppi: {len(pipe.duplicates)})."
+    print(summary)
+    if args.dedup_report:
+        write_duplicates_report(args.dedup_report, pipe.duplicates)
+        print(f"Report duplicati: {args.dedup_report}")
+    if pipe.report:
+        print("\n".join(pipe.report.summary_lines()))
+        pipe.report.write(args.timing_report)
+        print(f"Report tempi: {args.timing_report}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
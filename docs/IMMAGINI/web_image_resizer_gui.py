@@ -12,33 +12,47 @@ Funzioni principali:
 - Rimozione metadata EXIF/ICC (opzionale)
 - Correzione orientamento da EXIF
 - Conversione a sRGB (se possibile)
+- Atlas sprite: ritratti di dimensione esatta impacchettati in pochi fogli + indice JSON
+- Varianti: più dimensioni/formati per sorgente con una sola decodifica (indice variants.json)
+- Decodifica ridotta per sorgenti grandi (qualità / veloce / disattivata)
 - Suffix automatico al nome file (es. *_web)
+- Modalità incrementale: rielabora solo i file nuovi o modificati
+- Elaborazione parallela su più processi (un file per processo)
+- Peso massimo per file (JPEG/WebP): qualità scelta automaticamente entro il budget
+- Tempi per fase e throughput (immagini/s, MB/s) nel log, con report JSON/CSV
+- Quasi-duplicati (hash percettivo): una sola codifica per gruppo, report CSV dei gruppi
+- PNG lossless max: palette/profondità/alpha ridotte e ricerca parallela filtri/zlib
+- Avanzamento determinato con velocità e tempo residuo; log a costo costante
+  (ultime righe a video, log completo in logs/) tramite gui_log_sink.py
+
+Il motore di elaborazione è in web_image_pipeline.py (utilizzabile anche senza GUI).
 
 Dipendenze: Pillow (PIL)  ->  pip install pillow
 Esecuzione: python web_image_resizer_gui.py
 """
 
 import os
-import io
-import sys
-import math
 import threading
 from pathlib import Path
-from typing import Tuple, Optional
-
-from PIL import Image, ImageOps
-
-# Conversione sRGB: ImageCms è opzionale ma consigliata
-try:
-    from PIL import ImageCms
-    HAVE_CMS = True
-except Exception:
-    HAVE_CMS = False
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, colorchooser
 
-SUPPORTED_EXT = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+# Motore di elaborazione (senza Tk), condiviso con la CLI
+from web_image_pipeline import (
+    ResizeSettings, ResizePipeline, parse_variants, write_duplicates_report, DEDUP_DISTANCE,
+)
+from web_image_atlas import AtlasBuilder
+from gui_log_sink import LogSink, ProgressTracker, default_log_path
+
+# Etichette GUI -> valori di ResizeSettings
+SCALE_TYPE_LABELS = {"lato lungo": "long", "larghezza fissa": "width"}
+EXACT_MODE_LABELS = {"ADATTA (bordi)": "fit", "RIEMPI (ritaglio)": "fill"}
+SHRINK_LABELS = {"qualità": "quality", "veloce": "fast", "disattivata": "off"}
+# Report tempi per fase (opzione "Misura i tempi"): nome base nella cartella di destinazione
+TIMING_REPORT_NAME = "resize_timing"
+# Report dei quasi-duplicati (opzione "Quasi-duplicati"), nella cartella di destinazione
+DUPLICATES_REPORT_NAME = "duplicates"
 
 class ResizerApp(tk.Tk):
     def __init__(self):
@@ -52,6 +66,10 @@ class ResizerApp(tk.Tk):
         self.var_out_dir  = tk.StringVar(value=str(Path.cwd() / "out_web"))
         self.var_suffix   = tk.StringVar(value="_web")
         self.var_recursive = tk.BooleanVar(value=False)
+        self.var_incremental = tk.BooleanVar(value=False)  # salta i file invariati (manifest)
+        self.var_timing = tk.BooleanVar(value=False)       # tempi per fase + report JSON/CSV
+        self.var_dedup = tk.BooleanVar(value=False)        # quasi-duplicati: una sola codifica
+        self.var_dedup_dist = tk.IntVar(value=DEDUP_DISTANCE)
 
         # Mode: scale or exact size
         self.var_mode = tk.StringVar(value="scale")  # "scale" | "exact"
@@ -68,17 +86,31 @@ class ResizerApp(tk.Tk):
         self.var_exact_mode = tk.StringVar(value="ADATTA (bordi)")  # "ADATTA (bordi)" | "RIEMPI (ritaglio)"
         self.var_bg = tk.StringVar(value="#FFFFFF")
         self.var_transparent_bg = tk.BooleanVar(value=False)
+        self.var_atlas = tk.BooleanVar(value=False)      # fogli sprite + indice JSON
+        self.var_atlas_cols = tk.IntVar(value=16)
+        self.var_atlas_rows = tk.IntVar(value=16)
 
         # Output format & quality
         self.var_format = tk.StringVar(value="WEBP")     # "JPEG" | "PNG" | "WEBP"
         self.var_quality = tk.IntVar(value=82)           # 1..100
+        self.var_max_kb = tk.IntVar(value=0)             # budget di peso per file (KB), 0 = disattivato
         self.var_progressive = tk.BooleanVar(value=True) # JPEG only
         self.var_optimize = tk.BooleanVar(value=True)
+        self.var_png_optimize = tk.BooleanVar(value=False)  # PNG only
 
         # Metadata / profiles
         self.var_strip_meta = tk.BooleanVar(value=True)
         self.var_to_srgb    = tk.BooleanVar(value=True)
 
+        # Varianti (es. "card=160x200:fill preview=480 detail=1200:jpeg"): vuoto = output singolo
+        self.var_variants = tk.StringVar(value="")
+
+        # Decodifica ridotta (shrink-on-load) per sorgenti grandi
+        self.var_shrink = tk.StringVar(value="qualità")  # "qualità" | "veloce" | "disattivata"
+
+        # Parallelismo: numero di processi worker (1 = sequenziale)
+        self.var_workers = tk.IntVar(value=os.cpu_count() or 1)
+
         # UI
         self._build_ui()
         self.worker = None
@@ -100,6 +132,13 @@ class ResizerApp(tk.Tk):
         ttk.Button(f_paths, text="Sfoglia…", command=self._choose_out).grid(row=1, column=2, **pad)
 
         ttk.Checkbutton(f_paths, text="Includi sottocartelle", variable=self.var_recursive).grid(row=2, column=1, sticky="w", **pad)
+        ttk.Checkbutton(f_paths, text="Solo file nuovi/modificati (rimuove output orfani)", variable=self.var_incremental).grid(row=3, column=1, sticky="w", **pad)
+        ttk.Checkbutton(f_paths, text=f"Misura i tempi per fase ({TIMING_REPORT_NAME}.json/.csv in destinazione)", variable=self.var_timing).grid(row=4, column=1, sticky="w", **pad)
+        f_dedup = ttk.Frame(f_paths)
+        f_dedup.grid(row=5, column=1, sticky="w")
+        ttk.Checkbutton(f_dedup, text=f"Quasi-duplicati: codifica una volta e collega (report {DUPLICATES_REPORT_NAME}.csv), distanza max:",
+                        variable=self.var_dedup).pack(side="left", **pad)
+        ttk.Spinbox(f_dedup, from_=0, to=32, textvariable=self.var_dedup_dist, width=4).pack(side="left")
         ttk.Label(f_paths, text="Suffix filename:").grid(row=2, column=0, sticky="e", **pad)
         ttk.Entry(f_paths, textvariable=self.var_suffix, width=12).grid(row=2, column=2, sticky="w", **pad)
 
@@ -145,6 +184,12 @@ class ResizerApp(tk.Tk):
         self.btn_bg.grid(row=0, column=6, sticky="w", **pad)
         ttk.Checkbutton(self.f_exact, text="Sfondo trasparente (se supportato)", variable=self.var_transparent_bg).grid(row=0, column=7, sticky="w", **pad)
 
+        ttk.Checkbutton(self.f_exact, text="Atlas sprite (fogli + atlas.json)", variable=self.var_atlas).grid(row=1, column=0, columnspan=2, sticky="w", **pad)
+        ttk.Label(self.f_exact, text="Colonne:").grid(row=1, column=2, sticky="e", **pad)
+        ttk.Spinbox(self.f_exact, from_=1, to=100, textvariable=self.var_atlas_cols, width=8).grid(row=1, column=3, sticky="w", **pad)
+        ttk.Label(self.f_exact, text="Righe per foglio:").grid(row=1, column=4, sticky="e", **pad)
+        ttk.Spinbox(self.f_exact, from_=1, to=100, textvariable=self.var_atlas_rows, width=8).grid(row=1, column=5, sticky="w", **pad)
+
         # Output format
         f_fmt = ttk.LabelFrame(self, text="Output")
         f_fmt.pack(fill="x", padx=10, pady=6)
@@ -161,6 +206,20 @@ class ResizerApp(tk.Tk):
         ttk.Checkbutton(f_fmt, text="Rimuovi metadata", variable=self.var_strip_meta).grid(row=1, column=1, sticky="w", **pad)
         ttk.Checkbutton(f_fmt, text="Converti a sRGB", variable=self.var_to_srgb).grid(row=1, column=2, sticky="w", **pad)
 
+        ttk.Label(f_fmt, text="Processi paralleli:").grid(row=1, column=3, sticky="e", **pad)
+        ttk.Spinbox(f_fmt, from_=1, to=max(64, os.cpu_count() or 1), textvariable=self.var_workers, width=6).grid(row=1, column=4, sticky="w", **pad)
+        ttk.Checkbutton(f_fmt, text="PNG lossless max (lento)", variable=self.var_png_optimize).grid(row=1, column=5, columnspan=2, sticky="w", **pad)
+
+        ttk.Label(f_fmt, text="Decodifica ridotta:").grid(row=2, column=0, sticky="e", **pad)
+        ttk.Combobox(f_fmt, values=list(SHRINK_LABELS), textvariable=self.var_shrink, state="readonly", width=12).grid(row=2, column=1, sticky="w", **pad)
+
+        ttk.Label(f_fmt, text="Peso max KB (0 = off):").grid(row=2, column=2, sticky="e", **pad)
+        ttk.Spinbox(f_fmt, from_=0, to=100000, textvariable=self.var_max_kb, width=8).grid(row=2, column=3, sticky="w", **pad)
+
+        ttk.Label(f_fmt, text="Varianti (opzionale):").grid(row=3, column=0, sticky="e", **pad)
+        ttk.Entry(f_fmt, textvariable=self.var_variants).grid(row=3, column=1, columnspan=4, sticky="we", **pad)
+        ttk.Label(f_fmt, text="NOME=L[xA][:fill|fit][:FORMATO][:qN][:NNkb]").grid(row=3, column=5, columnspan=2, sticky="w", **pad)
+
         # Actions
         f_actions = ttk.Frame(self)
         f_actions.pack(fill="x", padx=10, pady=6)
@@ -169,7 +228,9 @@ class ResizerApp(tk.Tk):
         self.btn_stop = ttk.Button(f_actions, text="Annulla", command=self._on_stop, state="disabled")
         self.btn_stop.pack(side="left", padx=4)
 
-        self.progress = ttk.Progressbar(f_actions, mode="indeterminate")
+        self.lbl_progress = ttk.Label(f_actions, text="", width=34, anchor="e")
+        self.lbl_progress.pack(side="right", padx=4)
+        self.progress = ttk.Progressbar(f_actions, mode="determinate")
         self.progress.pack(side="right", fill="x", expand=True, padx=6)
 
         # Log
@@ -177,6 +238,9 @@ class ResizerApp(tk.Tk):
         f_log.pack(fill="both", expand=True, padx=10, pady=10)
         self.txt_log = tk.Text(f_log, height=14, wrap="word")
         self.txt_log.pack(fill="both", expand=True, padx=6, pady=6)
+        self.sink = LogSink(self, self.txt_log, log_file=default_log_path("web_image_resizer"),
+                            progress=ProgressTracker(self.progress, self.lbl_progress))
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
         self._toggle_mode()  # inizializza visibilità frame
 
     # ---------------- UI Events ----------------
@@ -223,14 +287,29 @@ class ResizerApp(tk.Tk):
             messagebox.showwarning("Attenzione", "Seleziona una cartella sorgente valida.")
             return
 
+        atlas = self.var_mode.get() == "exact" and self.var_atlas.get()
+        try:
+            if atlas:
+                job = AtlasBuilder(self._build_settings(), cols=self.var_atlas_cols.get(), rows=self.var_atlas_rows.get(),
+                                   workers=self.var_workers.get(), stop_flag=self.stop_flag)
+            else:
+                job = ResizePipeline(self._build_settings(), workers=self.var_workers.get(),
+                                     stop_flag=self.stop_flag, incremental=self.var_incremental.get(),
+                                     timing=self.var_timing.get(),
+                                     dedup=self.var_dedup_dist.get() if self.var_dedup.get() else None)
+        except (ValueError, tk.TclError) as e:
+            messagebox.showwarning("Attenzione", f"Parametri non validi: {e}")
+            return
+
         out_dir.mkdir(parents=True, exist_ok=True)
         self.stop_flag.clear()
-        self.progress.start(80)
+        self.sink.progress.start(unit="riquadri" if atlas else "file")
         self.btn_start["state"] = "disabled"
         self.btn_stop["state"] = "normal"
-        self._log("Avvio elaborazione…")
+        self._log(f"Avvio elaborazione… (log completo: {self.sink.log_file})")
 
-        self.worker = threading.Thread(target=self._process_all, daemon=True)
+        target = self._process_atlas if atlas else self._process_all
+        self.worker = threading.Thread(target=target, args=(job,), daemon=True)
         self.worker.start()
 
     def _on_stop(self):
@@ -238,226 +317,148 @@ class ResizerApp(tk.Tk):
             self.stop_flag.set()
             self._log("Richiesta di annullamento…")
 
+    def _on_close(self):
+        self.stop_flag.set()
+        self.sink.close()
+        self.destroy()
+
     def _done(self):
-        self.progress.stop()
+        self.sink.progress.finish()
         self.btn_start["state"] = "normal"
         self.btn_stop["state"] = "disabled"
 
     def _log(self, msg):
-        self.txt_log.insert("end", msg.rstrip() + "\n")
-        self.txt_log.see("end")
-
-    # ---------------- Image utils ----------------
-    def _collect_files(self, root: Path):
-        if self.var_recursive.get():
-            for p in root.rglob("*"):
-                if p.is_file() and p.suffix.lower() in SUPPORTED_EXT:
-                    yield p
-        else:
-            for p in root.iterdir():
-                if p.is_file() and p.suffix.lower() in SUPPORTED_EXT:
-                    yield p
-
-    def _open_image(self, path: Path) -> Optional[Image.Image]:
-        try:
-            img = Image.open(path)
-            img = ImageOps.exif_transpose(img)  # orientazione corretta
-            return img
-        except Exception as e:
-            self._log(f"[SKIP] {path.name}: {e}")
-            return None
-
-    def _remove_metadata(self, img: Image.Image) -> Image.Image:
-        data = list(img.getdata())
-        clean = Image.new(img.mode, img.size)
-        clean.putdata(data)
-        return clean
-
-    def _to_srgb(self, img: Image.Image) -> Image.Image:
-        if not HAVE_CMS or not self.var_to_srgb.get():
-            # fallback: se ha alpha e salveremo in JPEG, convertiremo con bg in seguito
-            return img.convert("RGB") if img.mode not in ("RGB", "RGBA") else img
-        try:
-            icc = img.info.get("icc_profile")
-            if icc:
-                src = ImageCms.ImageCmsProfile(io.BytesIO(icc))
-                dst = ImageCms.createProfile("sRGB")
-                intent = ImageCms.INTENT_PERCEPTUAL
-                img = ImageCms.profileToProfile(img, src, dst, renderingIntent=intent, outputMode="RGB")
-            else:
-                if img.mode not in ("RGB", "RGBA"):
-                    img = img.convert("RGB")
-        except Exception:
-            img = img.convert("RGB")
-        return img
-
-    def _resize_scale(self, img: Image.Image) -> Image.Image:
-        t = self.var_scale_type.get()
-        no_up = self.var_no_upscale.get()
-        if t == "lato lungo":
-            max_side = int(self.var_long_side.get())
-            w, h = img.size
-            long_curr = max(w, h)
-            if long_curr <= max_side and no_up:
-                return img.copy()
-            scale = max_side / float(long_curr)
-            nw, nh = int(round(w * scale)), int(round(h * scale))
-            return img.resize((nw, nh), Image.LANCZOS)
-        else:  # larghezza fissa
-            target_w = int(self.var_target_w.get())
-            w, h = img.size
-            if w <= target_w and no_up:
-                return img.copy()
-            scale = target_w / float(w)
-            nw, nh = target_w, int(round(h * scale))
-            return img.resize((nw, nh), Image.LANCZOS)
-
-    def _resize_exact(self, img: Image.Image) -> Image.Image:
-        W = int(self.var_exact_w.get())
-        H = int(self.var_exact_h.get())
-        method = self.var_exact_mode.get()  # "ADATTA (bordi)" or "RIEMPI (ritaglio)"
-        if method.startswith("ADATTA"):
-            # contain: ridimensiona per entrare, poi letterbox
-            iw, ih = img.size
-            scale = min(W / iw, H / ih)
-            nw, nh = int(round(iw * scale)), int(round(ih * scale))
-            resized = img.resize((nw, nh), Image.LANCZOS)
-            # canvas
-            use_alpha = self.var_transparent_bg.get() and (self.var_format.get() in ("PNG", "WEBP"))
-            if use_alpha:
-                canvas = Image.new("RGBA", (W, H), (0,0,0,0))
-            else:
-                bg_hex = self.var_bg.get().lstrip("#")
-                r = int(bg_hex[0:2], 16)
-                g = int(bg_hex[2:4], 16)
-                b = int(bg_hex[4:6], 16)
-                canvas = Image.new("RGB", (W, H), (r, g, b))
-            x = (W - nw) // 2
-            y = (H - nh) // 2
-            canvas.paste(resized, (x, y), resized if resized.mode in ("RGBA", "LA") else None)
-            return canvas
-        else:
-            # cover: ridimensiona per coprire, poi crop centrale
-            iw, ih = img.size
-            scale = max(W / iw, H / ih)
-            nw, nh = int(round(iw * scale)), int(round(ih * scale))
-            resized = img.resize((nw, nh), Image.LANCZOS)
-            # crop centrale
-            left = (nw - W) // 2
-            top = (nh - H) // 2
-            right = left + W
-            bottom = top + H
-            return resized.crop((left, top, right, bottom))
-
-    def _save_image(self, img: Image.Image, out_path: Path):
-        fmt = self.var_format.get().upper()
-        q = int(self.var_quality.get())
-        optimize = bool(self.var_optimize.get())
-        progressive = bool(self.var_progressive.get()) if fmt == "JPEG" else False
-
-        params = {}
-        if fmt in ("JPEG", "WEBP"):
-            params["quality"] = q
-        if fmt == "JPEG":
-            params["progressive"] = progressive
-            params["subsampling"] = "4:2:0"  # default web-friendly
-        if fmt == "WEBP":
-            # method 5 ~ buon compromesso; riduce dimensione
-            params["method"] = 5
-        if fmt in ("JPEG", "PNG", "WEBP"):
-            params["optimize"] = optimize
-
-        # Trasparenza e alpha per JPEG: appiattire su bg
-        if fmt == "JPEG":
-            if img.mode in ("RGBA", "LA"):
-                bg_hex = self.var_bg.get().lstrip("#")
-                r = int(bg_hex[0:2], 16)
-                g = int(bg_hex[2:4], 16)
-                b = int(bg_hex[4:6], 16)
-                base = Image.new("RGB", img.size, (r, g, b))
-                base.paste(img, mask=img.split()[-1])
-                img = base
-            else:
-                img = img.convert("RGB")
-
-        # Rimozione metadata
-        if self.var_strip_meta.get():
-            img = self._remove_metadata(img)
-
-        # Estensione coerente
-        ext = ".jpg" if fmt == "JPEG" else (".png" if fmt == "PNG" else ".webp")
-        out_path = out_path.with_suffix(ext)
-
-        img.save(out_path, format=fmt, **params)
-        return out_path
+        # Sicuro dai thread di lavoro: il widget viene aggiornato dal LogSink una volta per frame
+        self.sink.write(msg)
+
+    # ---------------- Settings ----------------
+    def _build_settings(self) -> ResizeSettings:
+        # Copia dei parametri della GUI in un record semplice (serializzabile verso i processi worker)
+        return ResizeSettings(
+            mode=self.var_mode.get(),
+            scale_type=SCALE_TYPE_LABELS[self.var_scale_type.get()],
+            long_side=int(self.var_long_side.get()),
+            target_w=int(self.var_target_w.get()),
+            no_upscale=bool(self.var_no_upscale.get()),
+            exact_w=int(self.var_exact_w.get()),
+            exact_h=int(self.var_exact_h.get()),
+            exact_mode=EXACT_MODE_LABELS[self.var_exact_mode.get()],
+            bg=self.var_bg.get(),
+            transparent_bg=bool(self.var_transparent_bg.get()),
+            format=self.var_format.get(),
+            quality=int(self.var_quality.get()),
+            max_bytes=int(self.var_max_kb.get()) * 1024,
+            progressive=bool(self.var_progressive.get()),
+            optimize=bool(self.var_optimize.get()),
+            png_optimize=bool(self.var_png_optimize.get()),
+            strip_meta=bool(self.var_strip_meta.get()),
+            to_srgb=bool(self.var_to_srgb.get()),
+            shrink_on_load=SHRINK_LABELS[self.var_shrink.get()],
+            suffix=self.var_suffix.get(),
+            recursive=bool(self.var_recursive.get()),
+            variants=parse_variants(self.var_variants.get()),
+        )
 
     # ---------------- Processing ----------------
-    def _process_all(self):
+    def _process_all(self, pipe: ResizePipeline):
         try:
             src = Path(self.var_in_dir.get().strip())
             dst = Path(self.var_out_dir.get().strip())
-            suffix = self.var_suffix.get()
 
-            files = list(self._collect_files(src))
+            files = pipe.collect_files(src)
             total = len(files)
             if total == 0:
                 self._log("Nessuna immagine valida trovata.")
                 self._done()
                 return
 
-            self._log(f"Trovati {total} file. Inizio…")
+            self._log(f"Trovati {total} file. Inizio… (processi: {pipe.workers})")
+            self.sink.progress.set_total(total)
 
             processed = 0
             saved_bytes = 0
+            unchanged = pruned = duplicates = i = 0
+            icc_stats = {"hit": 0, "miss": 0}
 
-            for i, path in enumerate(files, 1):
-                if self.stop_flag.is_set():
-                    self._log("Operazione annullata.")
-                    self._done()
-                    return
-
-                rel = path.relative_to(src) if self.var_recursive.get() else path.name
-                self._log(f"[{i}/{total}] {rel}")
-
-                img = self._open_image(path)
-                if img is None:
+            for res in pipe.process(files, src, dst):
+                if res.pruned:
+                    pruned += 1
+                    self._log(f"[RIMOSSO] {res.out_path.name} (sorgente eliminata: {res.rel})")
                     continue
-
-                # Colori
-                if self.var_to_srgb.get():
-                    img = self._to_srgb(img)
-
-                # Ridimensionamento
-                if self.var_mode.get() == "scale":
-                    out_img = self._resize_scale(img)
-                else:
-                    out_img = self._resize_exact(img)
-
-                # Path di output
-                if self.var_recursive.get() and isinstance(rel, Path):
-                    target_dir = dst / rel.parent
-                else:
-                    target_dir = dst
-                target_dir.mkdir(parents=True, exist_ok=True)
-                base = path.stem + (suffix or "")
-                out_path = target_dir / base
-
-                # Salva
-                orig_size = path.stat().st_size if path.exists() else 0
-                out_file = self._save_image(out_img, out_path)
-                new_size = out_file.stat().st_size if out_file.exists() else 0
-                if orig_size and new_size:
-                    delta = orig_size - new_size
-                    saved_bytes += max(0, delta)
-
+                i += 1
+                self.sink.progress.advance()
+                if res.unchanged:
+                    unchanged += 1
+                    continue
+                if not res.ok:
+                    tag = "SKIP" if res.skipped else "ERRORE"
+                    self._log(f"[{i}/{total}] [{tag}] {res.rel}: {res.error}")
+                    continue
+                if res.orig_size and res.new_size:
+                    saved_bytes += max(0, res.orig_size - res.new_size)
                 processed += 1
-                self._log(f" → {out_file.name} ({new_size/1024:.0f} KB)")
+                if res.icc:
+                    icc_stats[res.icc] += 1
+                if res.duplicate_of:
+                    duplicates += 1
+                names = ", ".join(res.out_labels)
+                dup = f", duplicato di {res.duplicate_of}" if res.duplicate_of else ""
+                self._log(f"[{i}/{total}] {res.rel} → {names} ({res.new_size/1024:.0f} KB{dup})")
+
+            if pipe.cancelled:
+                self._log("Operazione annullata.")
+                return
 
+            if pipe.incremental:
+                self._log(f"Invariati (saltati): {unchanged}. Output rimossi: {pruned}.")
+            if icc_stats["hit"] or icc_stats["miss"]:
+                self._log(f"Cache profili ICC: {icc_stats['hit']} hit, {icc_stats['miss']} miss.")
+            if pipe.dedup is not None:
+                write_duplicates_report(dst / f"{DUPLICATES_REPORT_NAME}.csv", pipe.duplicates)
+                self._log(f"Duplicati non ricodificati: {duplicates} (gruppi: {len(pipe.duplicates)}). "
+                          f"Report: {dst / DUPLICATES_REPORT_NAME}.csv")
             if saved_bytes > 0:
                 kb = saved_bytes / 1024
                 self._log(f"Completato. File processati: {processed}. Risparmio stimato: {kb:.0f} KB.")
             else:
                 self._log(f"Completato. File processati: {processed}.")
+            if pipe.report:
+                for line in pipe.report.summary_lines():
+                    self._log(line)
+                for ext in (".json", ".csv"):
+                    pipe.report.write(dst / (TIMING_REPORT_NAME + ext))
+                self._log(f"Report tempi: {dst / TIMING_REPORT_NAME}.json / .csv")
+        except Exception as e:
+            self._log(f"Errore: {e}")
+        finally:
+            self._done()
+
+    def _process_atlas(self, builder: AtlasBuilder):
+        try:
+            src = Path(self.var_in_dir.get().strip())
+            dst = Path(self.var_out_dir.get().strip())
+            self._log(f"Atlas: riquadri {builder.settings.exact_w}x{builder.settings.exact_h}, "
+                      f"{builder.cols}x{builder.rows} per foglio (processi: {builder.pipeline.workers})")
+            files = builder.pipeline.collect_files(src)
+            self.sink.progress.set_total(len(files))
+            changed = 0
+            for res in builder.tiles(src, dst, files):
+                if not res.pruned:
+                    self.sink.progress.advance()
+                if not res.ok:
+                    tag = "SKIP" if res.skipped else "ERRORE"
+                    self._log(f"[{tag}] {res.rel}: {res.error}")
+                elif not res.unchanged and not res.pruned:
+                    changed += 1
+                    self._log(f"Riquadro: {res.rel}")
+            if builder.cancelled:
+                self._log("Operazione annullata.")
+                return
+            self._log(f"Ritratti: {builder.sprite_count} (aggiornati: {changed}). Composizione fogli…")
+            for sheet in builder.compose(dst):
+                state = "ricodificato" if sheet["rebuilt"] else "invariato"
+                self._log(f" → {sheet['file']}: {sheet['sprites']} ritratti, {sheet['bytes']/1024:.0f} KB ({state})")
+            self._log(f"Completato. Indice: {dst / (builder.name + '.json')}")
         except Exception as e:
             self._log(f"Errore: {e}")
         finally:
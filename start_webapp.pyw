@@ -7,8 +7,8 @@ Avvia automaticamente il proxy server Smartsheet e il frontend Vite,
 poi apre l'applicazione in una finestra Chrome in modalità app (senza UI browser).
 
 Gestisce il ciclo di vita completo:
-- Avvio server in background
-- Health checks per verificare disponibilità
+- Avvio server in background, entrambi in parallelo
+- Health checks HTTP in parallelo (porta effettiva di Vite letta dal suo output)
 - Apertura browser in modalità webapp
 - Cleanup automatico dei processi all'uscita
 
@@ -19,15 +19,19 @@ License: Proprietary
 
 import subprocess
 import time
-import socket
 import sys
 import os
+import re
 import json
 import logging
 import atexit
 import signal
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Callable
 from logging.handlers import RotatingFileHandler
 import psutil
 
@@ -50,12 +54,16 @@ class Config:
             "proxy": {
                 "port": 3001,
                 "command": "npm run proxy",
-                "startup_timeout": 30
+                "startup_timeout": 30,
+                "health_path": "/health"
             },
             "frontend": {
                 "port": 3000,
                 "command": "npm run dev",
-                "startup_timeout": 60
+                "startup_timeout": 60,
+                "health_path": "/",
+                # Riga di Vite con l'indirizzo effettivo ("➜  Local:   http://localhost:3001/")
+                "port_pattern": r"Local:\s+https?://[^\s/]+:(\d+)"
             }
         },
         "browser": {
@@ -156,44 +164,83 @@ def setup_logging(config: Config) -> logging.Logger:
 # UTILITY FUNCTIONS
 # =============================================================================
 
-def is_port_open(port: int, host: str = 'localhost', timeout: float = 1.0) -> bool:
-    """Verifica se una porta è aperta e accetta connessioni."""
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(timeout)
+# Sequenze colore ANSI nell'output dei server (Vite colora la porta)
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+
+# Health check sempre diretti su localhost, ignorando eventuali proxy di sistema
+_HTTP = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+
+def is_http_ready(url: str, timeout: float = 1.0) -> bool:
+    """Verifica che il server risponda via HTTP (qualsiasi stato < 500), non solo che la porta sia aperta."""
     try:
-        result = sock.connect_ex((host, port))
-        return result == 0
-    except socket.error:
+        with _HTTP.open(url, timeout=timeout) as response:
+            return response.status < 500
+    except urllib.error.HTTPError as e:
+        return e.code < 500
+    except (urllib.error.URLError, OSError, ValueError):
         return False
-    finally:
-        sock.close()
 
 
-def wait_for_port(port: int, timeout: int, logger: logging.Logger, 
-                  check_interval: float = 0.5) -> bool:
+def wait_for_http(url: str, timeout: float, logger: logging.Logger,
+                  process: Optional[subprocess.Popen] = None,
+                  check_interval: float = 0.2) -> bool:
     """
-    Attende che una porta diventi disponibile con polling.
+    Attende che un URL risponda con polling ravvicinato.
     
     Args:
-        port: Porta da controllare
+        url: URL di health check
         timeout: Timeout massimo in secondi
         logger: Logger per messaggi
+        process: Processo del server; se termina l'attesa si interrompe subito
         check_interval: Intervallo tra controlli in secondi
     
     Returns:
-        True se porta disponibile, False se timeout
+        True se il server risponde, False se timeout o processo terminato
     """
     start_time = time.time()
     while time.time() - start_time < timeout:
-        if is_port_open(port):
-            logger.info(f"✅ Porta {port} disponibile dopo {time.time() - start_time:.1f}s")
+        if is_http_ready(url):
+            logger.info(f"✅ {url} risponde dopo {time.time() - start_time:.1f}s")
             return True
+        if process is not None and process.poll() is not None:
+            logger.error(f"❌ Processo terminato (codice {process.returncode}) prima di rispondere su {url}")
+            return False
         time.sleep(check_interval)
     
-    logger.error(f"❌ Timeout: porta {port} non disponibile dopo {timeout}s")
+    logger.error(f"❌ Timeout: {url} non risponde dopo {timeout}s")
     return False
 
 
+class OutputPortWatcher:
+    """
+    Ricava la porta effettiva di un server dalle righe del suo output
+    (Vite passa alla porta successiva se quella configurata è occupata).
+    """
+    
+    def __init__(self, pattern: str):
+        self.pattern = re.compile(pattern)
+        self.port: Optional[int] = None
+        self.found = threading.Event()
+    
+    def __call__(self, line: str):
+        """Callback per ogni riga di output (thread di lettura del processo)."""
+        if self.found.is_set():
+            return
+        match = self.pattern.search(ANSI_ESCAPE.sub('', line))
+        if match:
+            self.port = int(match.group(1))
+            self.found.set()
+    
+    def wait(self, timeout: float, process: subprocess.Popen) -> Optional[int]:
+        """Attende la riga con la porta; None se timeout o processo terminato."""
+        deadline = time.time() + timeout
+        while not self.found.wait(0.1):
+            if process.poll() is not None or time.time() >= deadline:
+                break
+        return self.port
+
+
 def find_chrome_path() -> Optional[Path]:
     """Trova il percorso di Chrome su Windows con fallback multipli."""
     possible_paths = [
@@ -240,7 +287,8 @@ class ProcessManager:
         self.cleanup()
         sys.exit(0)
     
-    def start_process(self, command: str, cwd: Path, name: str) -> Optional[subprocess.Popen]:
+    def start_process(self, command: str, cwd: Path, name: str,
+                      on_output: Optional[Callable[[str], None]] = None) -> Optional[subprocess.Popen]:
         """
         Avvia un processo in background.
         
@@ -248,6 +296,7 @@ class ProcessManager:
             command: Comando da eseguire
             cwd: Directory di lavoro
             name: Nome descrittivo del processo
+            on_output: Callback per ogni riga di stdout (l'output va comunque nel file log)
         
         Returns:
             Processo avviato o None se errore
@@ -271,10 +320,18 @@ class ProcessManager:
                 command,
                 shell=True,
                 cwd=cwd,
-                stdout=stdout_file,
+                stdout=subprocess.PIPE if on_output else stdout_file,
                 stderr=stderr_file,
                 creationflags=creation_flags
             )
+            if on_output:
+                # Thread che svuota la pipe di continuo (nessun blocco del figlio) e copia nel log
+                threading.Thread(
+                    target=self._pump_output,
+                    args=(process.stdout, stdout_file, on_output),
+                    name=f"{name} output",
+                    daemon=True
+                ).start()
             
             self.processes.append(process)
             self.logger.info(f"✅ {name} avviato (PID: {process.pid})")
@@ -285,6 +342,19 @@ class ProcessManager:
             self.logger.error(f"❌ Errore avvio {name}: {e}")
             return None
     
+    @staticmethod
+    def _pump_output(stream, log_file, on_output: Callable[[str], None]):
+        """Legge stdout riga per riga: scrive nel file log e passa la riga alla callback."""
+        with stream, log_file:
+            for raw in iter(stream.readline, b''):
+                line = raw.decode('utf-8', errors='replace')
+                log_file.write(line)
+                log_file.flush()
+                try:
+                    on_output(line)
+                except Exception:
+                    pass
+    
     def cleanup(self):
         """Termina tutti i processi gestiti."""
         if not self.processes:
@@ -330,63 +400,54 @@ class WebAppLauncher:
     
     def start_servers(self) -> bool:
         """
-        Avvia proxy e frontend server.
+        Avvia proxy e frontend server in parallelo e ne attende la disponibilità,
+        anch'essa in parallelo: il tempo di avvio è quello del server più lento.
         
         Returns:
             True se entrambi avviati con successo
         """
         self.logger.info("[1/5] 🔍 Validazione configurazione...")
-        
-        # Avvia proxy server
-        self.logger.info("[2/5] 🚀 Avvio proxy server Smartsheet...")
         proxy_cmd = self.config.get('servers', 'proxy', 'command')
-        proxy_port = self.config.get('servers', 'proxy', 'port')
-        proxy_timeout = self.config.get('servers', 'proxy', 'startup_timeout')
+        frontend_cmd = self.config.get('servers', 'frontend', 'command')
+        port_pattern = self.config.get('servers', 'frontend', 'port_pattern',
+                                       default=Config.DEFAULTS['servers']['frontend']['port_pattern'])
         
+        # Avvia entrambi i server subito, senza attendere il proxy
+        self.logger.info("[2/5] 🚀 Avvio proxy server Smartsheet...")
         proxy_process = self.process_manager.start_process(
             proxy_cmd,
             Config.PROJECT_ROOT,
             "Proxy Server"
         )
         
-        if not proxy_process:
-            self.logger.error("❌ Impossibile avviare proxy server")
-            return False
-        
-        # Attendi disponibilità proxy
-        if not wait_for_port(proxy_port, proxy_timeout, self.logger):
-            self.logger.error(f"❌ Proxy server non risponde su porta {proxy_port}")
-            return False
-        
-        # Avvia frontend server
         self.logger.info("[3/5] 🚀 Avvio frontend Vite...")
-        frontend_cmd = self.config.get('servers', 'frontend', 'command')
-        frontend_port = self.config.get('servers', 'frontend', 'port')
-        frontend_timeout = self.config.get('servers', 'frontend', 'startup_timeout')
-        
+        # La porta effettiva del frontend si legge dall'output di Vite
+        frontend_watcher = OutputPortWatcher(port_pattern)
         frontend_process = self.process_manager.start_process(
             frontend_cmd,
             Config.PROJECT_ROOT,
-            "Frontend Server"
+            "Frontend Server",
+            on_output=frontend_watcher
         )
         
+        if not proxy_process:
+            self.logger.error("❌ Impossibile avviare proxy server")
+            return False
         if not frontend_process:
             self.logger.error("❌ Impossibile avviare frontend server")
             return False
         
-        # Attendi disponibilità frontend (può usare porta diversa se 3000 occupata)
         self.logger.info("[4/5] ⏳ Attesa disponibilità server...")
-        actual_frontend_port = frontend_port
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="health") as pool:
+            proxy_ready = pool.submit(self._wait_proxy, proxy_process)
+            frontend_port = pool.submit(self._wait_frontend, frontend_process, frontend_watcher)
+            proxy_ok, actual_frontend_port = proxy_ready.result(), frontend_port.result()
         
-        # Prova porta 3000, poi 3001-3010 se occupata
-        for port in range(frontend_port, frontend_port + 10):
-            if wait_for_port(port, 5, self.logger):  # Timeout ridotto per test rapido
-                actual_frontend_port = port
-                if port != frontend_port:
-                    self.logger.info(f"ℹ️ Frontend su porta {port} (3000 occupata)")
-                break
-        else:
-            self.logger.error(f"❌ Frontend server non risponde su porte {frontend_port}-{frontend_port + 9}")
+        if not proxy_ok:
+            self.logger.error(f"❌ Proxy server non risponde su porta {self.config.get('servers', 'proxy', 'port')}")
+            return False
+        if actual_frontend_port is None:
+            self.logger.error("❌ Frontend server non risponde")
             return False
         
         # Salva la porta effettiva per uso successivo
@@ -395,12 +456,51 @@ class WebAppLauncher:
         self.logger.info("✅ Server pronti!")
         return True
     
+    def _health_url(self, server: str, port: int) -> str:
+        """URL di health check del server ('proxy' o 'frontend') sulla porta indicata."""
+        path = self.config.get('servers', server, 'health_path', default=Config.DEFAULTS['servers'][server]['health_path'])
+        return f"http://127.0.0.1:{port}{path}"
+    
+    def _wait_proxy(self, process: subprocess.Popen) -> bool:
+        """Health check HTTP del proxy (endpoint /health)."""
+        port = self.config.get('servers', 'proxy', 'port')
+        timeout = self.config.get('servers', 'proxy', 'startup_timeout')
+        return wait_for_http(self._health_url('proxy', port), timeout, self.logger, process)
+    
+    def _wait_frontend(self, process: subprocess.Popen, watcher: OutputPortWatcher) -> Optional[int]:
+        """
+        Attende la porta annunciata da Vite, poi il suo health check HTTP.
+        
+        Returns:
+            Porta effettiva del frontend o None se non disponibile
+        """
+        configured_port = self.config.get('servers', 'frontend', 'port')
+        timeout = self.config.get('servers', 'frontend', 'startup_timeout')
+        start_time = time.time()
+        
+        port = watcher.wait(timeout, process)
+        if port is None:
+            if process.poll() is not None:
+                self.logger.error(f"❌ Frontend terminato (codice {process.returncode}) prima di avviarsi")
+                return None
+            # Output non riconosciuto (versione di Vite diversa?): si prova la porta configurata
+            self.logger.warning(f"⚠️ Porta del frontend non trovata nell'output, provo la {configured_port}")
+            port = configured_port
+        elif port != configured_port:
+            self.logger.info(f"ℹ️ Frontend su porta {port} ({configured_port} occupata)")
+        
+        remaining = max(1.0, timeout - (time.time() - start_time))
+        if not wait_for_http(self._health_url('frontend', port), remaining, self.logger, process):
+            return None
+        return port
+    
     def _check_servers_alive(self) -> bool:
-        """Verifica che entrambi i server rispondano."""
+        """Verifica che entrambi i server rispondano (stessi health check HTTP dell'avvio)."""
         proxy_port = self.config.get('servers', 'proxy', 'port')
         frontend_port = getattr(self, 'actual_frontend_port', self.config.get('servers', 'frontend', 'port'))
         
-        return is_port_open(proxy_port) and is_port_open(frontend_port)
+        return (is_http_ready(self._health_url('proxy', proxy_port))
+                and is_http_ready(self._health_url('frontend', frontend_port)))
     
     def _monitor_chrome_windows(self, url: str) -> None:
         """
@@ -501,10 +601,7 @@ class WebAppLauncher:
                 self.logger.error("❌ Avvio server fallito, uscita")
                 return 1
             
-            # Pausa per stabilizzazione
-            time.sleep(2)
-            
-            # Apri browser
+            # Apri browser (i server hanno già risposto agli health check HTTP)
             browser_process = self.launch_browser()
             
             if browser_process:
@@ -515,7 +612,7 @@ class WebAppLauncher:
             else:
                 # Se browser non si apre, mantieni server attivi
                 self.logger.info("⚠️ Browser non avviato, ma server attivi")
-                self.logger.info("📍 Apri manualmente: http://localhost:3000")
+                self.logger.info(f"📍 Apri manualmente: http://localhost:{self.actual_frontend_port}")
                 self.logger.info("🛑 Premi Ctrl+C per terminare")
                 
                 # Attendi indefinitamente